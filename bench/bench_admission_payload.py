@@ -0,0 +1,125 @@
+# benchmark for the /mutate-pod payload handling of large pods: stdlib json + eager
+# pformat + full response dict (old handlers) vs pve_cloud_ctrl.admission (orjson if
+# installed, lazy debug formatting, prebuilt response bytes)
+# usage: python bench/bench_admission_payload.py [containers] [managed_fields] [rounds]
+import base64
+import json
+import logging
+import sys
+import time
+from pprint import pformat
+
+from pve_cloud_ctrl import admission
+
+logger = logging.getLogger("bench")
+logger.setLevel(logging.INFO)
+
+
+def make_review(containers, managed_fields):
+    def container(i):
+        return {
+            "name": f"container-{i}",
+            "image": f"quay.io/org/app-{i}:v1.2.3",
+            "env": [{"name": f"ENV_{j}", "value": "x" * 40} for j in range(40)],
+            "resources": {"limits": {"cpu": "1", "memory": "1Gi"}},
+            "volumeMounts": [
+                {"name": f"vol-{j}", "mountPath": f"/data/{j}"} for j in range(10)
+            ],
+        }
+
+    pod = {
+        "metadata": {
+            "name": "big-pod",
+            "namespace": "default",
+            "labels": {f"label-{i}": f"value-{i}" for i in range(20)},
+            "managedFields": [
+                {
+                    "manager": f"controller-{i}",
+                    "operation": "Update",
+                    "fieldsV1": {f"f:field-{j}": {} for j in range(50)},
+                }
+                for i in range(managed_fields)
+            ],
+        },
+        "spec": {"containers": [container(i) for i in range(containers)]},
+    }
+    return {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "request": {
+            "uid": "705ab4f5-6393-11e8-b7cc-42010a800002",
+            "namespace": "default",
+            "operation": "CREATE",
+            "object": pod,
+        },
+    }
+
+
+PATCH = base64.b64encode(
+    json.dumps(
+        [{"op": "replace", "path": "/spec/containers/0/image", "value": "x"}]
+    ).encode("utf-8")
+).decode("utf-8")
+
+
+def old_handler(body):
+    review = json.loads(body)
+    logger.debug(pformat(review))  # formatted even though debug is off
+    spec = review["request"]["object"]["spec"]
+    images = tuple(container["image"] for container in spec["containers"])
+    response = {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "response": {
+            "uid": review["request"]["uid"],
+            "allowed": True,
+            "patchType": "JSONPatch",
+            "patch": PATCH,
+        },
+    }
+    return images, json.dumps(response).encode("utf-8")
+
+
+def new_handler(body):
+    review = admission.loads(body)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(pformat(review))
+    review_request = review["request"]
+    spec = review_request["object"]["spec"]
+    images = tuple(container["image"] for container in spec["containers"])
+    return images, admission.patched(review_request["uid"], PATCH)
+
+
+def run(fn, body, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(body)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    containers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    managed_fields = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    body = json.dumps(make_review(containers, managed_fields)).encode("utf-8")
+
+    old_images, old_response = old_handler(body)
+    new_images, new_response = new_handler(body)
+    assert old_images == new_images
+    assert json.loads(old_response) == json.loads(new_response)
+
+    old_time = run(old_handler, body, rounds)
+    new_time = run(new_handler, body, rounds)
+
+    parser = "orjson" if admission.orjson is not None else "stdlib json"
+    print(
+        f"review of {len(body) / 1024:.0f} KiB, {containers} containers, {rounds} rounds"
+    )
+    print(f"json + pformat + dict response: {old_time * 1000:.3f}ms per review")
+    print(f"admission ({parser}):  {new_time * 1000:.3f}ms per review")
+    print(f"speedup: {old_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# benchmark for the host policy checks, old fnmatch loops vs the compiled HostMatcher
+# usage: python bench/bench_host_policy.py [num_zones] [num_hosts]
+import fnmatch
+import random
+import sys
+import time
+
+from pve_cloud_ctrl.policy import HostMatcher
+
+
+def fnmatch_allowed(cluster_cert_entries, host):
+    # validate_host_allowed before the matcher
+    allowed = False
+    for entry in cluster_cert_entries:
+        zone = entry["zone"]
+
+        for name in entry["names"]:
+            if fnmatch.fnmatch(host, f"{name}.{zone}"):
+                allowed = True
+                break
+
+        if entry["apex_zone_san"] and zone == host:
+            allowed = True
+
+    return allowed
+
+
+def main():
+    num_zones = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    num_hosts = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    rng = random.Random(42)
+
+    entries = []
+    for i in range(num_zones):
+        names = [f"app{j}" for j in range(5)] + ["*.apps", f"svc-?{i % 10}"]
+        if i % 3 == 0:
+            names.append("*")
+        entries.append(
+            {
+                "zone": f"zone{i}.example.com",
+                "names": names,
+                "apex_zone_san": i % 2 == 0,
+            }
+        )
+
+    hosts = []
+    for i in range(num_hosts):
+        zone = f"zone{rng.randrange(num_zones * 2)}.example.com"
+        hosts.append(
+            rng.choice(
+                [
+                    zone,
+                    f"app{rng.randrange(8)}.{zone}",
+                    f"x{i}.apps.{zone}",
+                    f"svc-a{rng.randrange(10)}.{zone}",
+                    f"deep.name{i}.{zone}",
+                ]
+            )
+        )
+
+    start = time.perf_counter()
+    matcher = HostMatcher(entries, "apex_zone_san")
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    old = [fnmatch_allowed(entries, host) for host in hosts]
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = [matcher.matches(host) for host in hosts]
+    new_time = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(old, new) if a != b)
+
+    print(f"{num_zones} zones, {len(hosts)} hosts, {sum(new)} allowed")
+    print(f"compile:        {compile_time * 1000:.1f}ms")
+    print(f"fnmatch loops:  {old_time:.3f}s ({len(hosts) / old_time:,.0f} hosts/s)")
+    print(f"host matcher:   {new_time:.3f}s ({len(hosts) / new_time:,.0f} hosts/s)")
+    print(f"speedup:        {old_time / new_time:.0f}x")
+    print(f"mismatches:     {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
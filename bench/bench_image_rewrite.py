@@ -0,0 +1,83 @@
+# benchmark for pod image rewrites, the old if/elif get_patched_image vs ImageRewriter
+# usage: python bench/bench_image_rewrite.py [num_refs] [distinct_images]
+import random
+import sys
+import time
+
+from pve_cloud_ctrl.images import DEFAULT_IMAGE_MIRRORS, ImageRewriter
+
+MIRROR = "harbor.example.com"
+
+
+def old_get_patched_image(image):
+    # adm.get_patched_image before the rule engine, without its two info logs
+    if "bitnami/" in image:
+        image = image.replace("bitnami/", "bitnamilegacy/")
+
+    registry = image.split("/")[0]
+    if registry == "quay.io":
+        return f"{MIRROR}/quay-mirror/{image.removeprefix('quay.io/')}"
+    elif registry == "public.ecr.aws":
+        return f"{MIRROR}/aws-ecr-mirror/{image.removeprefix('public.ecr.aws/')}"
+    elif registry == "ghcr.io":
+        return f"{MIRROR}/github-mirror/{image.removeprefix('ghcr.io/')}"
+    elif registry == "docker.io" or "." not in registry:
+        return f"{MIRROR}/docker-hub-mirror/{image.removeprefix('docker.io/')}"
+    return image
+
+
+def make_images(count, rng):
+    templates = [
+        "nginx:1.{i}",
+        "library/redis:7.{i}",
+        "docker.io/bitnami/postgresql:16.{i}",
+        "quay.io/prometheus/node-exporter:v1.{i}.0",
+        "ghcr.io/org/app{i}@sha256:" + "a" * 64,
+        "public.ecr.aws/eks/app{i}:latest",
+        "registry.k8s.io/kube-proxy:v1.{i}",
+        "localhost:5000/dev/app{i}",
+        "myregistry:5000/team/app{i}:1.0",
+    ]
+    return [rng.choice(templates).format(i=i) for i in range(count)]
+
+
+def run(fn, refs):
+    start = time.perf_counter()
+    for ref in refs:
+        fn(ref)
+    return time.perf_counter() - start
+
+
+def main():
+    num_refs = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    rng = random.Random(42)
+    images = make_images(distinct, rng)
+    refs = [rng.choice(images) for _ in range(num_refs)]
+
+    memoized = ImageRewriter(MIRROR, DEFAULT_IMAGE_MIRRORS, memo_size=4096)
+    unmemoized = ImageRewriter(MIRROR, DEFAULT_IMAGE_MIRRORS, memo_size=0)
+
+    old_time = run(old_get_patched_image, refs)
+    cold_time = run(unmemoized._rewrite, refs)
+    memo_time = run(memoized.rewrite, refs)
+
+    # the old split mirrored registries with a port or localhost to docker hub and left
+    # single component images with a dotted tag (nginx:1.25) unmirrored
+    differing = [
+        image
+        for image in images
+        if old_get_patched_image(image) != memoized.rewrite(image)
+    ]
+
+    print(f"{num_refs:,} image refs, {distinct} distinct")
+    print(f"old if/elif:        {old_time:.3f}s ({num_refs / old_time:,.0f} refs/s)")
+    print(f"rewriter, no memo:  {cold_time:.3f}s ({num_refs / cold_time:,.0f} refs/s)")
+    print(f"rewriter, memo:     {memo_time:.3f}s ({num_refs / memo_time:,.0f} refs/s)")
+    print(f"memo: {memoized.rewrite.cache_info()}")
+    print(f"differing results: {len(differing)}, e.g. {differing[:2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# microbenchmark for zone lookups, linear endswith scan (old funcs behaviour) vs ZoneIndex
+# usage: python bench/bench_zone_index.py [num_zones] [num_hosts]
+import random
+import sys
+import time
+
+from pve_cloud_ctrl.zones import ZoneIndex
+
+
+def linear_lookup(zones, host):
+    for zone in zones:
+        if host.endswith(zone):
+            return zone
+    return None
+
+
+def main():
+    num_zones = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    num_hosts = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    rng = random.Random(42)
+    tlds = ["com", "net", "org", "de", "io"]
+
+    zones = []
+    for i in range(num_zones):
+        zone = f"zone{i}.{rng.choice(tlds)}"
+        # every 10th zone gets a delegated sub zone
+        if i % 10 == 0:
+            zones.append(f"sub.{zone}")
+        zones.append(zone)
+
+    # zones that are a plain string suffix but not a label suffix of others (ne1.com vs
+    # zone1.com), listed first like an unordered db result would
+    zones = [
+        f"ne{i}.{zone.rsplit('.', 1)[1]}"
+        for i, zone in enumerate(zones)
+        if zone.startswith("zone") and i % 50 == 0
+    ] + zones
+
+    hosts = []
+    for i in range(num_hosts):
+        zone = rng.choice(zones)
+        hosts.append(f"app{i}.svc.{zone}")
+    # hosts without any authoratative zone, worst case for the linear scan
+    hosts.extend(f"miss{i}.unknown.tld" for i in range(num_hosts // 10))
+
+    index = ZoneIndex((zone, zone) for zone in zones)
+
+    start = time.perf_counter()
+    linear = [linear_lookup(zones, host) for host in hosts]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.lookup(host) for host in hosts]
+    index_time = time.perf_counter() - start
+
+    # linear scan returns the first match in list order, the index the longest match
+    differing = sum(1 for a, b in zip(linear, indexed) if a != (b[0] if b else None))
+
+    print(f"{len(zones)} zones, {len(hosts)} hosts")
+    print(
+        f"linear endswith: {linear_time:.3f}s ({len(hosts) / linear_time:,.0f} lookups/s)"
+    )
+    print(
+        f"zone index:      {index_time:.3f}s ({len(hosts) / index_time:,.0f} lookups/s)"
+    )
+    print(f"speedup:         {linear_time / index_time:.0f}x")
+    print(f"hosts where the linear scan picked a different zone: {differing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# load test for the admission webhooks against local fakes (see fakes.py), requests go
+# through the flask app in process so the numbers leave out tls and gunicorn.
+# requests are sent open loop at --rps, latency is measured from the scheduled send
+# time so a backed up server shows up in the percentiles.
+# usage: python bench/loadtest/adm_load.py --rps 200 --duration 10 [--route ingress-dns]
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakes
+
+ROUTES = ("mutate-pod", "ingress-dns", "delete-namespace")
+
+IMAGES = [
+    "nginx:1.25",
+    "docker.io/bitnami/redis:7.2",
+    "quay.io/prometheus/node-exporter:v1.8.0",
+    "ghcr.io/org/app:latest",
+    "registry.k8s.io/pause:3.9",
+]
+
+
+def review(uid, namespace, operation="CREATE", obj=None, old_obj=None):
+    request = {"uid": uid, "namespace": namespace, "operation": operation}
+    if obj is not None:
+        request["object"] = obj
+    if old_obj is not None:
+        request["oldObject"] = old_obj
+    return {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "request": request,
+    }
+
+
+def pod_payloads(rng, namespaces, count):
+    payloads = []
+    for i in range(count):
+        containers = [
+            {"name": f"c{j}", "image": rng.choice(IMAGES)}
+            for j in range(rng.randint(1, 3))
+        ]
+        pod = {
+            "metadata": {"name": f"pod-{i}", "labels": {"app": f"app-{i % 50}"}},
+            "spec": {"containers": containers},
+        }
+        payloads.append(review(f"pod-{i}", rng.choice(namespaces), obj=pod))
+    return payloads
+
+
+def ingress_payloads(rng, cluster, count):
+    ingresses = [ingress for items in cluster.ingresses.values() for ingress in items]
+    payloads = []
+    for i in range(count):
+        ingress = rng.choice(ingresses)
+        obj = {
+            "metadata": {"name": ingress.metadata.name},
+            "spec": {"rules": [{"host": rule.host} for rule in ingress.spec.rules]},
+        }
+        payloads.append(review(f"ing-{i}", ingress.metadata.namespace, obj=obj))
+    return payloads
+
+
+def namespace_payloads(rng, namespaces, count):
+    return [
+        review(f"ns-{i}", rng.choice(namespaces), operation="DELETE")
+        for i in range(count)
+    ]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def run_load(app, path, payloads, rps, duration, concurrency):
+    total = max(1, int(rps * duration))
+    interval = 1 / rps
+    local = threading.local()
+
+    def send(scheduled, body):
+        test_client = getattr(local, "client", None)
+        if test_client is None:
+            test_client = local.client = app.test_client()
+
+        response = test_client.post(path, data=body, content_type="application/json")
+        latency = time.perf_counter() - scheduled
+
+        allowed = response.status_code == 200 and response.get_json()["response"].get(
+            "allowed", False
+        )
+        return latency, allowed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        futures = []
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, scheduled, payloads[i % len(payloads)]))
+
+        results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    denied = sum(1 for _, allowed in results if not allowed)
+    return {
+        "requests": total,
+        "throughput": total / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p90": percentile(latencies, 0.90),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1],
+        "denied": denied,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--route", choices=ROUTES + ("all",), default="all")
+    parser.add_argument("--rps", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per route")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--namespaces", type=int, default=200)
+    parser.add_argument("--ingresses", type=int, default=3, help="per namespace")
+    parser.add_argument("--hosts", type=int, default=2, help="per ingress")
+    parser.add_argument("--zones", type=int, default=20)
+    parser.add_argument("--k8s-latency-ms", type=float, default=2)
+    parser.add_argument("--dns-latency-ms", type=float, default=2)
+    parser.add_argument("--pg", help="postgres url instead of a sqlite file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--env", action="append", default=[], help="extra KEY=VALUE for the controller"
+    )
+    args = parser.parse_args()
+
+    zones = fakes.zone_names(args.zones)
+    env = fakes.setup(
+        zones,
+        exposed_zones=zones[: args.zones // 2],
+        k8s_latency=args.k8s_latency_ms / 1000,
+        dns_latency=args.dns_latency_ms / 1000,
+        pg_conn_str=args.pg,
+        # the payloads are replayed once a run sends more than 1000 requests, their
+        # uids would be answered from the idempotency cache without any dns write
+        extra_env={
+            "DNS_IDEMPOTENCY_TTL": "0",
+            **dict(item.split("=", 1) for item in args.env),
+        },
+    )
+    fakes.build_cluster(env.cluster, args.namespaces, args.ingresses, args.hosts, zones)
+    env.seed_ext_records()
+
+    # after setup, the modules read the env on import
+    import pve_cloud_ctrl.adm as adm
+
+    rng = random.Random(args.seed)
+    namespaces = [ns for ns in env.cluster.namespaces if ns.startswith("ns-")]
+    payloads = {
+        "mutate-pod": pod_payloads(rng, namespaces, 1000),
+        "ingress-dns": ingress_payloads(rng, env.cluster, 1000),
+        "delete-namespace": namespace_payloads(rng, namespaces, 1000),
+    }
+
+    print(
+        f"{args.namespaces} namespaces, {args.namespaces * args.ingresses} ingresses, "
+        f"{args.zones} zones, k8s {args.k8s_latency_ms}ms, dns {args.dns_latency_ms}ms, "
+        f"{args.rps} rps for {args.duration}s, {args.concurrency} client threads"
+    )
+    print(
+        f"{'route':<18}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}"
+        f"{'p99 ms':>9}{'max ms':>9}{'denied':>8}"
+    )
+
+    routes = ROUTES if args.route == "all" else (args.route,)
+    for route in routes:
+        bodies = [json.dumps(payload) for payload in payloads[route]]
+        result = run_load(
+            adm.app, f"/{route}", bodies, args.rps, args.duration, args.concurrency
+        )
+        print(
+            f"{route:<18}{result['requests']:>9}{result['throughput']:>9.1f}"
+            f"{result['p50'] * 1000:>9.1f}{result['p90'] * 1000:>9.1f}"
+            f"{result['p99'] * 1000:>9.1f}{result['max'] * 1000:>9.1f}{result['denied']:>8}"
+        )
+
+    print(f"k8s api calls: {env.cluster.calls}, bind updates: {env.bind.updates}")
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
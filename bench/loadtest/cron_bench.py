@@ -0,0 +1,84 @@
+# times the cron job against a synthetic cluster on local fakes (see fakes.py). runs the
+# job --runs times, the first run creates every secret copy and dns record, the
+# following ones show the steady state.
+# usage: python bench/loadtest/cron_bench.py --namespaces 2000 --ingresses 2 [--diff]
+import argparse
+import time
+
+import fakes
+
+PHASES = ("load", "ingress_dns", "cluster_tls", "mirror_pull_secret", "total")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--namespaces", type=int, default=2000)
+    parser.add_argument("--ingresses", type=int, default=2, help="per namespace")
+    parser.add_argument("--hosts", type=int, default=2, help="per ingress")
+    parser.add_argument("--zones", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--diff", action="store_true", help="CRON_DNS_RECONCILE=diff")
+    parser.add_argument("--k8s-latency-ms", type=float, default=1)
+    parser.add_argument("--dns-latency-ms", type=float, default=1)
+    parser.add_argument("--pg", help="postgres url instead of a sqlite file")
+    parser.add_argument(
+        "--env", action="append", default=[], help="extra KEY=VALUE for the controller"
+    )
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    if args.diff:
+        extra_env["CRON_DNS_RECONCILE"] = "diff"
+
+    zones = fakes.zone_names(args.zones)
+    env = fakes.setup(
+        zones,
+        exposed_zones=zones[: args.zones // 2],
+        k8s_latency=args.k8s_latency_ms / 1000,
+        dns_latency=args.dns_latency_ms / 1000,
+        pg_conn_str=args.pg,
+        extra_env=extra_env,
+    )
+    fakes.build_cluster(env.cluster, args.namespaces, args.ingresses, args.hosts, zones)
+
+    # after setup, the modules read the env on import
+    from prometheus_client import REGISTRY
+
+    import pve_cloud_ctrl.cron as cron
+    import pve_cloud_ctrl.settings as settings
+
+    hosts = args.namespaces * args.ingresses * args.hosts
+    print(
+        f"{args.namespaces} namespaces, {hosts} hosts in {args.zones} zones, "
+        f"k8s {args.k8s_latency_ms}ms, dns {args.dns_latency_ms}ms, "
+        f"reconcile {'diff' if args.diff else 'replace'}"
+    )
+    print(
+        f"{'run':<5}"
+        + "".join(f"{phase:>20}" for phase in PHASES)
+        + f"{'k8s calls':>11}{'bind updates':>14}"
+    )
+
+    for run in range(args.runs):
+        calls, updates = env.cluster.calls, env.bind.updates
+        start = time.perf_counter()
+        cron.run(settings.get())
+        total = time.perf_counter() - start
+
+        durations = [
+            REGISTRY.get_sample_value(
+                "pve_cloud_ctrl_cron_phase_duration_seconds", {"phase": phase}
+            )
+            for phase in PHASES[:-1]
+        ] + [total]
+        print(
+            f"{run + 1:<5}"
+            + "".join(f"{duration or 0:>19.2f}s" for duration in durations)
+            + f"{env.cluster.calls - calls:>11}{env.bind.updates - updates:>14}"
+        )
+
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+# local stand-ins for the services the controller talks to, used by the load tests:
+# an in memory kubernetes api, a tsig authenticated dns server for the bind updates,
+# moto for route53 and sqlite (or a local postgres) for bind_domains / acme_x509.
+# setup() has to run before any pve_cloud_ctrl module is imported, the modules read
+# the env and build their clients on import.
+import json
+import os
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+import dns.tsigkeyring
+import dns.zone
+from kubernetes import client, config
+from kubernetes.client.rest import ApiException
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+TSIG_KEY = "c2VjcmV0c2VjcmV0c2VjcmV0c2VjcmV0"
+STACK_FQDN = "bench.local"
+INTERNAL_PROXY_FIP = "10.0.0.10"
+EXTERNAL_FORWARDED_IP = "192.0.2.10"
+
+
+class FakeCluster:
+    # namespaces, ingresses and secrets of a synthetic cluster
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.namespaces = {}  # name -> V1Namespace
+        self.ingresses = {}  # namespace -> [V1Ingress]
+        self.secrets = {}  # (namespace, name) -> V1Secret
+        self.calls = 0
+
+    def add_namespace(self, name, phase="Active"):
+        self.namespaces[name] = client.V1Namespace(
+            metadata=client.V1ObjectMeta(name=name),
+            status=client.V1NamespaceStatus(phase=phase),
+        )
+
+    def add_ingress(self, namespace, name, hosts):
+        self.ingresses.setdefault(namespace, []).append(
+            client.V1Ingress(
+                metadata=client.V1ObjectMeta(name=name, namespace=namespace),
+                spec=client.V1IngressSpec(
+                    rules=[client.V1IngressRule(host=host) for host in hosts]
+                ),
+            )
+        )
+
+    def add_secret(self, namespace, name, secret_type, data=None, string_data=None):
+        self.secrets[(namespace, name)] = client.V1Secret(
+            metadata=client.V1ObjectMeta(name=name, namespace=namespace),
+            type=secret_type,
+            data=data,
+            string_data=string_data,
+        )
+
+    def call(self):
+        # every api call pays the configured round trip
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def _page(items, limit, _continue):
+    start = int(_continue or 0)
+    end = start + limit if limit else len(items)
+    next_token = str(end) if end < len(items) else None
+    return items[start:end], client.V1ListMeta(
+        _continue=next_token, resource_version="1"
+    )
+
+
+class FakeCoreV1Api:
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def list_namespace(self, limit=None, _continue=None, **kwargs):
+        self.cluster.call()
+        items, meta = _page(list(self.cluster.namespaces.values()), limit, _continue)
+        return client.V1NamespaceList(items=items, metadata=meta)
+
+    def read_namespaced_secret(self, name, namespace, **kwargs):
+        self.cluster.call()
+        secret = self.cluster.secrets.get((namespace, name))
+        if secret is None:
+            raise ApiException(status=404, reason="Not Found")
+        return secret
+
+    def create_namespaced_secret(self, namespace, body, **kwargs):
+        self.cluster.call()
+        key = (namespace, body.metadata.name)
+        with self.cluster.lock:
+            if key in self.cluster.secrets:
+                raise ApiException(status=409, reason="Conflict")
+            body.metadata.namespace = namespace
+            self.cluster.secrets[key] = body
+        return body
+
+    def patch_namespaced_secret(self, name, namespace, body, **kwargs):
+        self.cluster.call()
+        secret = self.cluster.secrets.get((namespace, name))
+        if secret is None:
+            raise ApiException(status=404, reason="Not Found")
+        secret.metadata.annotations = body["metadata"]["annotations"]
+        secret.data = body.get("data", secret.data)
+        secret.string_data = body.get("stringData", secret.string_data)
+        return secret
+
+    def list_secret_for_all_namespaces(
+        self, field_selector=None, limit=None, _continue=None, **kwargs
+    ):
+        self.cluster.call()
+        name = field_selector.split("=", 1)[1] if field_selector else None
+        secrets = [
+            secret
+            for (_, secret_name), secret in self.cluster.secrets.items()
+            if name is None or secret_name == name
+        ]
+        items, meta = _page(secrets, limit, _continue)
+        return client.V1SecretList(items=items, metadata=meta)
+
+
+class FakeNetworkingV1Api:
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def list_namespaced_ingress(self, namespace, **kwargs):
+        self.cluster.call()
+        return client.V1IngressList(
+            items=list(self.cluster.ingresses.get(namespace, [])),
+            metadata=client.V1ListMeta(),
+        )
+
+    def list_ingress_for_all_namespaces(self, limit=None, _continue=None, **kwargs):
+        self.cluster.call()
+        ingresses = [
+            ingress
+            for namespace_ingresses in self.cluster.ingresses.values()
+            for ingress in namespace_ingresses
+        ]
+        items, meta = _page(ingresses, limit, _continue)
+        return client.V1IngressList(items=items, metadata=meta)
+
+
+class _DnsHandler(socketserver.BaseRequestHandler):
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _send(self, response):
+        wire = response.to_wire()
+        self.request.sendall(struct.pack("!H", len(wire)) + wire)
+
+    def handle(self):
+        server = self.server
+        while True:
+            header = self._read(2)
+            if header is None:
+                return
+            wire = self._read(struct.unpack("!H", header)[0])
+            if wire is None:
+                return
+
+            message = dns.message.from_wire(wire, keyring=server.keyring)
+            response = dns.message.make_response(message)
+
+            if server.latency:
+                time.sleep(server.latency)
+
+            if message.opcode() == dns.opcode.UPDATE:
+                response.set_rcode(server.apply_update(message))
+            elif message.question and message.question[0].rdtype == dns.rdatatype.AXFR:
+                zone = server.zones.get(message.question[0].name)
+                if zone is None:
+                    response.set_rcode(dns.rcode.NOTAUTH)
+                else:
+                    response.answer.extend(server.transfer(zone))
+
+            self._send(response)
+
+
+class FakeBindServer(socketserver.ThreadingTCPServer):
+    # authoritative for the added zones, accepts tsig signed rfc2136 updates and AXFR
+    # over tcp. latency is added to every answer
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, zones, key=TSIG_KEY, latency=0.0):
+        super().__init__(("127.0.0.1", 0), _DnsHandler)
+        self.keyring = dns.tsigkeyring.from_text({"internal.": key})
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.zones = {}
+        for zone in zones:
+            self.add_zone(zone)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_zone(self, name):
+        zone = dns.zone.Zone(name)
+        zone.replace_rdataset(
+            "@", dns.rdataset.from_text("IN", "SOA", 300, "ns. admin. 1 1 1 1 1")
+        )
+        zone.replace_rdataset("@", dns.rdataset.from_text("IN", "NS", 300, "ns."))
+        self.zones[zone.origin] = zone
+
+    def apply_update(self, message):
+        zone = self.zones.get(message.zone[0].name)
+        if zone is None:
+            return dns.rcode.NOTAUTH
+
+        with self.lock:
+            self.updates += 1
+            for rrset in message.update:
+                name = rrset.name.relativize(zone.origin)
+                if rrset.deleting in (dns.rdataclass.ANY, dns.rdataclass.NONE):
+                    zone.delete_rdataset(name, rrset.rdtype)
+                else:
+                    rdataset = zone.find_rdataset(name, rrset.rdtype, create=True)
+                    rdataset.update(rrset)
+        return dns.rcode.NOERROR
+
+    def transfer(self, zone):
+        with self.lock:
+            soa = dns.rrset.from_rdata_list(
+                zone.origin, 300, list(zone.find_rdataset("@", "SOA"))
+            )
+            rrsets = [soa]
+            for name, node in zone.nodes.items():
+                for rdataset in node.rdatasets:
+                    if rdataset.rdtype != dns.rdatatype.SOA:
+                        rrsets.append(
+                            dns.rrset.from_rdata_list(
+                                name.derelativize(zone.origin),
+                                rdataset.ttl,
+                                list(rdataset),
+                            )
+                        )
+            rrsets.append(soa)
+            return rrsets
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kwargs):
+    return "JSON"
+
+
+def setup_db(conn_str, zones, cert):
+    # creates the two tables the controller reads and fills them for our stack
+    from pve_cloud.orm.alchemy import AcmeX509, Base, BindDomains
+
+    engine = create_engine(conn_str)
+    tables = [BindDomains.__table__, AcmeX509.__table__]
+    Base.metadata.drop_all(engine, tables=tables)
+    Base.metadata.create_all(engine, tables=tables)
+
+    with Session(engine) as session:
+        session.add_all(BindDomains(domain=z, stack_fqdn=STACK_FQDN) for z in zones)
+        session.add(AcmeX509(stack_fqdn=STACK_FQDN, k8s=cert))
+        session.commit()
+
+    engine.dispose()
+
+
+def zone_names(count):
+    return [f"zone{i}.bench.example" for i in range(count)]
+
+
+def build_cluster(
+    cluster, namespaces, ingresses_per_namespace, hosts_per_ingress, zones
+):
+    # ns-00000 .. with ingresses whose hosts are spread over the zones
+    for i in range(namespaces):
+        namespace = f"ns-{i:05d}"
+        cluster.add_namespace(namespace)
+        for j in range(ingresses_per_namespace):
+            zone = zones[(i * ingresses_per_namespace + j) % len(zones)]
+            cluster.add_ingress(
+                namespace,
+                f"ing-{j}",
+                [f"h{k}-{j}.{namespace}.{zone}" for k in range(hosts_per_ingress)],
+            )
+
+
+class Environment:
+    # handles to the started fakes
+    def __init__(self, cluster, bind, route53, conf_dir, mock):
+        self.cluster = cluster
+        self.bind = bind
+        self.route53 = route53
+        self.conf_dir = conf_dir
+        self.mock = mock
+
+    def seed_ext_records(self):
+        # route53 records for every ingress host in an exposed zone, the state after a
+        # cron run. moto only accepts a DELETE for a record that was created before
+        zone_ids = {
+            zone["Name"].rstrip("."): zone["Id"]
+            for zone in self.route53.list_hosted_zones()["HostedZones"]
+        }
+        zone_changes = {}
+        for ingresses in self.cluster.ingresses.values():
+            for ingress in ingresses:
+                for rule in ingress.spec.rules:
+                    zone_id = next(
+                        (
+                            zone_id
+                            for zone, zone_id in zone_ids.items()
+                            if rule.host.endswith("." + zone)
+                        ),
+                        None,
+                    )
+                    if zone_id is None:
+                        continue
+                    zone_changes.setdefault(zone_id, []).append(
+                        {
+                            "Action": "UPSERT",
+                            "ResourceRecordSet": {
+                                "Name": rule.host + ".",
+                                "Type": "A",
+                                "TTL": 300,
+                                "ResourceRecords": [{"Value": EXTERNAL_FORWARDED_IP}],
+                            },
+                        }
+                    )
+
+        for zone_id, changes in zone_changes.items():
+            for i in range(0, len(changes), 1000):
+                self.route53.change_resource_record_sets(
+                    HostedZoneId=zone_id, ChangeBatch={"Changes": changes[i : i + 1000]}
+                )
+
+    def close(self):
+        self.bind.shutdown()
+        self.bind.server_close()
+        self.mock.stop()
+
+
+def setup(
+    zones,
+    exposed_zones=(),
+    k8s_latency=0.0,
+    dns_latency=0.0,
+    pg_conn_str=None,
+    extra_env=None,
+):
+    # starts all fakes and points the controller env at them
+    from moto import mock_aws
+
+    conf_dir = tempfile.mkdtemp(prefix="pve-cloud-bench-")
+    with open(os.path.join(conf_dir, "cluster_cert_entries.json"), "w") as f:
+        json.dump(
+            [{"zone": z, "names": ["*"], "apex_zone_san": True} for z in zones], f
+        )
+    with open(os.path.join(conf_dir, "external_domains.json"), "w") as f:
+        json.dump(
+            [{"zone": z, "names": ["*"], "expose_apex": True} for z in exposed_zones], f
+        )
+
+    pg_conn_str = pg_conn_str or f"sqlite:///{os.path.join(conf_dir, 'bench.db')}"
+    setup_db(pg_conn_str, zones, {"tls.crt": "bench-crt", "tls.key": "bench-key"})
+
+    bind = FakeBindServer(zones, latency=dns_latency).start()
+
+    os.environ.update(
+        {
+            "STACK_FQDN": STACK_FQDN,
+            "PG_CONN_STR": pg_conn_str,
+            "CONTROLLER_CONF_DIR": conf_dir,
+            "BIND_DNS_UPDATE_KEY": TSIG_KEY,
+            "BIND_MASTER_IP": "127.0.0.1",
+            "BIND_MASTER_PORT": str(bind.port),
+            "INTERNAL_PROXY_FIP": INTERNAL_PROXY_FIP,
+            "EXTERNAL_FORWARDED_IP": EXTERNAL_FORWARDED_IP,
+            "ROUTE53_ACCESS_KEY_ID": "bench",
+            "ROUTE53_SECRET_ACCESS_KEY": "bench",
+            "ROUTE53_REGION": "us-east-1",
+            "HARBOR_MIRROR_HOST": "harbor.bench.example",
+            "HARBOR_MIRROR_PULL_SECRET_NAME": "mirror-pull-secret",
+            "EXCLUDE_TLS_NAMESPACES": "kube-system",
+            "EXCLUDE_MIRROR_NAMESPACES": "kube-system",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        }
+    )
+    os.environ.update(extra_env or {})
+
+    mock = mock_aws()
+    mock.start()
+
+    import boto3
+
+    route53 = boto3.client("route53", region_name="us-east-1")
+    for i, zone in enumerate(exposed_zones):
+        route53.create_hosted_zone(Name=zone, CallerReference=f"bench-{i}")
+
+    cluster = FakeCluster(latency=k8s_latency)
+    cluster.add_namespace("pve-cloud-controller")
+    cluster.add_secret(
+        "pve-cloud-controller",
+        "mirror-pull-secret",
+        "kubernetes.io/dockerconfigjson",
+        data={".dockerconfigjson": "e30="},
+    )
+
+    config.load_incluster_config = lambda: None
+    client.CoreV1Api = lambda *args: FakeCoreV1Api(cluster)
+    client.NetworkingV1Api = lambda *args: FakeNetworkingV1Api(cluster)
+
+    return Environment(cluster, bind, route53, conf_dir, mock)
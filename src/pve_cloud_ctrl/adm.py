@@ -1,18 +1,33 @@
+import atexit
 import base64
-import json
+import hmac
 import logging
 import os
+import threading
+from functools import lru_cache
 from pprint import pformat
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, g, request
 from kubernetes import client, config
 from kubernetes.client.rest import ApiException
 
+import pve_cloud_ctrl.admission as admission
+import pve_cloud_ctrl.asyncdns as asyncdns
 import pve_cloud_ctrl.funcs as funcs
+import pve_cloud_ctrl.metrics as metrics
+import pve_cloud_ctrl.profiling as profiling
+import pve_cloud_ctrl.settings as settings
+import pve_cloud_ctrl.tracing as tracing
+from pve_cloud_ctrl.cache import TTLCache, TTLSet, singleton
+from pve_cloud_ctrl.dnsqueue import DnsWorkQueue
+from pve_cloud_ctrl.images import load_image_rewriter
+from pve_cloud_ctrl.server import serve
 
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
 logger = logging.getLogger("cloud-adm")
 
+settings.validate("adm")
+
 app = Flask(__name__)
 
 config.load_incluster_config()
@@ -20,387 +35,447 @@ v1 = client.CoreV1Api()
 net_v1 = client.NetworkingV1Api()
 
 
-def get_patched_image(image):
-    patch_registry = os.getenv("HARBOR_MIRROR_HOST")
-
-    # bitnami legacy rewrite
-    if "bitnami/" in image:
-        image = image.replace("bitnami/", "bitnamilegacy/")
-
-    registry = image.split("/")[0]
-    if registry == "quay.io":
-        patched_image = f"{patch_registry}/quay-mirror/{image.removeprefix('quay.io/')}"
-    elif registry == "public.ecr.aws":
-        patched_image = (
-            f"{patch_registry}/aws-ecr-mirror/{image.removeprefix('public.ecr.aws/')}"
-        )
-    elif registry == "ghcr.io":
-        patched_image = (
-            f"{patch_registry}/github-mirror/{image.removeprefix('ghcr.io/')}"
-        )
-    elif (
-        registry == "docker.io" or "." not in registry
-    ):  # default docker hub registry . not in means its path
-        # default docker.io
-        patched_image = (
-            f"{patch_registry}/docker-hub-mirror/{image.removeprefix('docker.io/')}"
+@app.before_request
+def start_trace():
+    g.trace_token = tracing.start_trace(f"{request.method} {request.path}")
+
+
+@app.teardown_request
+def end_trace(exc):
+    # also runs for requests that raised
+    if "trace_token" not in g:
+        return
+
+    trace = tracing.end_trace(g.trace_token)
+    elapsed = trace.elapsed()
+
+    if request.url_rule is not None:  # unknown paths are not recorded
+        metrics.request_duration.labels(request.url_rule.rule).observe(elapsed)
+
+    if (
+        elapsed >= settings.get().slow_request_seconds
+        and request.endpoint != "debug_profile"  # slow by design
+    ):
+        logger.warning(f"slow request {trace.format()}")
+
+
+@app.route("/metrics", methods=["GET"])
+def serve_metrics():
+    payload, content_type = metrics.render()
+    return Response(payload, content_type=content_type)
+
+
+profile_lock = threading.Lock()
+
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    # samples the stacks of all threads for ?seconds= (max 60), returns collapsed
+    # stacks for flamegraphs. only served with DEBUG_PROFILE_TOKEN set and the token
+    # passed as bearer
+    token = settings.get().debug_profile_token
+    if not token:
+        abort(404)
+
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {token}".encode()):
+        abort(403)
+
+    seconds = min(request.args.get("seconds", 10, type=float), 60)
+    interval = max(request.args.get("interval", 0.005, type=float), 0.001)
+
+    # one profile at a time, the sampler holds the gil a lot
+    if not profile_lock.acquire(blocking=False):
+        abort(409)
+    try:
+        logger.info(f"profiling for {seconds}s")
+        stacks = profiling.sample_stacks(seconds, interval)
+    finally:
+        profile_lock.release()
+
+    return Response(stacks, content_type="text/plain")
+
+
+def load_mirror_pull_secret():
+    # source secret in the cloud controller namespace
+    with metrics.upstream("kubernetes", "read_secret"):
+        return v1.read_namespaced_secret(
+            settings.get().harbor_mirror_pull_secret_name, "pve-cloud-controller"
         )
-    else:
-        patched_image = image
 
-    logger.info("orig image: " + image)
-    logger.info("patched image: " + patched_image)
 
-    return patched_image
+mirror_pull_secret_cache = TTLCache(
+    "mirror-pull-secret",
+    load_mirror_pull_secret,
+    ttl=int(os.getenv("MIRROR_SECRET_CACHE_TTL", "300")),
+)
 
+# namespaces known to hold the pull secret, no apiserver call for their pods
+pull_secret_namespaces = TTLSet(int(os.getenv("PULL_SECRET_CACHE_TTL", "600")))
 
-@app.route("/mutate-pod", methods=["POST"])
-def mutate_pod():
-    admission_review = request.get_json()
+metrics.register_cache("mirror-pull-secret", mirror_pull_secret_cache.stats)
+metrics.register_cache("pull-secret-namespaces", pull_secret_namespaces.stats)
 
-    uid = admission_review["request"]["uid"]
-    pod_spec = admission_review["request"]["object"]
-    namespace = admission_review["request"]["namespace"]
 
-    # need this to exclude the harbor namespace / system namespaces
-    exclude_namespace = False
-    if os.getenv("EXCLUDE_MIRROR_NAMESPACES"):
-        if namespace in os.getenv("EXCLUDE_MIRROR_NAMESPACES").split(","):
-            logger.debug("exluding namespace")
-            exclude_namespace = True
+def ensure_mirror_pull_secret(namespace, secret_name):
+    if namespace in pull_secret_namespaces:
+        return
 
-    logger.debug(pformat(admission_review))
+    try:
+        # check if the secret exists
+        with metrics.upstream("kubernetes", "read_secret"):
+            v1.read_namespaced_secret(secret_name, namespace)
+        logger.debug("secret exists")
+    except ApiException as e:
+        if e.status != 404:
+            raise
 
-    # pods only get patched to the mirror repository if its actually defined
-    if (
-        os.getenv("HARBOR_MIRROR_HOST")
-        and os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME")
-        and not exclude_namespace
-    ):
+        # secret doesnt exist yet, create it from the cached controller copy
+        secret = client.V1Secret(
+            metadata=client.V1ObjectMeta(name=secret_name),
+            type="kubernetes.io/dockerconfigjson",
+            data=mirror_pull_secret_cache.get().data,
+        )
         try:
-            # check if the secret exists
-            mirror_pull_secret = v1.read_namespaced_secret(
-                os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME"), namespace
-            )
-            logger.debug("secret exists")
+            with metrics.upstream("kubernetes", "create_secret"):
+                v1.create_namespaced_secret(namespace=namespace, body=secret)
+            logger.info("created mps")
         except ApiException as e:
-            if e.status == 404:  # secret doesnt exist yet, create it
-                # read secret from cloud controller namespace
-                mps_controller = v1.read_namespaced_secret(
-                    os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME"), "pve-cloud-controller"
-                )
+            if e.status != 409:  # created by a parallel admission
+                raise
 
-                secret = client.V1Secret(
-                    metadata=client.V1ObjectMeta(
-                        name=os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME")
-                    ),
-                    type="kubernetes.io/dockerconfigjson",
-                    data=mps_controller.data,
-                )
-                v1.create_namespaced_secret(namespace=namespace, body=secret)
-                logger.info("created mps")
+    pull_secret_namespaces.add(namespace)
 
-        # patch the pods images to point to our harbor mirror
-        patches = []
-
-        patched_image = False
-
-        if "initContainers" in pod_spec["spec"]:
-            # preprend harbor.vmz.management/mirror repo
-            for i, container in enumerate(pod_spec["spec"]["initContainers"]):
-                image = container["image"]
-                image_patched = get_patched_image(image)
-
-                if image != image_patched:
-                    patches.append(
-                        {
-                            "op": "replace",
-                            "path": f"/spec/initContainers/{i}/image",
-                            "value": image_patched,
-                        }
-                    )
-                    patched_image = True
-
-        # normal containers
-        for i, container in enumerate(pod_spec["spec"]["containers"]):
-            image = container["image"]
+
+# registry -> mirror mapping, compiled once from the controller conf
+image_rewriter = load_image_rewriter(
+    settings.get().controller_conf_dir, settings.get().harbor_mirror_host
+)
+
+
+def get_patched_image(image):
+    return image_rewriter.rewrite(image)
+
+
+@lru_cache(maxsize=int(os.getenv("IMAGE_PATCH_CACHE_SIZE", "1024")))
+def build_image_patch(init_images, images, has_pull_secrets, secret_name):
+    # base64 encoded JSONPatch for a pods container images or None, pods with the same
+    # image set (replicas of a deployment) reuse the patch
+    patches = []
+
+    # preprend harbor.vmz.management/mirror repo
+    for kind, kind_images in (("initContainers", init_images), ("containers", images)):
+        for i, image in enumerate(kind_images):
             image_patched = get_patched_image(image)
 
             if image != image_patched:
+                logger.debug(f"patched image {image} -> {image_patched}")
                 patches.append(
                     {
                         "op": "replace",
-                        "path": f"/spec/containers/{i}/image",
+                        "path": f"/spec/{kind}/{i}/image",
                         "value": image_patched,
                     }
                 )
-                patched_image = True
 
-        # add / create image pull secrets
-        if patched_image:
-            if "imagePullSecrets" in pod_spec["spec"]:
-                patches.append(
-                    {
-                        "op": "add",
-                        "path": "/spec/imagePullSecrets/-",
-                        "value": {"name": os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME")},
-                    }
-                )
-            else:
-                patches.append(
-                    {
-                        "op": "add",
-                        "path": "/spec/imagePullSecrets",
-                        "value": [
-                            {"name": os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME")}
-                        ],
-                    }
-                )
+    if not patches:
+        return None
 
-        if patches:
-            response = {
-                "apiVersion": "admission.k8s.io/v1",
-                "kind": "AdmissionReview",
-                "response": {
-                    "uid": uid,
-                    "allowed": True,
-                    "patchType": "JSONPatch",
-                    "patch": base64.b64encode(
-                        json.dumps(patches).encode("utf-8")
-                    ).decode("utf-8"),
-                },
+    # add / create image pull secrets
+    if has_pull_secrets:
+        patches.append(
+            {
+                "op": "add",
+                "path": "/spec/imagePullSecrets/-",
+                "value": {"name": secret_name},
+            }
+        )
+    else:
+        patches.append(
+            {
+                "op": "add",
+                "path": "/spec/imagePullSecrets",
+                "value": [{"name": secret_name}],
             }
+        )
 
-            return jsonify(response)
+    return base64.b64encode(admission.dumps(patches)).decode("ascii")
 
-    # fallback
-    response = {
-        "apiVersion": "admission.k8s.io/v1",
-        "kind": "AdmissionReview",
-        "response": {
-            "uid": uid,
-            "allowed": True,  # Allow the request without modifications
-        },
-    }
 
-    return jsonify(response)
+metrics.register_lru_cache("image-rewrite", image_rewriter.rewrite)
+metrics.register_lru_cache("image-patch", build_image_patch)
 
 
-@app.route("/ingress-dns", methods=["POST"])
-def ingress_dns():
+def review_response(body):
+    return Response(body, mimetype="application/json")
 
-    admission_review = request.get_json()
 
-    uid = admission_review["request"]["uid"]
+def debug_review(admission_review):
+    # pformat of a full pod spec is expensive, only done if it is logged
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(pformat(admission_review))
 
-    if (
-        os.getenv("BIND_DNS_UPDATE_KEY")
-        and os.getenv("BIND_MASTER_IP")
-        and os.getenv("INTERNAL_PROXY_FIP")
-    ):
 
-        logger.debug(pformat(admission_review))
+@app.route("/mutate-pod", methods=["POST"])
+def mutate_pod():
+    admission_review = admission.loads(request.get_data())
 
-        # get all zones that our cloud bind is authoratative for
-        bind_domains = funcs.get_bind_domains()
-
-        ext_domains = funcs.get_ext_domains()  # might be none
-
-        if admission_review["request"]["operation"] == "CREATE":
-            # iterate ingress hosts and make dns updates for zones bind is authoratative for
-            for rule in admission_review["request"]["object"]["spec"]["rules"]:
-                host = rule["host"]
-
-                errors = []
-                errors.extend(funcs.set_ingress_dyn_dns(bind_domains, host))
-                errors.extend(funcs.set_ingress_ext_dyn_dns(ext_domains, host))
-
-                if errors:
-                    response = {
-                        "apiVersion": "admission.k8s.io/v1",
-                        "kind": "AdmissionReview",
-                        "response": {
-                            "uid": uid,
-                            "allowed": False,  # dont allow ingress submit since ingress dns failed
-                            "status": {
-                                "status": "Failure",
-                                "message": ", ".join(errors),
-                                "reason": "InternalError",
-                                "code": 500,  # todo: better error codes on deny
-                            },
-                        },
-                    }
-                    # return immediatly on error
-                    return jsonify(response)
-        elif admission_review["request"]["operation"] == "UPDATE":
-            # rules in old object that changed / arent present in current object need to be deleted
-            new_hosts = set(
-                rule["host"]
-                for rule in admission_review["request"]["object"]["spec"]["rules"]
-            )
+    review_request = admission_review["request"]
+    uid = review_request["uid"]
+    namespace = review_request["namespace"]
+
+    conf = settings.get()
+
+    # need this to exclude the harbor namespace / system namespaces
+    exclude_namespace = namespace in conf.exclude_mirror_namespaces
+    if exclude_namespace:
+        logger.debug("exluding namespace")
 
-            delete_hosts = set(
-                rule["host"]
-                for rule in admission_review["request"]["oldObject"]["spec"]["rules"]
-                if rule["host"] not in new_hosts
+    debug_review(admission_review)
+
+    # pods only get patched to the mirror repository if its actually defined
+    if conf.mirror_enabled and not exclude_namespace:
+        with tracing.span("mirror_pull_secret"):
+            ensure_mirror_pull_secret(namespace, conf.harbor_mirror_pull_secret_name)
+
+        # patch the pods images to point to our harbor mirror
+        spec = review_request["object"]["spec"]
+        with tracing.span("image_patch"):
+            patch = build_image_patch(
+                tuple(
+                    container["image"] for container in spec.get("initContainers") or []
+                ),
+                tuple(container["image"] for container in spec["containers"]),
+                "imagePullSecrets" in spec,
+                conf.harbor_mirror_pull_secret_name,
             )
 
-            for host in delete_hosts:
-                errors = []
-
-                errors.extend(funcs.delete_ingress_dyn_dns(bind_domains, host))
-                errors.extend(funcs.delete_ingress_ext_dyn_dns(ext_domains, host))
-
-                if errors:
-                    response = {
-                        "apiVersion": "admission.k8s.io/v1",
-                        "kind": "AdmissionReview",
-                        "response": {
-                            "uid": uid,
-                            "allowed": False,  # dont allow ingress submit since ingress dns failed
-                            "status": {
-                                "status": "Failure",
-                                "message": ", ".join(errors),
-                                "reason": "InternalError",
-                                "code": 500,  # todo: better error codes on deny
-                            },
-                        },
-                    }
-                    # return immediatly on error
-                    return jsonify(response)
-
-            # update / insert new ones
-            for host in new_hosts:
-                errors = []
-                errors.extend(funcs.set_ingress_dyn_dns(bind_domains, host))
-                errors.extend(funcs.set_ingress_ext_dyn_dns(ext_domains, host))
-
-                if errors:
-                    response = {
-                        "apiVersion": "admission.k8s.io/v1",
-                        "kind": "AdmissionReview",
-                        "response": {
-                            "uid": uid,
-                            "allowed": False,  # dont allow ingress submit since ingress dns failed
-                            "status": {
-                                "status": "Failure",
-                                "message": ", ".join(errors),
-                                "reason": "InternalError",
-                                "code": 500,  # todo: better error codes on deny
-                            },
-                        },
-                    }
-                    # return immediatly on error
-                    return jsonify(response)
-
-        elif admission_review["request"]["operation"] == "DELETE":
-            for rule in admission_review["request"]["oldObject"]["spec"]["rules"]:
-                host = rule["host"]
-
-                errors = []
-
-                errors.extend(funcs.delete_ingress_dyn_dns(bind_domains, host))
-                errors.extend(funcs.delete_ingress_ext_dyn_dns(ext_domains, host))
-
-                if errors:
-                    response = {
-                        "apiVersion": "admission.k8s.io/v1",
-                        "kind": "AdmissionReview",
-                        "response": {
-                            "uid": uid,
-                            "allowed": False,  # dont allow ingress submit since ingress dns failed
-                            "status": {
-                                "status": "Failure",
-                                "message": ", ".join(errors),
-                                "reason": "InternalError",
-                                "code": 500,  # todo: better error codes on deny
-                            },
-                        },
-                    }
-                    # return immediatly on error
-                    return jsonify(response)
+        if patch:
+            return review_response(admission.patched(uid, patch))
+
+    # fallback, allow the request without modifications
+    return review_response(admission.allowed(uid))
 
+
+def apply_ingress_dns(conf, set_hosts=(), delete_hosts=(), max_workers=1):
+    # a host outside the cluster cert denies the whole ingress, so nothing is written
+    # for it. only the cron writes the allowed hosts and collects the errors
+    with tracing.span("host_policy"):
+        _, errors = funcs.filter_allowed_hosts(set_hosts)
+    if errors:
+        return errors
+
+    # zones that our cloud bind is authoratative for, route53 zones might be none
+    bind_domains = funcs.get_bind_domains()
+    ext_domains = funcs.get_ext_domains()
+
+    if conf.dns_async_pipeline:
+        # bind and route53 updates of all zones at once
+        return asyncdns.apply_ingress_dns(
+            bind_domains,
+            ext_domains,
+            set_hosts,
+            delete_hosts,
+            max_concurrency=conf.dns_concurrency,
+        )
+
+    return funcs.apply_ingress_dns(
+        bind_domains,
+        ext_domains,
+        set_hosts=set_hosts,
+        delete_hosts=delete_hosts,
+        max_workers=max_workers,
+    )
+
+
+def apply_ingress_dns_around_queue(conf, set_hosts=(), delete_hosts=(), max_workers=1):
+    # synchronous writes go around the queue, a queued change of the same host (a
+    # namespace cleanup, a retrying async ingress write) must not land after ours
+    dns_queue = get_dns_queue()
+    dropped, in_flight = dns_queue.discard(list(set_hosts) + list(delete_hosts))
+
+    errors = apply_ingress_dns(conf, set_hosts, delete_hosts, max_workers)
+    if errors:
+        # the request is denied, the dropped changes are still due
+        dns_queue.enqueue(
+            set_hosts=[host for host, action in dropped.items() if action == "set"],
+            delete_hosts=[
+                host for host, action in dropped.items() if action == "delete"
+            ],
+        )
+    elif in_flight:
+        # a change being applied right now can land after our write, repeat ours
+        # behind it
+        dns_queue.enqueue(
+            set_hosts=[host for host in set_hosts if host in in_flight],
+            delete_hosts=[host for host in delete_hosts if host in in_flight],
+        )
+
+    return errors
+
+
+def apply_queued_dns(set_hosts, delete_hosts):
+    return apply_ingress_dns(settings.get(), set_hosts, delete_hosts)
+
+
+@singleton
+def get_dns_queue():
+    dns_queue = DnsWorkQueue(
+        "ingress-dns",
+        apply_queued_dns,
+        rate=float(os.getenv("DNS_QUEUE_RATE", "50")),
+        burst=int(os.getenv("DNS_QUEUE_BURST", "100")),
+        batch_size=int(os.getenv("DNS_QUEUE_BATCH_SIZE", "100")),
+        max_retries=int(os.getenv("DNS_QUEUE_MAX_RETRIES", "8")),
+    )
+    metrics.register_queue("ingress-dns", dns_queue.__len__)
+    # flush what is left when the worker exits (gunicorn graceful shutdown)
+    atexit.register(dns_queue.drain)
+    return dns_queue
+
+
+# uids of admission reviews whose dns writes were applied within the last
+# DNS_IDEMPOTENCY_TTL seconds. the apiserver retries a review with the same uid (webhook
+# timeout, lost response), those are allowed without writing the records again. the set
+# is per process, a retry served by another worker / replica just writes again
+handled_reviews = TTLSet(int(os.getenv("DNS_IDEMPOTENCY_TTL", "30")))
+metrics.register_cache("dns-idempotency", handled_reviews.stats)
+
+
+def record_handled_review(uid):
+    if handled_reviews.ttl > 0:
+        handled_reviews.add(uid)
+
+
+def ingress_hosts(ingress):
+    return [
+        rule["host"] for rule in ingress["spec"].get("rules") or [] if rule.get("host")
+    ]
+
+
+def dns_failure_response(uid, errors):
+    # dont allow ingress submit since ingress dns failed
+    # todo: better error codes on deny
+    return review_response(admission.denied(uid, ", ".join(errors)))
+
+
+@app.route("/ingress-dns", methods=["POST"])
+def ingress_dns():
+
+    admission_review = admission.loads(request.get_data())
+
+    review_request = admission_review["request"]
+    uid = review_request["uid"]
+
+    conf = settings.get()
+
+    if conf.bind_enabled:
+
+        debug_review(admission_review)
+
+        operation = review_request["operation"]
+
+        if operation == "CREATE":
+            set_hosts = ingress_hosts(review_request["object"])
+            delete_hosts = []
+        elif operation == "UPDATE":
+            # only the hosts that were added / removed, label / annotation / status
+            # updates and re-applies of the same rules dont touch dns
+            new_hosts = ingress_hosts(review_request["object"])
+            old_hosts = ingress_hosts(review_request["oldObject"])
+            set_hosts = [host for host in new_hosts if host not in old_hosts]
+            delete_hosts = [host for host in old_hosts if host not in new_hosts]
+        elif operation == "DELETE":
+            set_hosts = []
+            delete_hosts = ingress_hosts(review_request["oldObject"])
         else:
-            raise Exception(
-                f"Operation {admission_review['request']['operation']} not implemented!"
-            )
+            raise Exception(f"Operation {operation} not implemented!")
+
+        if not (set_hosts or delete_hosts) or uid in handled_reviews:
+            return review_response(admission.allowed(uid))
+
+        if conf.ingress_dns_async:
+            # only the host policy is checked in the request, the dns writes are
+            # done by the queue worker
+            with tracing.span("host_policy"):
+                set_hosts, errors = funcs.filter_allowed_hosts(set_hosts)
+            if not errors:
+                get_dns_queue().enqueue(set_hosts, delete_hosts)
+        else:
+            # all hosts of the ingress are sent batched, one dns update per zone
+            errors = apply_ingress_dns_around_queue(conf, set_hosts, delete_hosts)
+            if not errors:
+                record_handled_review(uid)
 
-    response = {
-        "apiVersion": "admission.k8s.io/v1",
-        "kind": "AdmissionReview",
-        "response": {
-            "uid": uid,
-            "allowed": True,  # Allow the request without modifications
-        },
-    }
+        if errors:
+            return dns_failure_response(uid, errors)
 
-    return jsonify(response)
+    # Allow the request without modifications
+    return review_response(admission.allowed(uid))
 
 
 @app.route("/delete-namespace", methods=["POST"])
 def delete_namespace():
 
-    admission_review = request.get_json()
+    admission_review = admission.loads(request.get_data())
 
-    logger.debug(pformat(admission_review))
+    debug_review(admission_review)
 
     uid = admission_review["request"]["uid"]
 
     namespace = admission_review["request"]["namespace"]
 
-    # get all zones that our cloud bind is authoratative for
-    bind_domains = funcs.get_bind_domains()
-
-    ext_domains = funcs.get_ext_domains()  # might be none
-
-    ingresses = net_v1.list_namespaced_ingress(namespace=namespace)
-
-    for ingress in ingresses.items:
-        if ingress.spec.rules:
-            for rule in ingress.spec.rules:
-                host = rule.host
-
-                errors = []
-                errors.extend(funcs.set_ingress_dyn_dns(bind_domains, host))
-                errors.extend(funcs.set_ingress_ext_dyn_dns(ext_domains, host))
-                if errors:
-                    response = {
-                        "apiVersion": "admission.k8s.io/v1",
-                        "kind": "AdmissionReview",
-                        "response": {
-                            "uid": uid,
-                            "allowed": False,  # dont allow ingress submit since ingress dns failed
-                            "status": {
-                                "status": "Failure",
-                                "message": ", ".join(errors),
-                                "reason": "InternalError",
-                                "code": 500,  # todo: better error codes on deny
-                            },
-                        },
-                    }
-
-                    # return immediatly on error
-                    return jsonify(response)
-
-    response = {
-        "apiVersion": "admission.k8s.io/v1",
-        "kind": "AdmissionReview",
-        "response": {
-            "uid": uid,
-            "allowed": True,  # Allow the request without modifications
-        },
-    }
+    # a recreated namespace wont have the pull secret anymore
+    pull_secret_namespaces.discard(namespace)
+
+    conf = settings.get()
+
+    if conf.bind_enabled:
+        with metrics.upstream("kubernetes", "list_ingresses"):
+            with tracing.span("list_ingresses"):
+                ingresses = net_v1.list_namespaced_ingress(namespace=namespace)
+
+        hosts = [
+            rule.host
+            for ingress in ingresses.items
+            if ingress.spec.rules
+            for rule in ingress.spec.rules
+            if rule.host
+        ]
+
+        if hosts and conf.namespace_dns_async:
+            # the queue worker deletes the records, the namespace deletion doesnt
+            # wait on bind / route53 no matter how many ingresses it has. deletes
+            # dropped by the queue are only cleaned up by a pruning diff cron
+            get_dns_queue().enqueue(delete_hosts=hosts)
+            logger.info(
+                f"queued dns cleanup of {len(hosts)} hosts in namespace {namespace}"
+            )
+        elif hosts and uid not in handled_reviews:
+            # deleted in the request, one update per zone with the zones sent
+            # concurrently
+            errors = apply_ingress_dns_around_queue(
+                conf, delete_hosts=hosts, max_workers=conf.namespace_dns_workers
+            )
+            if errors:
+                return dns_failure_response(uid, errors)
+            record_handled_review(uid)
 
-    return jsonify(response)
+    # Allow the request without modifications
+    return review_response(admission.allowed(uid))
 
 
 def main():
-    # todo: change to gunicorn / multi threaded
-    app.run(
-        host="0.0.0.0",
-        port=443,
-        ssl_context=(
-            "/etc/tls/tls.crt",  # Path to TLS certificate
-            "/etc/tls/tls.key",  # Path to TLS private key
-        ),
-    )
+    # werkzeug dev server, single threaded. only meant for local debugging
+    if os.getenv("ADM_DEV_SERVER"):
+        app.run(
+            host="0.0.0.0",
+            port=443,
+            ssl_context=(
+                os.getenv("TLS_CERT_FILE", "/etc/tls/tls.crt"),
+                os.getenv("TLS_KEY_FILE", "/etc/tls/tls.key"),
+            ),
+        )
+        return
+
+    serve(app)
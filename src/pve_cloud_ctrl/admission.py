@@ -0,0 +1,47 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json otherwise
+    orjson = None
+
+# AdmissionReview parsing and responses without flask's json layer. requests are parsed
+# and responses serialized with orjson if installed, the fixed parts of the responses
+# are prebuilt bytes and only the uid (and patch) are filled in
+
+
+if orjson is not None:
+    loads = orjson.loads
+    dumps = orjson.dumps
+else:
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+_RESPONSE_HEAD = (
+    b'{"apiVersion":"admission.k8s.io/v1","kind":"AdmissionReview","response":{"uid":'
+)
+_ALLOWED_TAIL = b',"allowed":true}}'
+_PATCH_HEAD = b',"allowed":true,"patchType":"JSONPatch","patch":"'
+
+
+def allowed(uid):
+    return _RESPONSE_HEAD + dumps(uid) + _ALLOWED_TAIL
+
+
+def patched(uid, patch):
+    # patch is the base64 encoded JSONPatch, base64 needs no json escaping
+    return _RESPONSE_HEAD + dumps(uid) + _PATCH_HEAD + patch.encode("ascii") + b'"}}'
+
+
+def denied(uid, message, reason="InternalError", code=500):
+    status = {"status": "Failure", "message": message, "reason": reason, "code": code}
+    return (
+        _RESPONSE_HEAD
+        + dumps(uid)
+        + b',"allowed":false,"status":'
+        + dumps(status)
+        + b"}}"
+    )
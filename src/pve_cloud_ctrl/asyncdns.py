@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import threading
+
+import dns.exception
+
+import pve_cloud_ctrl.funcs as funcs
+import pve_cloud_ctrl.metrics as metrics
+import pve_cloud_ctrl.tracing as tracing
+from pve_cloud_ctrl.cache import singleton
+from pve_cloud_ctrl.dnsclient import AsyncBindUpdateClient
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-asyncdns")
+
+
+@singleton
+def get_loop():
+    # one event loop thread per process, started on first use so it lives in the
+    # serving gunicorn worker and not the master
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="dns-pipeline", daemon=True).start()
+    return loop
+
+
+@singleton
+def get_bind_client():
+    # only used on the pipeline loop, its connections belong to that loop
+    return AsyncBindUpdateClient(**funcs.bind_client_options())
+
+
+async def send_bind_zone_update(zone, records):
+    bind_client = get_bind_client()
+    dns_update = funcs.make_bind_zone_update(bind_client, zone, records)
+    hosts = ", ".join(host for _, host in records)
+
+    try:
+        with metrics.upstream("bind", "update"):
+            response = await bind_client.send(dns_update)
+    except (OSError, EOFError, dns.exception.DNSException) as e:
+        logger.warning(f"internal dns update for zone {zone} failed: {e}")
+        return [f"Error internal dns update {e!r} for hosts {hosts}"]
+
+    return funcs.bind_response_errors(response, hosts)
+
+
+async def submit_ext_zone(zone_id, changes):
+    # boto has no asyncio api, the batches run on the default executor and still go
+    # through the process wide route53 writer (rate limit, per zone coalescing)
+    return await asyncio.to_thread(funcs.submit_ext_zone, zone_id, changes)
+
+
+async def apply_ingress_dns_async(
+    bind_domains, ext_domains, set_hosts=(), delete_hosts=(), max_concurrency=16
+):
+    # like funcs.apply_ingress_dns, but the bind zone updates and route53 batches of all
+    # zones run at the same time (at most max_concurrency) instead of bind first and
+    # route53 after. returns the same list of errors
+    set_hosts, delete_hosts, errors = funcs.prepare_ingress_dns(set_hosts, delete_hosts)
+
+    limit = asyncio.Semaphore(max_concurrency)
+
+    async def limited(fn, zone, items):
+        async with limit:
+            with tracing.span(fn.__name__, zone=zone):
+                return await fn(zone, items)
+
+    jobs = [
+        limited(send_bind_zone_update, zone, records)
+        for zone, records in funcs.bind_zone_updates(
+            bind_domains, set_hosts, delete_hosts
+        ).items()
+    ]
+    if ext_domains is not None:
+        jobs.extend(
+            limited(submit_ext_zone, zone_id, changes)
+            for zone_id, changes in funcs.ext_zone_changes(
+                ext_domains, set_hosts, delete_hosts
+            ).items()
+        )
+
+    for zone_errors in await asyncio.gather(*jobs):
+        errors.extend(zone_errors)
+
+    return errors
+
+
+def apply_ingress_dns(
+    bind_domains, ext_domains, set_hosts=(), delete_hosts=(), max_concurrency=16
+):
+    # blocking entry point for request threads, the queue worker and the cron. the
+    # coroutine runs on the pipeline loop in a copy of the callers context, so its
+    # spans land in the request trace
+    return asyncio.run_coroutine_threadsafe(
+        apply_ingress_dns_async(
+            bind_domains, ext_domains, set_hosts, delete_hosts, max_concurrency
+        ),
+        get_loop(),
+    ).result()
@@ -0,0 +1,171 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-cache")
+
+
+def singleton(factory):
+    # lazy process wide instance like functools.cache, but the factory runs once even
+    # when request threads race on the first call (cache would build two queues /
+    # writers / loops and hand out both)
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
+
+
+class TTLCache:
+    # holds a single loaded value. within ttl the value is returned as is, after ttl the
+    # stale value is still returned while one background thread reloads it (stale while
+    # revalidate). past max_stale or after invalidate() the caller loads synchronously.
+    def __init__(self, name, loader, ttl, max_stale=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.max_stale = max_stale if max_stale is not None else ttl * 10
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._value = None
+        self._loaded_at = None
+        self._refreshing = False
+        self._generation = 0
+
+        # gets answered from memory (fresh or stale) / by a synchronous load
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        with self._lock:
+            generation = self._generation
+
+        value = self.loader()
+
+        with self._lock:
+            # dont let a load that started before invalidate() overwrite newer state
+            if generation == self._generation:
+                self._value = value
+                self._loaded_at = time.monotonic()
+        return value
+
+    def _background_refresh(self):
+        try:
+            self._load()
+            logger.debug(f"refreshed cache {self.name}")
+        except Exception as e:
+            # keep serving the stale value, next get past ttl retries
+            logger.warning(f"background refresh of cache {self.name} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        with self._lock:
+            loaded_at = self._loaded_at
+            value = self._value
+
+            if loaded_at is not None:
+                age = time.monotonic() - loaded_at
+                if age < self.ttl:
+                    self.hits += 1
+                    return value
+
+                if age < self.ttl + self.max_stale:
+                    self.hits += 1
+                    if not self._refreshing:
+                        self._refreshing = True
+                        threading.Thread(
+                            target=self._background_refresh, daemon=True
+                        ).start()
+                    return value
+
+        # nothing loaded yet or too stale to serve, only one caller loads
+        with self._load_lock:
+            with self._lock:
+                if (
+                    self._loaded_at is not None
+                    and time.monotonic() - self._loaded_at < self.ttl
+                ):
+                    self.hits += 1
+                    return self._value
+                self.misses += 1
+
+            return self._load()
+
+    def refresh(self):
+        return self._load()
+
+    def stats(self):
+        return self.hits, self.misses
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._value = None
+            self._loaded_at = None
+
+
+class TTLSet:
+    # set of keys that each expire ttl seconds after they were added. all keys share the
+    # ttl, so the dict is ordered by expiry and add() drops the expired ones from the
+    # front, keys that are never looked up again (review uids) dont pile up
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._expires = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, key):
+        with self._lock:
+            now = time.monotonic()
+            while self._expires:
+                oldest = next(iter(self._expires))
+                if self._expires[oldest] >= now:
+                    break
+                del self._expires[oldest]
+
+            # re-added keys move to the back to keep the order
+            self._expires.pop(key, None)
+            self._expires[key] = now + self.ttl
+
+    def __len__(self):
+        with self._lock:
+            return len(self._expires)
+
+    def discard(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is None:
+                self.misses += 1
+                return False
+            if expires < time.monotonic():
+                del self._expires[key]
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._expires.clear()
+
+    def stats(self):
+        return self.hits, self.misses
@@ -1,159 +1,209 @@
 import logging
 import os
+import time
 
 from kubernetes import client, config
-from kubernetes.client.rest import ApiException
-from pve_cloud.orm.alchemy import AcmeX509
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session
 
+import pve_cloud_ctrl.asyncdns as asyncdns
+import pve_cloud_ctrl.db as db
 import pve_cloud_ctrl.funcs as funcs
+import pve_cloud_ctrl.metrics as metrics
+import pve_cloud_ctrl.settings as settings
+from pve_cloud_ctrl.fanout import fan_out_secret
+from pve_cloud_ctrl.shards import ShardRing
 
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
 logger = logging.getLogger("cloud-cron")
 
 
-def main():
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
-    net_v1 = client.NetworkingV1Api()
+def active_namespaces(namespaces, excluded, shard=None):
+    # shard is a (ShardRing, index) pair, namespaces of other shards are left to the
+    # cron runs of those
+    names = []
+    for ns in namespaces.items:
+        if shard is not None and not shard[0].owns(shard[1], ns.metadata.name):
+            continue
 
-    # todo: check if defined => otherwise warning and close
-    engine = create_engine(os.getenv("PG_CONN_STR"))
+        if ns.metadata.name in excluded:
+            logger.debug(f"excluded {ns.metadata.name}")
+            continue
 
-    bind_domains = None
+        if ns.status.phase != "Active":
+            logger.info(
+                f"skipping namespace {ns.metadata.name} (status={ns.status.phase})"
+            )
+            continue
 
-    # select bind domains for ingress dns reapply
-    if (
-        os.getenv("BIND_DNS_UPDATE_KEY")
-        and os.getenv("BIND_MASTER_IP")
-        and os.getenv("INTERNAL_PROXY_FIP")
-    ):
-        bind_domains = funcs.get_bind_domains()
+        names.append(ns.metadata.name)
 
-    ext_domains = funcs.get_ext_domains()  # might be none
+    return names
 
-    # update certs and mirror pull secret
-    with Session(engine) as session:
-        stmt = select(AcmeX509).where(AcmeX509.stack_fqdn == os.getenv("STACK_FQDN"))
-        cert = session.scalars(stmt).first()
 
-    if not cert:
-        logger.info(f"No certificate found for {os.getenv('STACK_FQDN')}")
-    else:
-        logger.info("crt found")
-        logger.info(cert.k8s)
+def list_all_ingresses(net_v1):
+    ingresses = []
+    _continue = None
+    while True:
+        with metrics.upstream("kubernetes", "list_ingresses"):
+            page = net_v1.list_ingress_for_all_namespaces(
+                limit=settings.get().cron_list_page_size, _continue=_continue
+            )
+        ingresses.extend(page.items)
 
-    namespaces = v1.list_namespace()
+        _continue = page.metadata._continue
+        if not _continue:
+            return ingresses
 
-    # apply ingress dns for all namespaces
-    for ns in namespaces.items:
-        logger.info(f"processing ingress {ns.metadata.name}")
 
-        if ns.status.phase != "Active":
-            logger.info(
-                f"skipping namespace {ns.metadata.name} (status={ns.status.phase})"
-            )
+def reapply_ingress_dns(net_v1, namespaces, bind_domains, ext_domains, shard=None):
+    start = time.monotonic()
+
+    active = set(active_namespaces(namespaces, excluded=(), shard=shard))
+
+    hosts = {}  # dict keeps order while deduplicating
+    for ingress in list_all_ingresses(net_v1):
+        if ingress.metadata.namespace not in active:
             continue
 
-        # reapply ingress dns
-        if (
-            os.getenv("BIND_DNS_UPDATE_KEY")
-            and os.getenv("BIND_MASTER_IP")
-            and os.getenv("INTERNAL_PROXY_FIP")
-        ):
+        logger.debug(f"{ingress.metadata.namespace}/{ingress.metadata.name}")
+
+        if ingress.spec.rules:
+            hosts.update((rule.host, None) for rule in ingress.spec.rules if rule.host)
+
+    conf = settings.get()
+    max_workers = conf.cron_dns_workers
+
+    if conf.cron_dns_diff:
+        # read the zones and only write what differs from the ingresses
+        errors = funcs.reconcile_ingress_dns(
+            bind_domains,
+            ext_domains,
+            hosts,
+            # a shard only knows the hosts of its own namespaces
+            prune=conf.cron_dns_prune and conf.shard_count == 1,
+            max_workers=max_workers,
+        )
+    elif conf.dns_async_pipeline:
+        errors = asyncdns.apply_ingress_dns(
+            bind_domains, ext_domains, hosts, max_concurrency=conf.dns_concurrency
+        )
+    else:
+        errors = funcs.apply_ingress_dns(
+            bind_domains, ext_domains, set_hosts=hosts, max_workers=max_workers
+        )
 
-            ingresses = net_v1.list_namespaced_ingress(namespace=ns.metadata.name)
+    elapsed = time.monotonic() - start
+    logger.info(
+        f"ingress dns: {len(hosts)} hosts in {len(active)} namespaces, "
+        f"{len(errors)} errors, {elapsed:.2f}s ({len(hosts) / max(elapsed, 1e-6):.1f} hosts/s)"
+    )
+    for error in errors:
+        logger.error(error)
 
-            for ingress in ingresses.items:
-                logger.info(ingress.metadata.name)
+    return errors
 
-                if ingress.spec.rules:
-                    for rule in ingress.spec.rules:
-                        host = rule.host
 
-                        errors = []
-                        errors.extend(funcs.set_ingress_dyn_dns(bind_domains, host))
-                        errors.extend(funcs.set_ingress_ext_dyn_dns(ext_domains, host))
-                        if errors:
-                            raise Exception(", ".join(errors))
+def run(conf):
+    config.load_incluster_config()
+    v1 = client.CoreV1Api()
+    net_v1 = client.NetworkingV1Api()
 
-    # only cert and mirror is filtered
-    for ns in namespaces.items:
-        # here we only want to exclude the defualt namespaces, even if we dont want to apply mirroring
-        # we still want to apply tls
-        if ns.metadata.name in os.getenv("EXCLUDE_TLS_NAMESPACES").split(","):
-            logger.debug(f"excluded {ns.metadata.name}")
-            continue
+    with metrics.cron_phase("load"):
+        bind_domains = None
 
-        if ns.status.phase != "Active":
-            logger.info(
-                f"skipping namespace {ns.metadata.name} (status={ns.status.phase})"
+        # select bind domains for ingress dns reapply
+        if conf.bind_enabled:
+            bind_domains = funcs.get_bind_domains()
+
+        ext_domains = funcs.get_ext_domains()  # might be none
+
+        # update certs and mirror pull secret
+        cert = db.load_cluster_cert()
+
+        if not cert:
+            logger.info(f"No certificate found for {conf.stack_fqdn}")
+        else:
+            logger.info("crt found")
+            logger.info(cert.k8s)
+
+        with metrics.upstream("kubernetes", "list_namespaces"):
+            namespaces = v1.list_namespace()
+
+    shard = None
+    if conf.shard_count > 1:
+        shard = (ShardRing(conf.shard_count), conf.shard_index)
+        logger.info(f"reconciling shard {conf.shard_index} of {conf.shard_count}")
+
+    dns_errors = []
+
+    # reapply ingress dns for all active namespaces, one cluster wide ingress list,
+    # deduplicated hosts and the per zone batches pushed in parallel
+    if conf.bind_enabled:
+        with metrics.cron_phase("ingress_dns"):
+            dns_errors = reapply_ingress_dns(
+                net_v1, namespaces, bind_domains, ext_domains, shard
             )
-            continue
 
-        logger.info(f"processing certs {ns.metadata.name}")
-        if cert:
-            try:
-                # patch the cluster tls secret - this will always be a patch since its default functionality of pve cloud
-                pr = v1.patch_namespaced_secret(
-                    name="cluster-tls",
-                    namespace=ns.metadata.name,
-                    body={"stringData": cert.k8s},
-                )
-                logger.info("patched")
-                logger.info(pr)
-            except ApiException as e:
-                # incase it doesnt exist try to create it
-                if e.status == 404:
-                    v1.create_namespaced_secret(
-                        namespace=ns.metadata.name,
-                        body=client.V1Secret(
-                            metadata=client.V1ObjectMeta(name="cluster-tls"),
-                            type="kubernetes.io/tls",
-                            string_data=cert.k8s,
-                        ),
-                    )
-                else:
-                    raise
+    max_workers = conf.cron_secret_workers
+    secret_errors = []
 
     # only cert and mirror is filtered
-    for ns in namespaces.items:
+    if cert:
         # here we only want to exclude the defualt namespaces, even if we dont want to apply mirroring
         # we still want to apply tls
-        if ns.metadata.name in os.getenv("EXCLUDE_MIRROR_NAMESPACES").split(","):
-            logger.debug(f"excluded {ns.metadata.name}")
-            continue
-
-        if ns.status.phase != "Active":
-            logger.info(
-                f"skipping namespace {ns.metadata.name} (status={ns.status.phase})"
+        with metrics.cron_phase("cluster_tls"):
+            tls_namespaces = active_namespaces(
+                namespaces, conf.exclude_tls_namespaces, shard
+            )
+            secret_errors.extend(
+                fan_out_secret(
+                    v1,
+                    "cluster-tls",
+                    "kubernetes.io/tls",
+                    tls_namespaces,
+                    string_data=cert.k8s,
+                    max_workers=max_workers,
+                )
             )
-            continue
 
-        # update or create mirror pull secret - might have been toggled on retroactively
-        if os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME"):
-            mirror_pull_secret = v1.read_namespaced_secret(
-                os.getenv("HARBOR_MIRROR_PULL_SECRET_NAME"), "pve-cloud-controller"
+    # update or create mirror pull secret - might have been toggled on retroactively
+    if conf.harbor_mirror_pull_secret_name:
+        with metrics.cron_phase("mirror_pull_secret"):
+            # source is read once for all namespaces
+            with metrics.upstream("kubernetes", "read_secret"):
+                mirror_pull_secret = v1.read_namespaced_secret(
+                    conf.harbor_mirror_pull_secret_name, "pve-cloud-controller"
+                )
+
+            mirror_namespaces = active_namespaces(
+                namespaces, conf.exclude_mirror_namespaces, shard
             )
-            logger.info("mps")
-            logger.info(mirror_pull_secret)
-
-            try:
-                v1.create_namespaced_secret(
-                    namespace=ns.metadata.name,
-                    body=client.V1Secret(
-                        metadata=client.V1ObjectMeta(name="mirror-pull-secret"),
-                        type="kubernetes.io/dockerconfigjson",
-                        data=mirror_pull_secret.data,
-                    ),
+            secret_errors.extend(
+                fan_out_secret(
+                    v1,
+                    "mirror-pull-secret",
+                    "kubernetes.io/dockerconfigjson",
+                    mirror_namespaces,
+                    data=mirror_pull_secret.data,
+                    max_workers=max_workers,
                 )
-            except ApiException as e:
-                if e.status == 409:  # conflict => update the secret
-                    v1.patch_namespaced_secret(
-                        "mirror-pull-secret",
-                        namespace=ns.metadata.name,
-                        body={"data": mirror_pull_secret.data},
-                    )
-                else:
-                    raise
+            )
+
+    for error in secret_errors:
+        logger.error(error)
+
+    # dns errors dont stop the tls and mirror passes, fail the job at the end
+    errors = dns_errors + secret_errors
+    if errors:
+        raise Exception(f"{len(errors)} errors: " + ", ".join(errors))
+
+
+def main():
+    conf = settings.validate("cron")
+
+    metrics.start_metrics_server()
+    try:
+        with metrics.cron_phase("total"):
+            run(conf)
+    finally:
+        # the job is usually gone before a scrape, push the results if configured
+        metrics.push_metrics("pve-cloud-controller-cron")
@@ -0,0 +1,65 @@
+import logging
+import os
+
+from pve_cloud.orm.alchemy import AcmeX509, BindDomains
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import pve_cloud_ctrl.metrics as metrics
+import pve_cloud_ctrl.settings as settings
+from pve_cloud_ctrl.cache import TTLCache, singleton
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-db")
+
+
+@singleton
+def get_engine():
+    # one pooled engine per process shared by adm, cron and watcher. connections are
+    # pinged before use (postgres restarts, idle timeouts) and every statement is capped
+    conn_str = settings.get().pg_conn_str
+
+    kwargs = {}
+    if conn_str.startswith("postgresql"):
+        kwargs = {
+            "pool_size": int(os.getenv("PG_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("PG_MAX_OVERFLOW", "5")),
+            "pool_timeout": int(os.getenv("PG_POOL_TIMEOUT", "10")),
+            "pool_recycle": int(os.getenv("PG_POOL_RECYCLE", "1800")),
+            "connect_args": {
+                "connect_timeout": int(os.getenv("PG_CONNECT_TIMEOUT", "5")),
+                "options": f"-c statement_timeout={os.getenv('PG_STATEMENT_TIMEOUT_MS', '5000')}",
+            },
+        }
+
+    return create_engine(conn_str, pool_pre_ping=True, **kwargs)
+
+
+def session():
+    # objects stay readable after the session closes, they are cached across requests
+    return Session(get_engine(), expire_on_commit=False)
+
+
+def load_bind_domains():
+    with metrics.upstream("postgres", "bind_domains"), session() as s:
+        return s.execute(select(BindDomains)).scalars().all()
+
+
+def load_cluster_cert():
+    # the AcmeX509 row of our stack or None
+    with metrics.upstream("postgres", "cluster_cert"), session() as s:
+        stmt = select(AcmeX509).where(AcmeX509.stack_fqdn == settings.get().stack_fqdn)
+        return s.scalars(stmt).first()
+
+
+cluster_cert_cache = TTLCache(
+    "cluster-cert",
+    load_cluster_cert,
+    ttl=int(os.getenv("CLUSTER_CERT_CACHE_TTL", "60")),
+    max_stale=int(os.getenv("CLUSTER_CERT_CACHE_MAX_STALE", "3600")),
+)
+metrics.register_cache("cluster-cert", cluster_cert_cache.stats)
+
+
+def get_cluster_cert():
+    return cluster_cert_cache.get()
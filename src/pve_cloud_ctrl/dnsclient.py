@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+import dns.asyncbackend
+import dns.asyncquery
+import dns.exception
+import dns.inet
+import dns.name
+import dns.query
+import dns.tsigkeyring
+import dns.update
+import dns.xfr
+import dns.zone
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-dnsclient")
+
+
+class BindUpdateClient:
+    # sends tsig signed rfc2136 updates to the bind master over a small pool of kept
+    # alive tcp connections. the keyring is parsed once, idle connections are checked
+    # before reuse and replaced if bind closed them (tcp-idle-timeout).
+    def __init__(
+        self,
+        host,
+        key,
+        port=53,
+        keyname="internal.",
+        keyalgorithm="hmac-sha256",
+        pool_size=4,
+        timeout=5.0,
+        idle_timeout=20.0,
+    ):
+        self.host = host
+        self.port = port
+        self.keyname = keyname
+        self.keyalgorithm = keyalgorithm
+        self.keyring = dns.tsigkeyring.from_text({keyname: key})
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._idle = deque()  # (socket, last used monotonic)
+
+    def make_update(self, zone):
+        return dns.update.Update(
+            zone,
+            keyring=self.keyring,
+            keyname=self.keyname,
+            keyalgorithm=self.keyalgorithm,
+        )
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _healthy(sock):
+        # an idle dns connection never has anything to read, readable means eof / reset
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _checkout(self):
+        # returns (socket, reused)
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                sock, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout and self._healthy(sock):
+                    return sock, True
+                sock.close()
+
+        return self._connect(), False
+
+    def _checkin(self, sock):
+        with self._lock:
+            self._idle.append((sock, time.monotonic()))
+
+    def send(self, update):
+        with self._slots:
+            sock, reused = self._checkout()
+            try:
+                response = dns.query.tcp(
+                    update, self.host, timeout=self.timeout, port=self.port, sock=sock
+                )
+            except (OSError, EOFError, dns.exception.DNSException) as e:
+                sock.close()
+                if not reused or isinstance(e, dns.exception.Timeout):
+                    raise
+
+                # bind closed the kept alive connection between the health check and
+                # the send, updates are idempotent so retry once on a fresh connection
+                logger.debug(f"reused bind connection failed ({e}), reconnecting")
+                sock = self._connect()
+                try:
+                    response = dns.query.tcp(
+                        update,
+                        self.host,
+                        timeout=self.timeout,
+                        port=self.port,
+                        sock=sock,
+                    )
+                except BaseException:
+                    sock.close()
+                    raise
+            except BaseException:
+                sock.close()
+                raise
+
+            self._checkin(sock)
+            return response
+
+    def transfer_zone(self, zone, lifetime=60.0):
+        # full zone transfer (AXFR) signed with the update key, bind needs to allow
+        # transfers for the key. uses its own connection, transfers are rare
+        zone_obj = dns.zone.Zone(zone)
+        query, _ = dns.xfr.make_query(
+            zone_obj,
+            keyring=self.keyring,
+            keyname=dns.name.from_text(self.keyname),
+            keyalgorithm=self.keyalgorithm,
+        )
+        dns.query.inbound_xfr(
+            self.host,
+            zone_obj,
+            query,
+            port=self.port,
+            timeout=self.timeout,
+            lifetime=lifetime,
+        )
+        return zone_obj
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+
+class AsyncBindUpdateClient:
+    # asyncio counterpart of BindUpdateClient built on dns.asyncquery, for the async dns
+    # pipeline. the pool belongs to the event loop it is first used on. idle connections
+    # cant be probed without reading, a reused connection that fails is retried once on
+    # a fresh one instead
+    def __init__(
+        self,
+        host,
+        key,
+        port=53,
+        keyname="internal.",
+        keyalgorithm="hmac-sha256",
+        pool_size=4,
+        timeout=5.0,
+        idle_timeout=20.0,
+    ):
+        self.host = host
+        self.port = port
+        self.keyname = keyname
+        self.keyalgorithm = keyalgorithm
+        self.keyring = dns.tsigkeyring.from_text({keyname: key})
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        self.backend = dns.asyncbackend.get_backend("asyncio")
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle = deque()  # (stream socket, last used monotonic)
+
+    def make_update(self, zone):
+        return dns.update.Update(
+            zone,
+            keyring=self.keyring,
+            keyname=self.keyname,
+            keyalgorithm=self.keyalgorithm,
+        )
+
+    async def _connect(self):
+        return await self.backend.make_socket(
+            dns.inet.af_for_address(self.host),
+            socket.SOCK_STREAM,
+            destination=(self.host, self.port),
+            timeout=self.timeout,
+        )
+
+    async def _checkout(self):
+        # returns (socket, reused)
+        now = time.monotonic()
+        while self._idle:
+            sock, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout:
+                return sock, True
+            await sock.close()
+
+        return await self._connect(), False
+
+    async def _query(self, update, sock):
+        return await dns.asyncquery.tcp(
+            update, self.host, timeout=self.timeout, port=self.port, sock=sock
+        )
+
+    async def send(self, update):
+        async with self._slots:
+            sock, reused = await self._checkout()
+            try:
+                response = await self._query(update, sock)
+            except (OSError, EOFError, dns.exception.DNSException) as e:
+                await sock.close()
+                if not reused or isinstance(e, dns.exception.Timeout):
+                    raise
+
+                logger.debug(f"reused bind connection failed ({e}), reconnecting")
+                sock = await self._connect()
+                try:
+                    response = await self._query(update, sock)
+                except BaseException:
+                    await sock.close()
+                    raise
+            except BaseException:
+                await sock.close()
+                raise
+
+            self._idle.append((sock, time.monotonic()))
+            return response
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop()[0].close()
@@ -0,0 +1,172 @@
+import logging
+import os
+import random
+import threading
+import time
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-dnsqueue")
+
+
+class DnsWorkQueue:
+    # pending ingress dns changes keyed by host, a newer change for a host replaces the
+    # queued one. a background thread drains the queue in batches through
+    # apply(set_hosts, delete_hosts) -> errors, limited to rate hosts per second (token
+    # bucket). batches with errors are retried with jittered exponential backoff.
+    def __init__(
+        self,
+        name,
+        apply,
+        rate=50.0,
+        burst=100,
+        batch_size=100,
+        max_retries=8,
+        base_backoff=1.0,
+        max_backoff=300.0,
+    ):
+        self.name = name
+        self.apply = apply
+        self.rate = rate
+        self.burst = burst
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._pending = {}  # host -> (action, attempt, not before monotonic)
+        self._in_flight = set()  # hosts of the batch being applied
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def enqueue(self, set_hosts=(), delete_hosts=()):
+        with self._cond:
+            for host in delete_hosts:
+                self._pending[host] = ("delete", 0, 0)
+            for host in set_hosts:
+                self._pending[host] = ("set", 0, 0)
+
+            # started lazily so the thread lives in the serving process, not a
+            # gunicorn master that forks the workers
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+
+    def discard(self, hosts):
+        # drops the pending changes of hosts that are written around the queue. returns
+        # (dropped host -> action, hosts whose change is being applied right now), the
+        # caller has to queue its own change for the latter so it lands after the
+        # running one
+        with self._cond:
+            dropped = {}
+            for host in hosts:
+                item = self._pending.pop(host, None)
+                if item is not None:
+                    dropped[host] = item[0]
+            return dropped, [host for host in hosts if host in self._in_flight]
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled_at) * self.rate
+        )
+        self._refilled_at = now
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                ready = [
+                    host
+                    for host, (_, _, not_before) in self._pending.items()
+                    if not_before <= now
+                ]
+
+                if ready and self._tokens >= 1:
+                    size = min(len(ready), self.batch_size, int(self._tokens))
+                    self._tokens -= size
+                    self._in_flight.update(ready[:size])
+                    return {host: self._pending.pop(host) for host in ready[:size]}
+
+                if ready:
+                    timeout = (1 - self._tokens) / self.rate
+                elif self._pending:
+                    timeout = min(nb for _, _, nb in self._pending.values()) - now
+                else:
+                    timeout = None
+
+                self._cond.wait(timeout)
+
+    def _process(self, batch):
+        set_hosts = [host for host, item in batch.items() if item[0] == "set"]
+        delete_hosts = [host for host, item in batch.items() if item[0] == "delete"]
+
+        try:
+            errors = self.apply(set_hosts, delete_hosts)
+        except Exception as e:
+            errors = [f"{e!r}"]
+
+        if not errors:
+            logger.info(
+                f"{self.name}: applied {len(set_hosts)} sets, {len(delete_hosts)} deletes"
+            )
+            with self._cond:
+                self._in_flight.difference_update(batch)
+            return
+
+        for error in errors:
+            logger.warning(f"{self.name}: {error}")
+
+        # the changes are idempotent, the whole batch is retried
+        now = time.monotonic()
+        with self._cond:
+            self._in_flight.difference_update(batch)
+            for host, (action, attempt, _) in batch.items():
+                if host in self._pending:
+                    continue  # a newer change was queued meanwhile
+
+                if attempt >= self.max_retries:
+                    logger.error(
+                        f"[!] {self.name}: giving up on {action} {host} after {attempt + 1} attempts"
+                    )
+                    continue
+
+                delay = min(self.max_backoff, self.base_backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                self._pending[host] = (action, attempt + 1, now + delay)
+
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            self._process(self._next_batch())
+
+    def drain(self, timeout=10.0):
+        # best effort flush of everything still pending, ignores rate limit and backoff.
+        # used on shutdown. the cron reapplies dropped sets, dropped deletes are only
+        # cleaned up with CRON_DNS_RECONCILE=diff and CRON_DNS_PRUNE
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self._pending:
+                    return
+                hosts = list(self._pending)[: self.batch_size]
+                batch = {host: self._pending.pop(host) for host in hosts}
+
+            set_hosts = [host for host, item in batch.items() if item[0] == "set"]
+            delete_hosts = [host for host, item in batch.items() if item[0] == "delete"]
+            try:
+                for error in self.apply(set_hosts, delete_hosts):
+                    logger.warning(f"{self.name}: {error}")
+            except Exception as e:
+                logger.warning(f"{self.name}: drain failed: {e!r}")
+
+        logger.warning(f"{self.name}: {len(self)} changes left undrained")
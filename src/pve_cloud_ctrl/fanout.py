@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+import pve_cloud_ctrl.metrics as metrics
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-fanout")
+
+HASH_ANNOTATION = "pve-cloud-controller/content-hash"
+
+
+def content_hash(payload):
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def list_secret_hashes(v1, name):
+    # namespace -> content hash annotation (None if missing) of all copies of the secret,
+    # one paged cluster wide list instead of a read per namespace
+    hashes = {}
+    _continue = None
+    while True:
+        with metrics.upstream("kubernetes", "list_secrets"):
+            page = v1.list_secret_for_all_namespaces(
+                field_selector=f"metadata.name={name}", limit=500, _continue=_continue
+            )
+        for secret in page.items:
+            annotations = secret.metadata.annotations or {}
+            hashes[secret.metadata.namespace] = annotations.get(HASH_ANNOTATION)
+
+        _continue = page.metadata._continue
+        if not _continue:
+            return hashes
+
+
+def fan_out_secret(
+    v1, name, secret_type, namespaces, data=None, string_data=None, max_workers=8
+):
+    # makes sure secret name holds data / string_data in all namespaces. copies whose
+    # hash annotation already matches are skipped, the rest is created or patched on a
+    # bounded thread pool. returns the list of errors
+    payload_hash = content_hash({"data": data, "stringData": string_data})
+    existing = list_secret_hashes(v1, name)
+
+    def patch(namespace):
+        body = {"metadata": {"annotations": {HASH_ANNOTATION: payload_hash}}}
+        if data is not None:
+            body["data"] = data
+        if string_data is not None:
+            body["stringData"] = string_data
+
+        with metrics.upstream("kubernetes", "patch_secret"):
+            v1.patch_namespaced_secret(name, namespace=namespace, body=body)
+        logger.info(f"patched {name} in {namespace}")
+
+    def create(namespace):
+        body = client.V1Secret(
+            metadata=client.V1ObjectMeta(
+                name=name, annotations={HASH_ANNOTATION: payload_hash}
+            ),
+            type=secret_type,
+            data=data,
+            string_data=string_data,
+        )
+        with metrics.upstream("kubernetes", "create_secret"):
+            v1.create_namespaced_secret(namespace=namespace, body=body)
+        logger.info(f"created {name} in {namespace}")
+
+    def apply(namespace):
+        first, fallback = (patch, create) if namespace in existing else (create, patch)
+        try:
+            try:
+                first(namespace)
+            except ApiException as e:
+                # created / deleted by the watcher or adm since we listed
+                if e.status not in (404, 409):
+                    raise
+                fallback(namespace)
+            return None
+        except ApiException as e:
+            return f"Error applying {name} in {namespace}: {e.status} {e.reason}"
+
+    outdated = [ns for ns in namespaces if existing.get(ns) != payload_hash]
+    logger.info(
+        f"{name}: {len(namespaces) - len(outdated)} namespaces up to date, "
+        f"{len(outdated)} to apply"
+    )
+
+    if not outdated:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(outdated))) as pool:
+        return [error for error in pool.map(apply, outdated) if error]
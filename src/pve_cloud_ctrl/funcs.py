@@ -1,17 +1,23 @@
-import fnmatch
-import json
+import contextvars
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
-import dns.query
+import dns.exception
 import dns.rcode
-import dns.tsigkeyring
-import dns.update
-from botocore.exceptions import ClientError
-from pve_cloud.orm.alchemy import BindDomains
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session
+import dns.rdatatype
+from botocore.exceptions import BotoCoreError, ClientError
+
+import pve_cloud_ctrl.db as db
+import pve_cloud_ctrl.metrics as metrics
+import pve_cloud_ctrl.settings as settings
+import pve_cloud_ctrl.tracing as tracing
+from pve_cloud_ctrl.cache import TTLCache, singleton
+from pve_cloud_ctrl.dnsclient import BindUpdateClient
+from pve_cloud_ctrl.policy import HostPolicy
+from pve_cloud_ctrl.route53 import Route53Writer
+from pve_cloud_ctrl.zones import ZoneIndex
 
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
 logger = logging.getLogger("cloud-funcs")
@@ -41,58 +47,89 @@ if route53_key_id and route53_secret_key:
         )
 
 
-# load the cluster cert conf
-with open("/etc/controller-conf/cluster_cert_entries.json", "r") as f:
-    cluster_cert_entries = json.load(f)
+# changes per route53 ChangeBatch, the api allows 1000 records per request
+ROUTE53_MAX_CHANGES = int(os.getenv("ROUTE53_MAX_CHANGES", "500"))
 
-# load externally exposed domains
-with open("/etc/controller-conf/external_domains.json", "r") as f:
-    external_domains = json.load(f)
+
+# cluster cert and externally exposed domains, reloaded when the configmap changes
+host_policy = HostPolicy(
+    settings.get().controller_conf_dir,
+    int(os.getenv("CONTROLLER_CONF_CHECK_INTERVAL", "10")),
+)
 
 
 def validate_host_allowed(host):
-    allowed = False
-    for entry in cluster_cert_entries:
-        zone = entry["zone"]
+    return host_policy.host_allowed(host)
+
 
-        for name in entry["names"]:
-            if fnmatch.fnmatch(host, f"{name}.{zone}"):
-                allowed = True
-                break
+def host_exposed(host):
+    return host_policy.host_exposed(host)
 
-        if entry["apex_zone_san"] and zone == host:
-            # if there was an apex san created it covers a host that equals the zone
-            allowed = True
 
-    # return errors
-    return allowed
+def bind_client_options():
+    conf = settings.get()
+    return {
+        "host": conf.bind_master_ip,
+        "key": conf.bind_dns_update_key,
+        "port": int(os.getenv("BIND_MASTER_PORT", "53")),
+        "pool_size": int(os.getenv("BIND_POOL_SIZE", "4")),
+        "timeout": float(os.getenv("BIND_TIMEOUT", "5")),
+        "idle_timeout": float(os.getenv("BIND_IDLE_TIMEOUT", "20")),
+    }
 
 
-def host_exposed(host):
-    exposed = False
-    for entry in external_domains:
-        zone = entry["zone"]
+@singleton
+def get_bind_client():
+    # shared by all request threads, keeps tcp connections to the bind master open
+    return BindUpdateClient(**bind_client_options())
 
-        for name in entry["names"]:
-            if fnmatch.fnmatch(host, f"{name}.{zone}"):
-                exposed = True
-                break
 
-        if entry["expose_apex"] and zone == host:
-            # if there was an apex san created it covers a host that equals the zone
-            exposed = True
+def load_bind_domains():
+    domains = db.load_bind_domains()
+
+    logger.debug([domain.domain for domain in domains])
+    return ZoneIndex((domain.domain, domain.domain) for domain in domains)
+
 
-    return exposed
+bind_domains_cache = TTLCache(
+    "bind-domains",
+    load_bind_domains,
+    ttl=int(os.getenv("BIND_DOMAINS_CACHE_TTL", "60")),
+    max_stale=int(os.getenv("BIND_DOMAINS_CACHE_MAX_STALE", "600")),
+)
+metrics.register_cache("bind-domains", bind_domains_cache.stats)
 
 
 def get_bind_domains():
-    engine = create_engine(os.getenv("PG_CONN_STR"))
-    with Session(engine) as session:
-        stmt = select(BindDomains)
-        domains = session.execute(stmt).scalars().all()
+    with tracing.span("get_bind_domains"):
+        return bind_domains_cache.get()
 
-    logger.debug([domain.domain for domain in domains])
-    return domains
+
+def invalidate_bind_domains():
+    bind_domains_cache.invalidate()
+
+
+def load_ext_domains():
+    # only implemented for route53 at the moment, list_hosted_zones returns max 100 per page
+    hosted_zones = []
+    paginator = boto_client.get_paginator("list_hosted_zones")
+    with metrics.upstream("route53", "list_hosted_zones"):
+        for page in paginator.paginate():
+            hosted_zones.extend(page["HostedZones"])
+
+    logger.debug(f"num hosted zones found {len(hosted_zones)}")
+
+    # boto domains are fully quantified, the index strips the trailing dot for matching
+    return ZoneIndex((zone["Name"], zone["Id"]) for zone in hosted_zones)
+
+
+ext_domains_cache = TTLCache(
+    "ext-domains",
+    load_ext_domains,
+    ttl=int(os.getenv("EXT_DOMAINS_CACHE_TTL", "300")),
+    max_stale=int(os.getenv("EXT_DOMAINS_CACHE_MAX_STALE", "3600")),
+)
+metrics.register_cache("ext-domains", ext_domains_cache.stats)
 
 
 def get_ext_domains():
@@ -100,198 +137,469 @@ def get_ext_domains():
         logger.debug("returning none for get_ext_domains")
         return None  # function will handle
 
-    # only implemented for route53 at the moment
-    hosted_zones = boto_client.list_hosted_zones()["HostedZones"]
+    with tracing.span("get_ext_domains"):
+        return ext_domains_cache.get()
 
-    logger.debug(f"num hosted zones found {len(hosted_zones)}")
 
-    return [(zone["Name"], zone["Id"]) for zone in hosted_zones]
+def invalidate_ext_domains():
+    ext_domains_cache.invalidate()
 
 
-def set_ingress_ext_dyn_dns(ext_domains, host):
-    cluster_cert_covered = validate_host_allowed(host)
-    if not cluster_cert_covered:
-        return [f"Host {host} is not covered by the clusters certificate!"]
+def find_bind_domain(bind_domains, host):
+    match = bind_domains.lookup(host)
+    return match[0] if match else None
+
+
+def find_ext_domain(ext_domains, host):
+    # (zone name, hosted zone id) of the most specific zone
+    return ext_domains.lookup(host)
+
+
+def group_by_zone(zone_index, hosts, zone_of):
+    # zone key -> hosts, hosts without an authoratative zone are logged and dropped
+    groups = {}
+    for host in hosts:
+        match = zone_index.lookup(host)
+        if match is None:
+            logger.info(f"No authoratative domain found for host {host}")
+            continue
+        groups.setdefault(zone_of(match), []).append(host)
+
+    return groups
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def ext_record_change(action, host):
+    return {
+        "Action": action,
+        "ResourceRecordSet": {
+            "Name": host + ".",
+            "Type": "A",
+            "TTL": 300,
+            "ResourceRecords": [{"Value": settings.get().external_forwarded_ip}],
+        },
+    }
+
 
+def is_not_found_error(error):
+    return (
+        error["Code"] == "InvalidChangeBatch"
+        and "not found" in error.get("Message", "").lower()
+    )
+
+
+@singleton
+def get_route53_writer():
+    # shared by all request threads, rate limits and coalesces the change requests of
+    # the process. the route53 limit (5 req/s) is per account, split it over processes
+    return Route53Writer(
+        boto_client,
+        rate=float(os.getenv("ROUTE53_RATE", "5")),
+        burst=int(os.getenv("ROUTE53_BURST", "5")),
+        max_changes=ROUTE53_MAX_CHANGES,
+        max_retries=int(os.getenv("ROUTE53_MAX_RETRIES", "6")),
+        coalesce_window=float(os.getenv("ROUTE53_COALESCE_MS", "0")) / 1000,
+    )
+
+
+def submit_ext_changes(zone_id, changes):
+    response = get_route53_writer().submit(zone_id, changes)
+    logger.info(
+        f"Change submitted: {response['ChangeInfo']['Id']} ({len(changes)} changes)"
+    )
+
+
+def submit_ext_batch(zone_id, changes):
+    hosts = ", ".join(
+        change["ResourceRecordSet"]["Name"].removesuffix(".") for change in changes
+    )
+
+    try:
+        submit_ext_changes(zone_id, changes)
+        return []
+    except BotoCoreError as e:
+        # connection errors / timeouts, no response from route53
+        logger.warning(f"ext dns update for zone {zone_id} failed: {e}")
+        return [f"Error ext dns update {e!r} for hosts {hosts}"]
+    except ClientError as e:
+        error = e.response["Error"]
+        if error["Code"] == "NoSuchHostedZone":
+            invalidate_ext_domains()  # zone was removed, relist on next call
+
+        # a batch is atomic, a single already deleted record fails all of it. resend
+        # the upserts as one batch and the deletes one by one, ignoring not found
+        deletes = [change for change in changes if change["Action"] == "DELETE"]
+        if not (deletes and is_not_found_error(error)):
+            logger.info(f"error ext dns update {error}")
+            return [f"Error ext dns update {error} for hosts {hosts}"]
+
+        errors = []
+        upserts = [change for change in changes if change["Action"] != "DELETE"]
+        if upserts:
+            errors.extend(submit_ext_batch(zone_id, upserts))
+
+        for change in deletes:
+            try:
+                submit_ext_changes(zone_id, [change])
+            except BotoCoreError as e:
+                errors.append(
+                    f"Error ext dns delete {e!r} for host "
+                    f"{change['ResourceRecordSet']['Name'].removesuffix('.')}"
+                )
+            except ClientError as e:
+                if not is_not_found_error(e.response["Error"]):
+                    errors.append(
+                        f"Error ext dns delete {e.response['Error']} for host "
+                        f"{change['ResourceRecordSet']['Name'].removesuffix('.')}"
+                    )
+
+        return errors
+
+
+def submit_ext_zone(zone_id, changes):
+    errors = []
+    for batch in chunks(changes, ROUTE53_MAX_CHANGES):
+        errors.extend(submit_ext_batch(zone_id, batch))
+
+    return errors
+
+
+def map_zones(fn, zone_items, max_workers=1):
+    # calls fn(zone, items) for every zone and joins the returned error lists. with
+    # max_workers > 1 the zones are processed concurrently
+    def traced(zone, items):
+        with tracing.span(fn.__name__, zone=zone):
+            return fn(zone, items)
+
+    if max_workers <= 1 or len(zone_items) <= 1:
+        return [
+            error for zone, items in zone_items.items() for error in traced(zone, items)
+        ]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(zone_items))) as pool:
+        # each zone runs in a copy of the callers context so its span lands in the
+        # request trace
+        futures = [
+            pool.submit(contextvars.copy_context().run, traced, zone, items)
+            for zone, items in zone_items.items()
+        ]
+        return [error for future in futures for error in future.result()]
+
+
+def update_ingress_ext_dyn_dns(
+    ext_domains, set_hosts=(), delete_hosts=(), max_workers=1
+):
+    # one ChangeBatch per hosted zone (chunked to the route53 limits) instead of one
+    # call per host. hosts are expected to be validated against the cluster cert already
     if ext_domains is None:
         return []
 
-    if not host_exposed(host):
-        return []  # we skip external dns for hosts that are not exposed
+    zone_changes = ext_zone_changes(ext_domains, set_hosts, delete_hosts)
+    return map_zones(submit_ext_zone, zone_changes, max_workers)
 
-    matching_domain = None
-    for domain in ext_domains:
-        if host.endswith(
-            domain[0].removesuffix(".")
-        ):  # boto domains are fully quantified
-            matching_domain = domain
-            break
 
-    if matching_domain is None:
-        logger.info(f"No external authoratative domain found for host {host}")
-        return []
+def ext_zone_changes(ext_domains, set_hosts=(), delete_hosts=()):
+    # hosted zone id -> route53 changes
+    # we skip external dns for hosts that are not exposed
+    set_hosts = [host for host in set_hosts if host_exposed(host)]
+    delete_hosts = [host for host in delete_hosts if host_exposed(host)]
+
+    zone_changes = {}
+    for action, hosts in (("UPSERT", set_hosts), ("DELETE", delete_hosts)):
+        for zone_id, zone_hosts in group_by_zone(
+            ext_domains, hosts, lambda match: match[1]
+        ).items():
+            zone_changes.setdefault(zone_id, []).extend(
+                ext_record_change(action, host) for host in zone_hosts
+            )
+
+    return zone_changes
+
+
+def make_bind_zone_update(bind_client, zone, records):
+    # records are (replace | delete, host) pairs, all sent in one update message
+    dns_update = bind_client.make_update(zone)
+    fip = settings.get().internal_proxy_fip
+
+    for action, host in records:
+        # set @ if ingress is for apex, else set the host extracted from full host - matching domain
+        name = "@" if host == zone else host.removesuffix("." + zone)
+        if action == "replace":
+            dns_update.replace(name, 300, "A", fip)
+        else:
+            dns_update.delete(name, "A")
+
+    return dns_update
+
+
+def send_bind_zone_update(zone, records):
+    dns_update = make_bind_zone_update(get_bind_client(), zone, records)
+    hosts = ", ".join(host for _, host in records)
 
     try:
-        response = boto_client.change_resource_record_sets(
-            HostedZoneId=matching_domain[1],
-            ChangeBatch={
-                "Changes": [
-                    {
-                        "Action": "UPSERT",  # replace or create
-                        "ResourceRecordSet": {
-                            "Name": host + ".",
-                            "Type": "A",
-                            "TTL": 300,
-                            "ResourceRecords": [
-                                {"Value": os.getenv("EXTERNAL_FORWARDED_IP")}
-                            ],
-                        },
-                    }
-                ]
-            },
+        with metrics.upstream("bind", "update"):
+            response = get_bind_client().send(dns_update)
+    except (OSError, EOFError, dns.exception.DNSException) as e:
+        logger.warning(f"internal dns update for zone {zone} failed: {e}")
+        return [f"Error internal dns update {e!r} for hosts {hosts}"]
+
+    return bind_response_errors(response, hosts)
+
+
+def bind_response_errors(response, hosts):
+    logger.info(response)
+    logger.info(dns.rcode.to_text(response.rcode()))
+
+    # delete always returns noerror on an existing zone, even when the record doesnt exist
+    if response.rcode() != dns.rcode.NOERROR:
+        metrics.upstream_error("bind", "update")
+        return [
+            f"Error internal dns update {dns.rcode.to_text(response.rcode())} for hosts {hosts}"
+        ]
+
+    return []
+
+
+def update_ingress_dyn_dns(bind_domains, set_hosts=(), delete_hosts=(), max_workers=1):
+    # one tsig signed rfc2136 update per zone holding all replaces and deletes, instead
+    # of one update (and tcp connection) per host. hosts are expected to be validated
+    # against the cluster cert already
+    zone_updates = bind_zone_updates(bind_domains, set_hosts, delete_hosts)
+    return map_zones(send_bind_zone_update, zone_updates, max_workers)
+
+
+def bind_zone_updates(bind_domains, set_hosts=(), delete_hosts=()):
+    # zone -> (replace | delete, host) records
+    zone_updates = {}
+    for action, hosts in (("replace", set_hosts), ("delete", delete_hosts)):
+        for zone, zone_hosts in group_by_zone(
+            bind_domains, hosts, lambda match: match[0]
+        ).items():
+            zone_updates.setdefault(zone, []).extend(
+                (action, host) for host in zone_hosts
+            )
+
+    return zone_updates
+
+
+def filter_allowed_hosts(hosts):
+    # (allowed hosts, errors for hosts not covered by the cluster cert)
+    allowed = []
+    errors = []
+    for host in hosts:
+        if validate_host_allowed(host):
+            allowed.append(host)
+        else:
+            errors.append(f"Host {host} is not covered by the clusters certificate!")
+
+    return allowed, errors
+
+
+def prepare_ingress_dns(set_hosts=(), delete_hosts=()):
+    # (set hosts, delete hosts, errors) deduplicated, a host in both is only set, set
+    # hosts not covered by the cluster cert become errors
+    set_hosts = list(dict.fromkeys(set_hosts))
+    unique_set_hosts = set(set_hosts)
+    delete_hosts = [
+        host for host in dict.fromkeys(delete_hosts) if host not in unique_set_hosts
+    ]
+
+    with tracing.span("host_policy"):
+        set_hosts, errors = filter_allowed_hosts(set_hosts)
+
+    return set_hosts, delete_hosts, errors
+
+
+def apply_ingress_dns(
+    bind_domains, ext_domains, set_hosts=(), delete_hosts=(), max_workers=1
+):
+    # sets and deletes the ingress records of all passed hosts in bind and route53,
+    # batched per zone. returns the list of errors like the single host functions
+    set_hosts, delete_hosts, errors = prepare_ingress_dns(set_hosts, delete_hosts)
+
+    with tracing.span("bind_dns"):
+        errors.extend(
+            update_ingress_dyn_dns(bind_domains, set_hosts, delete_hosts, max_workers)
+        )
+    with tracing.span("ext_dns"):
+        errors.extend(
+            update_ingress_ext_dyn_dns(
+                ext_domains, set_hosts, delete_hosts, max_workers
+            )
         )
 
-        logger.info("Change submitted: " + response["ChangeInfo"]["Id"])
-        return []
+    return errors
 
-    except ClientError as e:
-        return [f"Error ext dns update {e.response['Error']}"]
 
+def read_bind_a_records(zone):
+    # host -> set of A values currently in the zone, read with one AXFR
+    with metrics.upstream("bind", "transfer"):
+        zone_obj = get_bind_client().transfer_zone(zone)
 
-def delete_ingress_ext_dyn_dns(ext_domains, host):
-    if ext_domains is None:
-        return []
+    records = {}
+    for name, node in zone_obj.nodes.items():
+        rdataset = node.get_rdataset(zone_obj.rdclass, dns.rdatatype.A)
+        if rdataset is None:
+            continue
 
-    if not host_exposed(host):
-        return []  # we skip external dns for hosts that are not exposed
+        host = name.derelativize(zone_obj.origin).to_text(omit_final_dot=True)
+        records[host] = {rdata.address for rdata in rdataset}
 
-    matching_domain = None
-    for domain in ext_domains:
-        if host.endswith(
-            domain[0].removesuffix(".")
-        ):  # boto domains are fully quantified
-            matching_domain = domain
-            break
+    return records
 
-    if matching_domain is None:
-        logger.info(f"No external authoratative domain found for host {host}")
-        return []
+
+def reconcile_bind_zone(zone, desired_hosts, prune):
+    target = {settings.get().internal_proxy_fip}
 
     try:
-        response = boto_client.change_resource_record_sets(
-            HostedZoneId=matching_domain[1],
-            ChangeBatch={
-                "Changes": [
-                    {
-                        "Action": "DELETE",
-                        "ResourceRecordSet": {
-                            "Name": host + ".",
-                            "Type": "A",
-                            "TTL": 300,
-                            "ResourceRecords": [
-                                {"Value": os.getenv("EXTERNAL_FORWARDED_IP")}
-                            ],
-                        },
-                    }
-                ]
-            },
+        current = read_bind_a_records(zone)
+    except (OSError, EOFError, dns.exception.DNSException) as e:
+        # no transfer permission / bind unreachable, fall back to a blind replace
+        logger.warning(f"zone transfer of {zone} failed, replacing all hosts: {e}")
+        return send_bind_zone_update(
+            zone, [("replace", host) for host in desired_hosts]
+        )
+
+    records = [
+        ("replace", host) for host in desired_hosts if current.get(host) != target
+    ]
+
+    if prune:
+        # records pointing at our proxy, covered by our cert but without an ingress
+        desired = set(desired_hosts)
+        records.extend(
+            ("delete", host)
+            for host, values in current.items()
+            if values == target and host not in desired and validate_host_allowed(host)
         )
 
-        logger.info("Change submitted:")
-        logger.info(response["ChangeInfo"]["Id"])
+    logger.info(f"zone {zone}: {len(records)} of {len(desired_hosts)} hosts differ")
+
+    if not records:
         return []
 
-    except ClientError as e:
-        logger.info("error deleting ext dns")
-        logger.info(e)
+    return send_bind_zone_update(zone, records)
 
-        # ignore not found errors
-        error = e.response["Error"]
-        if (
-            error["Code"] == "InvalidChangeBatch"
-            and "not found" in error.get("Message", "").lower()
-        ):
-            return []
 
-        return [f"Error ext dns delete {e.response['Error']}"]
+def read_ext_a_records(zone_id):
+    # host -> A record set currently in the hosted zone
+    records = {}
+    paginator = boto_client.get_paginator("list_resource_record_sets")
+    with metrics.upstream("route53", "list_resource_record_sets"):
+        for page in paginator.paginate(HostedZoneId=zone_id):
+            for record_set in page["ResourceRecordSets"]:
+                if record_set["Type"] != "A" or "ResourceRecords" not in record_set:
+                    continue  # alias records arent managed by us
 
+                # route53 escapes * in wildcard names as octal
+                host = record_set["Name"].removesuffix(".").replace("\\052", "*")
+                records[host] = record_set
 
-def set_ingress_dyn_dns(bind_domains, host):
-    cluster_cert_covered = validate_host_allowed(host)
-    if not cluster_cert_covered:
-        return [f"Host {host} is not covered by the clusters certificate!"]
-
-    matching_domain = None
-    for bind_domain in bind_domains:
-        if host.endswith(bind_domain.domain):
-            matching_domain = bind_domain.domain
-            break
-
-    if matching_domain is None:
-        logger.info(f"No authoratative domain found for host {host}")
-        return []
+    return records
 
-    dns_update = dns.update.Update(
-        matching_domain,
-        keyring=dns.tsigkeyring.from_text(
-            {"internal.": os.getenv("BIND_DNS_UPDATE_KEY")}
-        ),
-        keyname="internal.",
-        keyalgorithm="hmac-sha256",
-    )
 
-    # set @ if ingress is for apex, else set the host extracted from full host - matching domain
-    dns_update.replace(
-        "@" if host == matching_domain else host.removesuffix("." + matching_domain),
-        300,
-        "A",
-        os.getenv("INTERNAL_PROXY_FIP"),
-    )
-    response = dns.query.tcp(dns_update, os.getenv("BIND_MASTER_IP"))
+def reconcile_ext_zone(zone_id, desired_hosts, prune):
+    target = {settings.get().external_forwarded_ip}
 
-    logger.info(response)
-    logger.info(dns.rcode.to_text(response.rcode()))
+    try:
+        current = read_ext_a_records(zone_id)
+    except (BotoCoreError, ClientError) as e:
+        logger.warning(f"listing records of {zone_id} failed, upserting all hosts: {e}")
+        return submit_ext_zone(
+            zone_id, [ext_record_change("UPSERT", host) for host in desired_hosts]
+        )
 
-    if response.rcode() != dns.rcode.NOERROR:
-        return [f"Error internal dns update {dns.rcode.to_text(response.rcode())}"]
-    else:
-        return []
+    def values(record_set):
+        return {record["Value"] for record in record_set["ResourceRecords"]}
+
+    changes = [
+        ext_record_change("UPSERT", host)
+        for host in desired_hosts
+        if host not in current or values(current[host]) != target
+    ]
+
+    if prune:
+        desired = set(desired_hosts)
+        policy = host_policy.snapshot()
+        changes.extend(
+            # a delete has to match the existing record set exactly
+            {"Action": "DELETE", "ResourceRecordSet": record_set}
+            for host, record_set in current.items()
+            if values(record_set) == target
+            and host not in desired
+            and policy.exposed.matches(host)
+            and policy.allowed.matches(host)
+        )
 
+    logger.info(
+        f"hosted zone {zone_id}: {len(changes)} of {len(desired_hosts)} hosts differ"
+    )
 
-def delete_ingress_dyn_dns(bind_domains, host):
-    # check domain exists in bind first
-    matching_domain = None
-    for bind_domain in bind_domains:
-        if host.endswith(bind_domain.domain):
-            matching_domain = bind_domain.domain
-            break
-
-    if matching_domain is None:
-        logger.info(f"No authoratative domain found for host {host}")
+    if not changes:
         return []
 
-    # create the update object
-    dns_update = dns.update.Update(
-        matching_domain,
-        keyring=dns.tsigkeyring.from_text(
-            {"internal.": os.getenv("BIND_DNS_UPDATE_KEY")}
-        ),
-        keyname="internal.",
-        keyalgorithm="hmac-sha256",
-    )
+    return submit_ext_zone(zone_id, changes)
+
+
+def reconcile_ingress_dns(bind_domains, ext_domains, hosts, prune=False, max_workers=1):
+    # like apply_ingress_dns with set_hosts, but reads the current zone contents once per
+    # zone and only writes records that are missing or changed. with prune, records of
+    # ours (same target ip, covered by the cluster cert) without an ingress are deleted
+    hosts, errors = filter_allowed_hosts(dict.fromkeys(hosts))
+
+    bind_zones = group_by_zone(bind_domains, hosts, lambda match: match[0])
+    if prune:
+        for zone, _ in bind_domains:
+            bind_zones.setdefault(zone, [])
 
-    # delete the record
-    dns_update.delete(
-        "@" if host == matching_domain else host.removesuffix("." + matching_domain),
-        "A",
+    errors.extend(
+        map_zones(
+            lambda zone, zone_hosts: reconcile_bind_zone(zone, zone_hosts, prune),
+            bind_zones,
+            max_workers,
+        )
     )
 
-    response = dns.query.tcp(dns_update, os.getenv("BIND_MASTER_IP"))
-    logger.info(response)
-    logger.info(dns.rcode.to_text(response.rcode()))
+    if ext_domains is not None:
+        ext_zones = group_by_zone(
+            ext_domains,
+            [host for host in hosts if host_exposed(host)],
+            lambda match: match[1],
+        )
+        if prune:
+            for _, zone_id in ext_domains:
+                ext_zones.setdefault(zone_id, [])
+
+        errors.extend(
+            map_zones(
+                lambda zone_id, zone_hosts: reconcile_ext_zone(
+                    zone_id, zone_hosts, prune
+                ),
+                ext_zones,
+                max_workers,
+            )
+        )
 
-    # should always return noerror calling delete on existing zone, even when record doesnt exist
-    if response.rcode() != dns.rcode.NOERROR:
-        return [f"Error internal dns delete {dns.rcode.to_text(response.rcode())}"]
-    else:
-        return []
+    return errors
+
+
+def set_ingress_ext_dyn_dns(ext_domains, host):
+    allowed, errors = filter_allowed_hosts([host])
+    return errors or update_ingress_ext_dyn_dns(ext_domains, set_hosts=allowed)
+
+
+def delete_ingress_ext_dyn_dns(ext_domains, host):
+    return update_ingress_ext_dyn_dns(ext_domains, delete_hosts=[host])
+
+
+def set_ingress_dyn_dns(bind_domains, host):
+    allowed, errors = filter_allowed_hosts([host])
+    return errors or update_ingress_dyn_dns(bind_domains, set_hosts=allowed)
+
+
+def delete_ingress_dyn_dns(bind_domains, host):
+    return update_ingress_dyn_dns(bind_domains, delete_hosts=[host])
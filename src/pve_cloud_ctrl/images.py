@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+from functools import lru_cache
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-images")
+
+# used when the controller conf has no image_mirrors.json, registry -> harbor project
+DEFAULT_IMAGE_MIRRORS = {
+    "registries": {
+        "quay.io": "quay-mirror",
+        "public.ecr.aws": "aws-ecr-mirror",
+        "ghcr.io": "github-mirror",
+        "docker.io": "docker-hub-mirror",
+    },
+    # bitnami legacy rewrite
+    "rewrites": [{"find": "bitnami/", "replace": "bitnamilegacy/"}],
+}
+
+
+def split_registry(image):
+    # (registry, remainder) following the docker reference rules: the first path
+    # component is a registry if it has a dot, a port or is localhost, everything
+    # else is a docker hub image (nginx, library/nginx, nginx@sha256:...)
+    first, sep, rest = image.partition("/")
+    if sep and ("." in first or ":" in first or first == "localhost"):
+        return first, rest
+
+    return "docker.io", image
+
+
+class ImageRewriter:
+    # registry -> mirror project lookup compiled from the image mirror conf, results are
+    # memoized since pods of the same deployment carry the same images
+    def __init__(self, mirror_host, conf, memo_size=4096):
+        self.mirror_host = mirror_host
+        self.registries = {
+            registry: f"{mirror_host}/{project}"
+            for registry, project in conf.get("registries", {}).items()
+        }
+        self.rewrites = [
+            (rewrite["find"], rewrite["replace"])
+            for rewrite in conf.get("rewrites", [])
+        ]
+
+        self.rewrite = lru_cache(maxsize=memo_size)(self._rewrite)
+
+    def _rewrite(self, image):
+        for find, replace in self.rewrites:
+            if find in image:
+                image = image.replace(find, replace)
+
+        registry, remainder = split_registry(image)
+
+        prefix = self.registries.get(registry)
+        if prefix is None:
+            return image  # not mirrored
+
+        return f"{prefix}/{remainder}"
+
+
+def load_image_rewriter(conf_dir, mirror_host):
+    path = os.path.join(conf_dir, "image_mirrors.json")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            conf = json.load(f)
+        logger.info(f"loaded image mirror conf from {path}")
+    else:
+        conf = DEFAULT_IMAGE_MIRRORS
+
+    return ImageRewriter(
+        mirror_host, conf, int(os.getenv("IMAGE_REWRITE_CACHE_SIZE", "4096"))
+    )
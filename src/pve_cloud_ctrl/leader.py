@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+import pve_cloud_ctrl.metrics as metrics
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-leader")
+
+
+class LeaseElector:
+    # leader election on a coordination.k8s.io Lease. a background thread tries to
+    # acquire / renew the lease every retry_period, updates go through the lease's
+    # resourceVersion so only one candidate wins a race (409 for the others). a leader
+    # that could not renew for renew_deadline seconds steps down on its own, well before
+    # a standby may take over after lease_duration, so two replicas never act at once.
+    def __init__(
+        self,
+        coordination_v1,
+        name,
+        namespace,
+        identity,
+        lease_duration=15.0,
+        renew_deadline=10.0,
+        retry_period=2.0,
+        on_started_leading=None,
+    ):
+        self.api = coordination_v1
+        self.name = name
+        self.namespace = namespace
+        self.identity = identity
+        self.lease_duration = lease_duration
+        self.renew_deadline = renew_deadline
+        self.retry_period = retry_period
+        self.on_started_leading = on_started_leading
+
+        self._lock = threading.Lock()
+        self._renewed_at = None  # monotonic time of our last successful acquire / renew
+        self._leading = False
+
+        # (holder, renew time) of the lease as we last saw it, other holders are timed
+        # with our own clock from the moment we saw the renew time change
+        self._observed = None
+        self._observed_at = None
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def is_leader(self):
+        with self._lock:
+            return (
+                self._renewed_at is not None
+                and time.monotonic() - self._renewed_at < self.renew_deadline
+            )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _spec(self, now, acquired_at=None, transitions=0):
+        return client.V1LeaseSpec(
+            holder_identity=self.identity,
+            lease_duration_seconds=int(self.lease_duration),
+            acquire_time=acquired_at or now,
+            renew_time=now,
+            lease_transitions=transitions,
+        )
+
+    def _try_acquire_or_renew(self):
+        now = datetime.now(timezone.utc)
+
+        try:
+            with metrics.upstream("kubernetes", "read_lease"):
+                lease = self.api.read_namespaced_lease(self.name, self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+
+            body = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=self.name, namespace=self.namespace),
+                spec=self._spec(now),
+            )
+            try:
+                with metrics.upstream("kubernetes", "create_lease"):
+                    self.api.create_namespaced_lease(self.namespace, body)
+            except ApiException as e:
+                if e.status == 409:  # another candidate created it first
+                    return False
+                raise
+            return True
+
+        spec = lease.spec or client.V1LeaseSpec()
+        holder = spec.holder_identity
+
+        if holder and holder != self.identity:
+            observed = (holder, spec.renew_time)
+            if observed != self._observed:
+                self._observed = observed
+                self._observed_at = time.monotonic()
+
+            duration = spec.lease_duration_seconds or self.lease_duration
+            if time.monotonic() - self._observed_at < duration:
+                return False  # held and renewed by someone else
+
+            logger.info(f"lease {self.name} of {holder} expired, taking over")
+
+        if holder == self.identity:
+            lease.spec = self._spec(now, spec.acquire_time, spec.lease_transitions or 0)
+        else:
+            lease.spec = self._spec(now, transitions=(spec.lease_transitions or 0) + 1)
+
+        try:
+            # carries the read resourceVersion, a concurrent update fails with 409
+            with metrics.upstream("kubernetes", "replace_lease"):
+                self.api.replace_namespaced_lease(self.name, self.namespace, lease)
+        except ApiException as e:
+            if e.status == 409:
+                return False
+            raise
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                acquired = self._try_acquire_or_renew()
+            except Exception as e:
+                logger.warning(f"lease {self.name}: acquire / renew failed: {e}")
+                acquired = False
+
+            with self._lock:
+                if acquired:
+                    self._renewed_at = started
+                if self._stop.is_set():
+                    break  # released while we were talking to the apiserver
+                was_leading = self._leading
+                self._leading = (
+                    self._renewed_at is not None
+                    and time.monotonic() - self._renewed_at < self.renew_deadline
+                )
+                leading = self._leading
+
+            if leading and not was_leading:
+                logger.info(f"{self.identity} is now leader of {self.name}")
+                metrics.leader.labels(self.name).set(1)
+                if self.on_started_leading:
+                    try:
+                        self.on_started_leading()
+                    except Exception as e:
+                        logger.error(f"[!] on_started_leading of {self.name}: {e}")
+            elif was_leading and not leading:
+                logger.warning(f"{self.identity} lost the lease {self.name}")
+                metrics.leader.labels(self.name).set(0)
+
+            self._stop.wait(self.retry_period)
+
+    def release(self):
+        # hands the lease over on shutdown instead of letting it expire. the loop is
+        # stopped first so it doesnt renew / reacquire the lease behind our back
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            # an acquire / renew in flight could land after our write
+            self._thread.join(self.renew_deadline)
+
+        with self._lock:
+            if self._renewed_at is None:
+                return
+            self._renewed_at = None
+            self._leading = False
+        metrics.leader.labels(self.name).set(0)
+
+        try:
+            lease = self.api.read_namespaced_lease(self.name, self.namespace)
+            if lease.spec and lease.spec.holder_identity == self.identity:
+                lease.spec.holder_identity = None
+                lease.spec.renew_time = None
+                self.api.replace_namespaced_lease(self.name, self.namespace, lease)
+                logger.info(f"released lease {self.name}")
+        except ApiException as e:
+            logger.warning(f"releasing lease {self.name} failed: {e.status} {e.reason}")
@@ -0,0 +1,189 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    push_to_gateway,
+    start_http_server,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-metrics")
+
+# admission webhooks have to answer within the apiserver timeout (10s default)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_duration = Histogram(
+    "pve_cloud_ctrl_request_duration_seconds",
+    "Admission webhook latency per route",
+    ["route"],
+    buckets=BUCKETS,
+)
+
+upstream_duration = Histogram(
+    "pve_cloud_ctrl_upstream_duration_seconds",
+    "Latency of calls to bind, route53, postgres and the kubernetes api",
+    ["upstream", "operation"],
+    buckets=BUCKETS,
+)
+
+upstream_errors = Counter(
+    "pve_cloud_ctrl_upstream_errors_total",
+    "Failed calls to bind, route53, postgres and the kubernetes api",
+    ["upstream", "operation"],
+)
+
+cron_phase_duration = Gauge(
+    "pve_cloud_ctrl_cron_phase_duration_seconds",
+    "Duration of the phases of the last cron run",
+    ["phase"],
+)
+
+route53_throttled = Counter(
+    "pve_cloud_ctrl_route53_throttled_total",
+    "Route53 change requests answered with a throttling error",
+    ["code"],
+)
+
+route53_coalesced = Counter(
+    "pve_cloud_ctrl_route53_coalesced_total",
+    "Route53 change submissions merged into the ChangeBatch of another caller",
+)
+
+route53_rate_limit_wait = Histogram(
+    "pve_cloud_ctrl_route53_rate_limit_wait_seconds",
+    "Time route53 change requests waited for the client side rate limit",
+    buckets=BUCKETS,
+)
+
+leader = Gauge(
+    "pve_cloud_ctrl_leader",
+    "1 if this replica holds the lease",
+    ["lease"],
+)
+
+
+@contextmanager
+def upstream(name, operation):
+    # times the wrapped call, exceptions count as errors and are reraised
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        upstream_errors.labels(name, operation).inc()
+        raise
+    finally:
+        upstream_duration.labels(name, operation).observe(time.perf_counter() - start)
+
+
+def upstream_error(name, operation):
+    # for calls that report failures in their response instead of raising
+    upstream_errors.labels(name, operation).inc()
+
+
+@contextmanager
+def cron_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        cron_phase_duration.labels(phase).set(elapsed)
+        logger.info(f"cron phase {phase} took {elapsed:.2f}s")
+
+
+class StatsCollector:
+    # reads cache hit / miss counts and queue depths from the objects at scrape time,
+    # the hot paths only bump plain ints
+    def __init__(self):
+        self.caches = {}  # name -> () -> (hits, misses)
+        self.queues = {}  # name -> () -> depth
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "pve_cloud_ctrl_cache_hits",
+            "Cache lookups served from memory",
+            labels=["cache"],
+        )
+        misses = CounterMetricFamily(
+            "pve_cloud_ctrl_cache_misses", "Cache lookups that loaded", labels=["cache"]
+        )
+        for name, stats in self.caches.items():
+            cache_hits, cache_misses = stats()
+            hits.add_metric([name], cache_hits)
+            misses.add_metric([name], cache_misses)
+        yield hits
+        yield misses
+
+        depth = GaugeMetricFamily(
+            "pve_cloud_ctrl_queue_depth",
+            "Items waiting in work queues",
+            labels=["queue"],
+        )
+        for name, queue_depth in self.queues.items():
+            depth.add_metric([name], queue_depth())
+        yield depth
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def register_cache(name, stats):
+    stats_collector.caches[name] = stats
+
+
+def register_lru_cache(name, fn):
+    def stats():
+        info = fn.cache_info()
+        return info.hits, info.misses
+
+    register_cache(name, stats)
+
+
+def register_queue(name, depth):
+    stats_collector.queues[name] = depth
+
+
+def render():
+    # (payload, content type) for the /metrics route. with PROMETHEUS_MULTIPROC_DIR
+    # counters and histograms are aggregated over all gunicorn workers, cache and
+    # queue stats are always those of the worker answering the scrape
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server():
+    # watcher and cron serve metrics on their own port if METRICS_PORT is set
+    port = os.getenv("METRICS_PORT")
+    if port:
+        start_http_server(int(port))
+        logger.info(f"serving metrics on port {port}")
+
+
+def push_metrics(job):
+    # short lived jobs push to a pushgateway at METRICS_PUSHGATEWAY (host:port)
+    gateway = os.getenv("METRICS_PUSHGATEWAY")
+    if not gateway:
+        return
+
+    try:
+        push_to_gateway(gateway, job=job, registry=REGISTRY)
+    except OSError as e:
+        logger.warning(f"pushing metrics to {gateway} failed: {e}")
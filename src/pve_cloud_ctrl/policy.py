@@ -0,0 +1,148 @@
+import fnmatch
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-policy")
+
+
+def _has_magic(pattern):
+    return any(c in pattern for c in "*?[")
+
+
+class HostMatcher:
+    # compiled form of a list of {"zone", "names", <apex flag>} entries. a host matches
+    # if fnmatch(host, f"{name}.{zone}") for any entry, or it equals a zone whose apex
+    # flag is set. literal names land in a set, wildcard names are joined into one
+    # regex per zone, lookups only probe the zones that are a label suffix of the host.
+    def __init__(self, entries, apex_key):
+        self.exact = set()
+        patterns = {}
+        # entries with wildcards in the zone itself cant be keyed, matched the slow way
+        self.fallback = []
+
+        for entry in entries:
+            zone = entry["zone"]
+
+            if entry.get(apex_key):
+                self.exact.add(zone)
+
+            for name in entry["names"]:
+                if _has_magic(zone):
+                    self.fallback.append(f"{name}.{zone}")
+                elif _has_magic(name):
+                    patterns.setdefault(zone, []).append(fnmatch.translate(name))
+                else:
+                    self.exact.add(f"{name}.{zone}")
+
+        self.zone_patterns = {
+            zone: re.compile("|".join(translated))
+            for zone, translated in patterns.items()
+        }
+        self.fallback_re = (
+            re.compile("|".join(fnmatch.translate(p) for p in self.fallback))
+            if self.fallback
+            else None
+        )
+
+    def matches(self, host):
+        if host in self.exact:
+            return True
+
+        if self.zone_patterns:
+            # a * in fnmatch also matches dots, so every label suffix of the host can
+            # be the zone part of a pattern
+            dot = host.find(".")
+            while dot != -1:
+                pattern = self.zone_patterns.get(host[dot + 1 :])
+                if pattern is not None and pattern.match(host[:dot]):
+                    return True
+                dot = host.find(".", dot + 1)
+
+        if self.fallback_re is not None and self.fallback_re.match(host):
+            return True
+
+        return False
+
+
+class PolicySnapshot:
+    # one version of the controller-conf files with their matchers, never changed after
+    # it is built so allowed and exposed always belong to the same files
+    def __init__(self, cluster_cert_entries, external_domains):
+        self.cluster_cert_entries = cluster_cert_entries
+        self.external_domains = external_domains
+        self.allowed = HostMatcher(cluster_cert_entries, "apex_zone_san")
+        self.exposed = HostMatcher(external_domains, "expose_apex")
+
+
+class HostPolicy:
+    # the controller-conf configmap files compiled into matchers. reloaded when the
+    # mounted files change, checked at most every check_interval seconds
+    def __init__(self, conf_dir, check_interval):
+        self.cluster_cert_path = os.path.join(conf_dir, "cluster_cert_entries.json")
+        self.external_domains_path = os.path.join(conf_dir, "external_domains.json")
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._next_check = 0
+        self._stamp = None
+        self._snapshot = None
+
+        self._check()
+
+    def _file_stamp(self):
+        # configmap mounts swap a ..data symlink, stat follows it
+        stamps = []
+        for path in (self.cluster_cert_path, self.external_domains_path):
+            st = os.stat(path)
+            stamps.append((st.st_mtime_ns, st.st_ino, st.st_size))
+        return tuple(stamps)
+
+    def _load(self, stamp):
+        with open(self.cluster_cert_path, "r") as f:
+            cluster_cert_entries = json.load(f)
+
+        with open(self.external_domains_path, "r") as f:
+            external_domains = json.load(f)
+
+        # swapped with one assignment, readers grab the snapshot reference once
+        self._snapshot = PolicySnapshot(cluster_cert_entries, external_domains)
+        self._stamp = stamp
+
+    def _check(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+
+            try:
+                stamp = self._file_stamp()
+                if stamp != self._stamp:
+                    first_load = self._stamp is None
+                    self._load(stamp)
+                    if not first_load:
+                        logger.info("controller conf changed, reloaded host policy")
+            except (OSError, ValueError) as e:
+                # keep the last good policy if the configmap is mid update
+                if self._stamp is None:
+                    raise
+                logger.warning(f"failed reloading host policy: {e}")
+
+    def snapshot(self):
+        # for callers that check several hosts / both matchers against the same files
+        self._check()
+        return self._snapshot
+
+    def host_allowed(self, host):
+        return self.snapshot().allowed.matches(host)
+
+    def host_exposed(self, host):
+        return self.snapshot().exposed.matches(host)
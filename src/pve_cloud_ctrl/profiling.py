@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def sample_stacks(seconds, interval=0.005):
+    # samples the stacks of all other threads every interval seconds for seconds. returns
+    # collapsed stacks ("outer;...;inner count" per line, hottest first), the input
+    # format of flamegraph.pl and speedscope
+    counts = Counter()
+    own = threading.get_ident()
+    names = {}
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+
+            if ident not in names:
+                names.update((t.ident, t.name) for t in threading.enumerate())
+
+            stack.append(names.get(ident, str(ident)))
+            counts[";".join(reversed(stack))] += 1
+
+        time.sleep(interval)
+
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -0,0 +1,216 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import pve_cloud_ctrl.metrics as metrics
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-route53")
+
+# route53 answers these when the account request limit (5/s) is hit or the previous
+# change of the hosted zone is still being applied, both go away by waiting
+THROTTLE_CODES = frozenset(
+    ("Throttling", "ThrottlingException", "PriorRequestNotComplete")
+)
+
+
+class TokenBucket:
+    # blocking token bucket, acquire() waits until a token is available
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+
+    def acquire(self):
+        # returns the seconds waited
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._refilled_at) * self.rate
+                )
+                self._refilled_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                delay = (1 - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+
+class _Submission:
+    def __init__(self, changes):
+        self.changes = changes
+        self.response = None
+        self.error = None
+        self.leader = False
+        self.wakeup = threading.Event()
+
+
+def merge_changes(submissions):
+    # one change per record set, a later submission for the same name and type replaces
+    # an earlier one (a ChangeBatch cant touch a record set twice)
+    merged = {}
+    for submission in submissions:
+        for change in submission.changes:
+            record_set = change["ResourceRecordSet"]
+            key = (record_set["Name"], record_set["Type"])
+            merged.pop(key, None)
+            merged[key] = change
+
+    return list(merged.values())
+
+
+class Route53Writer:
+    # serializes change_resource_record_sets per hosted zone and merges the changes of
+    # callers that queue up behind an in flight request into one ChangeBatch (up to
+    # max_changes). the first caller of a zone sends, the others wait for its result or
+    # are handed the next batch. all calls go through one token bucket, throttling
+    # errors are retried with jittered exponential backoff. submit() returns the
+    # response or raises like the plain boto call
+    def __init__(
+        self,
+        boto_client,
+        rate=5.0,
+        burst=5,
+        max_changes=500,
+        max_retries=6,
+        base_backoff=0.5,
+        max_backoff=20.0,
+        coalesce_window=0.0,
+    ):
+        self.client = boto_client
+        self.limiter = TokenBucket(rate, burst)
+        self.max_changes = max_changes
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.coalesce_window = coalesce_window
+
+        self._lock = threading.Lock()
+        self._pending = {}  # zone id -> [_Submission], first one is the sender
+
+    def submit(self, zone_id, changes):
+        submission = _Submission(changes)
+        with self._lock:
+            queue = self._pending.get(zone_id)
+            if queue is None:
+                self._pending[zone_id] = [submission]
+                submission.leader = True
+            else:
+                queue.append(submission)
+
+        if not submission.leader:
+            submission.wakeup.wait()
+
+        # either the first caller of the zone or handed the next batch
+        if submission.leader:
+            self._flush(zone_id)
+
+        if submission.error is not None:
+            raise submission.error
+        return submission.response
+
+    def _flush(self, zone_id):
+        if self.coalesce_window:
+            time.sleep(self.coalesce_window)  # let more callers join the batch
+
+        with self._lock:
+            queue = self._pending[zone_id]
+            batch = [queue.pop(0)]
+            size = len(batch[0].changes)
+            while queue and size + len(queue[0].changes) <= self.max_changes:
+                size += len(queue[0].changes)
+                batch.append(queue.pop(0))
+
+        try:
+            self._send_batch(zone_id, batch)
+        finally:
+            with self._lock:
+                queue = self._pending[zone_id]
+                if queue:
+                    queue[0].leader = True
+                    queue[0].wakeup.set()
+                else:
+                    del self._pending[zone_id]
+
+            for submission in batch:
+                submission.leader = False
+                submission.wakeup.set()
+
+    def _send_batch(self, zone_id, batch):
+        if len(batch) == 1:
+            self._send_one(zone_id, batch[0])
+            return
+
+        changes = merge_changes(batch)
+        logger.debug(
+            f"coalesced {len(batch)} submissions into {len(changes)} changes for {zone_id}"
+        )
+        metrics.route53_coalesced.inc(len(batch) - 1)
+
+        try:
+            response = self.send(zone_id, changes)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in THROTTLE_CODES:
+                for submission in batch:
+                    submission.error = e
+                return
+
+            # a batch is atomic, one bad change would fail everyone. resend every
+            # submission on its own so each caller gets its own error
+            for submission in batch:
+                self._send_one(zone_id, submission)
+            return
+        except BaseException as e:
+            for submission in batch:
+                submission.error = e
+            return
+
+        for submission in batch:
+            submission.response = response
+
+    def _send_one(self, zone_id, submission):
+        try:
+            submission.response = self.send(zone_id, submission.changes)
+        except BaseException as e:
+            submission.error = e
+
+    def send(self, zone_id, changes):
+        # one rate limited ChangeBatch, retried while route53 throttles
+        attempt = 0
+        while True:
+            waited = self.limiter.acquire()
+            if waited:
+                metrics.route53_rate_limit_wait.observe(waited)
+
+            try:
+                with metrics.upstream("route53", "change_resource_record_sets"):
+                    return self.client.change_resource_record_sets(
+                        HostedZoneId=zone_id, ChangeBatch={"Changes": changes}
+                    )
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code not in THROTTLE_CODES:
+                    raise
+
+                metrics.route53_throttled.labels(code).inc()
+                if attempt >= self.max_retries:
+                    raise
+
+                delay = min(self.max_backoff, self.base_backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logger.info(f"route53 {code} for {zone_id}, retry in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
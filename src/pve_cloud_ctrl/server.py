@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+
+from gunicorn.app.base import BaseApplication
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-server")
+
+
+class ReloadingSSLContext:
+    # gunicorn calls the ssl_context hook for every accepted connection, we build the
+    # context once and only rebuild it when the mounted cert / key files change
+    def __init__(self, certfile, keyfile, check_interval):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._context = None
+        self._stamp = None
+        self._next_check = 0
+
+    def _file_stamp(self):
+        # k8s secret mounts swap a ..data symlink, stat follows it so mtime / inode change
+        stamps = []
+        for path in (self.certfile, self.keyfile):
+            st = os.stat(path)
+            stamps.append((st.st_mtime_ns, st.st_ino, st.st_size))
+        return tuple(stamps)
+
+    def __call__(self, conf, default_ssl_context_factory):
+        now = time.monotonic()
+        if self._context is not None and now < self._next_check:
+            return self._context
+
+        with self._lock:
+            if self._context is not None and now < self._next_check:
+                return self._context
+
+            self._next_check = now + self.check_interval
+
+            try:
+                stamp = self._file_stamp()
+            except OSError as e:
+                if self._context is None:
+                    raise
+                logger.warning(f"could not stat tls files, keeping current cert: {e}")
+                return self._context
+
+            if stamp != self._stamp:
+                try:
+                    self._context = default_ssl_context_factory()
+                    if self._stamp is not None:
+                        logger.info("tls certificate changed, reloaded ssl context")
+                    self._stamp = stamp
+                except Exception as e:
+                    # secret update might be half written, retry on next check
+                    if self._context is None:
+                        raise
+                    logger.warning(f"failed reloading tls certificate: {e}")
+
+            return self._context
+
+
+class AdmissionServer(BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def child_exit(server, worker):
+    # drop the metric files of dead workers so their gauges dont linger
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def get_server_options():
+    certfile = os.getenv("TLS_CERT_FILE", "/etc/tls/tls.crt")
+    keyfile = os.getenv("TLS_KEY_FILE", "/etc/tls/tls.key")
+
+    options = {
+        "bind": os.getenv("ADM_BIND", "0.0.0.0:443"),
+        # threaded workers, slow dns calls only block their own thread. a single process
+        # by default so in process caches are shared between all requests
+        "worker_class": "gthread",
+        "workers": int(os.getenv("ADM_WORKERS", "1")),
+        "threads": int(os.getenv("ADM_THREADS", "16")),
+        "worker_connections": int(os.getenv("ADM_MAX_CONNECTIONS", "1000")),
+        "backlog": int(os.getenv("ADM_BACKLOG", "2048")),
+        "keepalive": int(os.getenv("ADM_KEEPALIVE", "30")),
+        # hard kill for stuck workers and drain time for in flight requests on SIGTERM
+        "timeout": int(os.getenv("ADM_TIMEOUT", "60")),
+        "graceful_timeout": int(os.getenv("ADM_GRACEFUL_TIMEOUT", "30")),
+        "certfile": certfile,
+        "keyfile": keyfile,
+        "ssl_context": ReloadingSSLContext(
+            certfile, keyfile, int(os.getenv("ADM_CERT_CHECK_INTERVAL", "30"))
+        ),
+        "accesslog": "-" if os.getenv("ADM_ACCESS_LOG") else None,
+        "loglevel": os.getenv("LOG_LEVEL", "INFO").lower(),
+    }
+
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        options["child_exit"] = child_exit
+
+    return options
+
+
+def serve(app):
+    AdmissionServer(app, get_server_options()).run()
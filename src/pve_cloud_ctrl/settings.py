@@ -0,0 +1,203 @@
+import logging
+import os
+from dataclasses import dataclass, replace
+
+from pve_cloud_ctrl.shards import shard_index_from_env
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-settings")
+
+
+def _names(value):
+    # comma separated env list -> frozenset, blanks dropped
+    return frozenset(name.strip() for name in (value or "").split(",") if name.strip())
+
+
+def _number(environ, name, default, kind=int):
+    value = environ.get(name, default)
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"{name} must be {kind.__name__}, got {value!r}") from None
+
+
+@dataclass(frozen=True)
+class Settings:
+    # immutable snapshot of the env the hot paths read, parsed once. handlers grab the
+    # snapshot once per request / iteration and only do attribute lookups and set
+    # membership tests. pool sizes, cache ttls and server options stay where they are
+    # built, they are read once on startup anyway
+    stack_fqdn: str | None
+    pg_conn_str: str | None
+    exclude_tls_namespaces: frozenset
+    exclude_mirror_namespaces: frozenset
+
+    harbor_mirror_host: str | None
+    harbor_mirror_pull_secret_name: str | None
+    mirror_enabled: bool
+
+    bind_dns_update_key: str | None
+    bind_master_ip: str | None
+    internal_proxy_fip: str | None
+    bind_enabled: bool
+    external_forwarded_ip: str | None
+
+    controller_conf_dir: str
+    ingress_dns_async: bool
+    namespace_dns_async: bool
+    namespace_dns_workers: int
+    slow_request_seconds: float
+    debug_profile_token: str | None
+    watch_timeout: int
+    dns_async_pipeline: bool
+    dns_concurrency: int
+
+    cron_list_page_size: int
+    cron_dns_workers: int
+    cron_dns_diff: bool
+    cron_dns_prune: bool
+    cron_secret_workers: int
+
+    leader_election: bool
+    lease_name: str
+    lease_namespace: str
+    lease_duration: float
+    lease_renew_deadline: float
+    lease_retry_period: float
+    shard_count: int
+    shard_index: int | None  # resolved by validate() of watcher and cron
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+
+        harbor_mirror_host = environ.get("HARBOR_MIRROR_HOST") or None
+        pull_secret_name = environ.get("HARBOR_MIRROR_PULL_SECRET_NAME") or None
+        bind_dns_update_key = environ.get("BIND_DNS_UPDATE_KEY") or None
+        bind_master_ip = environ.get("BIND_MASTER_IP") or None
+        internal_proxy_fip = environ.get("INTERNAL_PROXY_FIP") or None
+
+        return cls(
+            stack_fqdn=environ.get("STACK_FQDN") or None,
+            pg_conn_str=environ.get("PG_CONN_STR") or None,
+            exclude_tls_namespaces=_names(environ.get("EXCLUDE_TLS_NAMESPACES")),
+            exclude_mirror_namespaces=_names(environ.get("EXCLUDE_MIRROR_NAMESPACES")),
+            harbor_mirror_host=harbor_mirror_host,
+            harbor_mirror_pull_secret_name=pull_secret_name,
+            mirror_enabled=bool(harbor_mirror_host and pull_secret_name),
+            bind_dns_update_key=bind_dns_update_key,
+            bind_master_ip=bind_master_ip,
+            internal_proxy_fip=internal_proxy_fip,
+            bind_enabled=bool(
+                bind_dns_update_key and bind_master_ip and internal_proxy_fip
+            ),
+            external_forwarded_ip=environ.get("EXTERNAL_FORWARDED_IP") or None,
+            controller_conf_dir=environ.get(
+                "CONTROLLER_CONF_DIR", "/etc/controller-conf"
+            ),
+            ingress_dns_async=bool(environ.get("INGRESS_DNS_ASYNC")),
+            namespace_dns_async=bool(environ.get("NAMESPACE_DNS_ASYNC")),
+            namespace_dns_workers=_number(environ, "NAMESPACE_DNS_WORKERS", "8"),
+            slow_request_seconds=_number(environ, "SLOW_REQUEST_MS", "1000", float)
+            / 1000,
+            debug_profile_token=environ.get("DEBUG_PROFILE_TOKEN") or None,
+            watch_timeout=_number(environ, "WATCH_TIMEOUT", "300"),
+            dns_async_pipeline=bool(environ.get("DNS_ASYNC_PIPELINE")),
+            dns_concurrency=_number(environ, "DNS_CONCURRENCY", "16"),
+            cron_list_page_size=_number(environ, "CRON_LIST_PAGE_SIZE", "500"),
+            cron_dns_workers=_number(environ, "CRON_DNS_WORKERS", "8"),
+            cron_dns_diff=environ.get("CRON_DNS_RECONCILE", "").lower() == "diff",
+            cron_dns_prune=bool(environ.get("CRON_DNS_PRUNE")),
+            cron_secret_workers=_number(environ, "CRON_SECRET_WORKERS", "8"),
+            leader_election=bool(environ.get("LEADER_ELECTION")),
+            lease_name=environ.get("LEASE_NAME", "pve-cloud-controller-watcher"),
+            lease_namespace=environ.get("LEASE_NAMESPACE", "pve-cloud-controller"),
+            lease_duration=_number(environ, "LEASE_DURATION", "15", float),
+            lease_renew_deadline=_number(environ, "LEASE_RENEW_DEADLINE", "10", float),
+            lease_retry_period=_number(environ, "LEASE_RETRY_PERIOD", "2", float),
+            shard_count=_number(environ, "SHARD_COUNT", "1"),
+            shard_index=None,
+        )
+
+    def validate(self, component, environ=None):
+        # fail on startup instead of on the first pod / namespace event. returns the
+        # settings of the component, for watcher and cron a copy with the shard index
+        missing = []
+        if component in ("watcher", "cron"):
+            if not self.stack_fqdn:
+                missing.append("STACK_FQDN")
+            if not self.pg_conn_str:
+                missing.append("PG_CONN_STR")
+        if component == "adm" and self.bind_enabled and not self.pg_conn_str:
+            missing.append("PG_CONN_STR")
+
+        if missing:
+            raise Exception(
+                f"{component}: missing required settings " + ", ".join(missing)
+            )
+
+        if self.leader_election and not (
+            self.lease_retry_period < self.lease_renew_deadline < self.lease_duration
+        ):
+            raise Exception(
+                f"{component}: LEASE_RETRY_PERIOD < LEASE_RENEW_DEADLINE < "
+                "LEASE_DURATION is required"
+            )
+
+        if component == "cron" and self.shard_count > 1 and self.cron_dns_prune:
+            logger.warning(
+                "CRON_DNS_PRUNE is ignored with SHARD_COUNT > 1, a shard cant tell "
+                "orphaned records from those of other shards"
+            )
+
+        if bool(self.harbor_mirror_host) != bool(self.harbor_mirror_pull_secret_name):
+            logger.warning(
+                "only one of HARBOR_MIRROR_HOST / HARBOR_MIRROR_PULL_SECRET_NAME is set, "
+                "image mirroring is disabled"
+            )
+
+        bind = (self.bind_dns_update_key, self.bind_master_ip, self.internal_proxy_fip)
+        if any(bind) and not all(bind):
+            logger.warning(
+                "BIND_DNS_UPDATE_KEY, BIND_MASTER_IP and INTERNAL_PROXY_FIP are only "
+                "partially set, internal ingress dns is disabled"
+            )
+
+        if component in ("watcher", "cron"):
+            return replace(self, shard_index=self._shard_index(component, environ))
+        return self
+
+    def _shard_index(self, component, environ):
+        # only watcher and cron are sharded, adm shares their env (SHARD_COUNT set, no
+        # statefulset pod name) and must not fail on it
+        environ = os.environ if environ is None else environ
+        if self.shard_count < 1:
+            raise Exception(f"{component}: SHARD_COUNT must be >= 1")
+
+        try:
+            index = shard_index_from_env(environ) if self.shard_count > 1 else 0
+        except ValueError as e:
+            raise Exception(f"{component}: {e}") from None
+
+        if not 0 <= index < self.shard_count:
+            raise Exception(
+                f"{component}: shard index {index} out of range for "
+                f"SHARD_COUNT {self.shard_count}"
+            )
+        return index
+
+
+# the env of a running pod cant change, a new value needs a restart anyway
+_current = Settings.from_env()
+
+
+def get():
+    return _current
+
+
+def validate(component):
+    # validates the snapshot on startup and swaps in the one of the component, the
+    # snapshots themselves never change
+    global _current
+    _current = _current.validate(component)
+    return _current
@@ -0,0 +1,61 @@
+import bisect
+import hashlib
+import os
+import re
+
+
+def _point(key):
+    # stable across processes and python versions, unlike hash()
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ShardRing:
+    # consistent hash ring that assigns namespaces to one of count shards. every shard
+    # owns vnodes points on the ring, a namespace belongs to the shard of the first point
+    # at or after its hash. growing from n to n + 1 shards only moves ~1/(n + 1) of the
+    # namespaces, the rest keep their owner (and their replica's warm caches)
+    def __init__(self, count, vnodes=128):
+        self.count = count
+
+        points = sorted(
+            (_point(f"shard-{shard}-{vnode}"), shard)
+            for shard in range(count)
+            for vnode in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_of(self, namespace):
+        if self.count <= 1:
+            return 0
+
+        i = bisect.bisect_left(self._hashes, _point(namespace))
+        return self._shards[i % len(self._shards)]
+
+    def owns(self, shard, namespace):
+        return self.shard_of(namespace) == shard
+
+
+def shard_index_from_env(environ):
+    # explicit SHARD_INDEX, else the completion index of an indexed job, else the
+    # ordinal of a statefulset pod (<name>-<ordinal>)
+    for name in ("SHARD_INDEX", "JOB_COMPLETION_INDEX"):
+        value = environ.get(name)
+        if value:
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be int, got {value!r}") from None
+
+    pod_name = environ.get("POD_NAME") or environ.get("HOSTNAME", "")
+    match = re.search(r"-(\d+)$", pod_name)
+    if match is None:
+        raise ValueError(
+            f"SHARD_INDEX is not set and {pod_name!r} is not a statefulset pod name"
+        )
+    return int(match.group(1))
+
+
+def pod_identity(environ=None):
+    environ = os.environ if environ is None else environ
+    return environ.get("POD_NAME") or environ.get("HOSTNAME") or f"pid-{os.getpid()}"
@@ -0,0 +1,90 @@
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional, only needed for TRACING_OTEL
+    otel_context = None
+    otel_trace = None
+
+logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
+logger = logging.getLogger("cloud-tracing")
+
+# with TRACING_OTEL set spans are also reported through the opentelemetry api, the
+# exporter is configured by the sdk (e.g. running under opentelemetry-instrument)
+tracer = None
+if os.getenv("TRACING_OTEL"):
+    if otel_trace is None:
+        logger.warning("TRACING_OTEL is set but opentelemetry-api is not installed")
+    else:
+        tracer = otel_trace.get_tracer("pve_cloud_ctrl")
+
+_current_trace = contextvars.ContextVar("pve_cloud_ctrl_trace", default=None)
+
+
+class Trace:
+    # spans of one request. zone workers append from their own threads, they run in a
+    # copy of the request context (see funcs.map_zones)
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []  # (name, attributes, offset, duration)
+        self.otel_span = None
+        self.otel_token = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def format(self):
+        steps = ", ".join(
+            f"{name}{''.join(f' {v}' for v in attributes.values())} "
+            f"+{offset * 1000:.1f}ms {duration * 1000:.1f}ms"
+            for name, attributes, offset, duration in self.spans
+        )
+        return f"{self.name} {self.elapsed() * 1000:.1f}ms: {steps or 'no spans'}"
+
+
+def start_trace(name):
+    # returns the token for end_trace
+    trace = Trace(name)
+    if tracer is not None:
+        trace.otel_span = tracer.start_span(name)
+        trace.otel_token = otel_context.attach(
+            otel_trace.set_span_in_context(trace.otel_span)
+        )
+    return _current_trace.set(trace)
+
+
+def end_trace(token):
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace.otel_span is not None:
+        otel_context.detach(trace.otel_token)
+        trace.otel_span.end()
+    return trace
+
+
+@contextmanager
+def span(name, **attributes):
+    # times a step of the current request, a no-op outside of a trace
+    trace = _current_trace.get()
+    if trace is None and tracer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        if tracer is not None:
+            with tracer.start_as_current_span(name, attributes=attributes):
+                yield
+        else:
+            yield
+    finally:
+        if trace is not None:
+            trace.spans.append(
+                (name, attributes, start - trace.start, time.perf_counter() - start)
+            )
@@ -1,67 +1,256 @@
+import atexit
 import logging
 import os
+import queue
+import random
+import signal
+import sys
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 from pprint import pformat
 
 from kubernetes import client, config, watch
-from pve_cloud.orm.alchemy import AcmeX509
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session
+from kubernetes.client.rest import ApiException
+
+import pve_cloud_ctrl.db as db
+import pve_cloud_ctrl.metrics as metrics
+import pve_cloud_ctrl.settings as settings
+from pve_cloud_ctrl.cache import singleton
+from pve_cloud_ctrl.leader import LeaseElector
+from pve_cloud_ctrl.shards import ShardRing, pod_identity
 
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()))
 logger = logging.getLogger("cloud-watcher")
 
 
+class NamespaceInformer:
+    # list + watch of namespaces with a local store. the watch resumes from the last seen
+    # resourceVersion (kept fresh by bookmarks), only a 410 Gone triggers a relist.
+    # events are handed to the handlers through a queue processed by a worker thread,
+    # failed handlers are retried with backoff.
+    def __init__(self, v1, on_added, max_retries=5):
+        self.v1 = v1
+        self.on_added = on_added
+        self.max_retries = max_retries
+
+        self.store = {}  # namespace name -> V1Namespace
+        self.resource_version = None
+
+        self.queue = queue.Queue()
+        self._worker = threading.Thread(target=self._process_queue, daemon=True)
+
+    def _process_queue(self):
+        while True:
+            name, attempt = self.queue.get()
+            try:
+                self.on_added(name)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"[!] giving up on namespace {name}: {e}")
+                else:
+                    delay = min(2**attempt, 60)
+                    logger.warning(
+                        f"handling namespace {name} failed ({e}), retry in {delay}s"
+                    )
+                    threading.Timer(
+                        delay, self.queue.put, args=((name, attempt + 1),)
+                    ).start()
+            finally:
+                self.queue.task_done()
+
+    def catch_up(self, seconds):
+        # queues namespaces created in the last seconds, used when this replica takes
+        # over the lease so namespaces added during the failover arent missed
+        since = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        for name, ns in list(self.store.items()):
+            if (
+                ns.metadata.creation_timestamp
+                and ns.metadata.creation_timestamp > since
+            ):
+                self.queue.put((name, 0))
+
+    def relist(self, initial=False):
+        items = []
+        _continue = None
+        while True:
+            with metrics.upstream("kubernetes", "list_namespaces"):
+                page = self.v1.list_namespace(limit=500, _continue=_continue)
+            items.extend(page.items)
+
+            _continue = page.metadata._continue
+            if not _continue:
+                break
+
+        store = {ns.metadata.name: ns for ns in items}
+
+        # existing namespaces on startup are handled by the cron, after a relist only
+        # namespaces we missed while the watch was gone are new to us
+        if not initial:
+            for name in store.keys() - self.store.keys():
+                logger.info(f"namespace {name} added while watch was gone")
+                self.queue.put((name, 0))
+
+        self.store = store
+        self.resource_version = page.metadata.resource_version
+        logger.info(
+            f"listed {len(store)} namespaces at resource version {self.resource_version}"
+        )
+
+    def watch(self):
+        w = watch.Watch()
+        for event in w.stream(
+            self.v1.list_namespace,
+            resource_version=self.resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=settings.get().watch_timeout + random.randint(0, 30),
+        ):
+            raw_object = event["raw_object"]
+            self.resource_version = raw_object["metadata"]["resourceVersion"]
+
+            if event["type"] == "BOOKMARK":
+                continue
+
+            logger.debug(pformat(event))
+
+            name = raw_object["metadata"]["name"]
+            if event["type"] == "DELETED":
+                self.store.pop(name, None)
+                continue
+
+            is_new = name not in self.store
+            self.store[name] = event["object"]
+
+            # replayed ADDED events for namespaces we already know are skipped
+            if event["type"] == "ADDED" and is_new:
+                self.queue.put((name, 0))
+
+    def run(self):
+        self.relist(initial=True)
+        self._worker.start()
+
+        needs_relist = False
+        backoff = 1
+        while True:
+            try:
+                if needs_relist:
+                    self.relist()
+                    needs_relist = False
+
+                self.watch()
+                backoff = 1
+            except ApiException as e:
+                if e.status == 410:
+                    # resource version too old, the only case that needs a full relist
+                    logger.info("watch expired (410 Gone), relisting")
+                    needs_relist = True
+                    continue
+
+                logger.error(f"[!] Error in namespace watch: {e.status} {e.reason}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            except Exception as e:
+                # connection errors, resume from the last seen resource version
+                logger.error(f"[!] Error in namespace watch: {e} - {type(e)}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+def create_cluster_tls(v1, namespace):
+    # here we only want to exclude the defualt namespaces, even if we dont want to apply mirroring
+    # we still want to apply tls
+    conf = settings.get()
+    if namespace in conf.exclude_tls_namespaces:
+        logger.debug("excluding ns")
+        logger.debug(namespace)
+        return
+
+    # insert cluster-tls secret
+    # todo: print warning if nothing is defined and continue => for e2e scenario
+    cert = db.get_cluster_cert()  # pooled and cached, not a new engine per event
+
+    if not cert:
+        logger.info(f"No certificate found for {conf.stack_fqdn}")
+        return
+
+    secret = client.V1Secret(
+        metadata=client.V1ObjectMeta(name="cluster-tls"),
+        type="kubernetes.io/tls",
+        string_data=cert.k8s,
+    )
+
+    try:
+        with metrics.upstream("kubernetes", "create_secret"):
+            v1.create_namespaced_secret(namespace=namespace, body=secret)
+        logger.info(f"created cluster-tls in {namespace}")
+    except ApiException as e:
+        if e.status != 409:
+            raise
+        # already there, the cron keeps its content up to date
+        logger.debug(f"cluster-tls already exists in {namespace}")
+
+
+@singleton
+def get_elector():
+    # one lease per shard, standbys of a shard keep their informer warm and only act
+    # once they hold the lease
+    conf = settings.get()
+    name = conf.lease_name
+    if conf.shard_count > 1:
+        name = f"{name}-{conf.shard_index}"
+
+    elector = LeaseElector(
+        client.CoordinationV1Api(),
+        name,
+        conf.lease_namespace,
+        pod_identity(),
+        lease_duration=conf.lease_duration,
+        renew_deadline=conf.lease_renew_deadline,
+        retry_period=conf.lease_retry_period,
+    )
+    atexit.register(elector.release)
+    elector.start()
+    return elector
+
+
 def watch_namespaces():
     config.load_incluster_config()
     v1 = client.CoreV1Api()
 
-    # todo: this is not perfectly clean
-    initial_list = v1.list_namespace(limit=1)
-    resource_version = initial_list.metadata.resource_version
+    conf = settings.get()
+    ring = ShardRing(conf.shard_count)
+    elector = get_elector() if conf.leader_election else None
 
-    w = watch.Watch()
+    def on_added(name):
+        if not ring.owns(conf.shard_index, name):
+            logger.debug(f"namespace {name} belongs to another shard")
+            return
+        if elector is not None and not elector.is_leader:
+            logger.debug(f"not leader, skipping namespace {name}")
+            return
+        create_cluster_tls(v1, name)
 
-    for event in w.stream(
-        v1.list_namespace, resource_version=resource_version, timeout_seconds=60
-    ):
-        # here we only want to exclude the defualt namespaces, even if we dont want to apply mirroring
-        # we still want to apply tls
-        if event["object"].metadata.name in os.getenv("EXCLUDE_TLS_NAMESPACES").split(
-            ","
-        ):
-            logger.debug("excluding ns")
-            logger.debug(event["object"].metadata.name)
-            continue
-
-        logger.debug(pformat(event))
-
-        if event["type"] == "ADDED":
-            # insert cluster-tls secret
-            # todo: print warning if nothing is defined and continue => for e2e scenario
-            engine = create_engine(os.getenv("PG_CONN_STR"))
-            with Session(engine) as session:
-                stmt = select(AcmeX509).where(
-                    AcmeX509.stack_fqdn == os.getenv("STACK_FQDN")
-                )
-                cert = session.scalars(stmt).first()
-
-            if not cert:
-                logger.info(f"No certificate found for {os.getenv('STACK_FQDN')}")
-                continue
+    informer = NamespaceInformer(v1, on_added)
+    metrics.register_queue("namespace-informer", informer.queue.qsize)
 
-            secret = client.V1Secret(
-                metadata=client.V1ObjectMeta(name="cluster-tls"),
-                type="kubernetes.io/tls",
-                string_data=cert.k8s,
-            )
+    if elector is not None:
+        # the gap between the old leader stopping and us taking over is at most a few
+        # lease durations
+        elector.on_started_leading = lambda: informer.catch_up(4 * conf.lease_duration)
 
-            v1.create_namespaced_secret(
-                namespace=event["object"].metadata.name, body=secret
-            )
+    informer.run()
 
 
 def main():
+    conf = settings.validate("watcher")
+    metrics.start_metrics_server()
+
+    if conf.shard_count > 1:
+        logger.info(f"handling shard {conf.shard_index} of {conf.shard_count}")
+
+    # exit through sys.exit so atexit hands the lease over
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     while True:
         try:
             logger.debug("watching namespaces")
@@ -0,0 +1,40 @@
+class ZoneIndex:
+    # maps dns zones to a value (bind domain, route53 hosted zone id) and finds the most
+    # specific zone for a host. lookups walk the label boundaries of the host from the
+    # full name down to the tld, so they cost O(labels) dict hits regardless of zone count
+    # and only match whole labels (foo.example.com never matches zone ample.com)
+    def __init__(self, zones=()):
+        self._zones = {}
+        for zone, value in zones:
+            self.add(zone, value)
+
+    @staticmethod
+    def normalize(name):
+        return name.lower().removesuffix(".")
+
+    def add(self, zone, value):
+        self._zones[self.normalize(zone)] = (zone, value)
+
+    def lookup(self, host):
+        # returns the (zone, value) pair as it was added or None
+        name = self.normalize(host)
+        zones = self._zones
+
+        while True:
+            match = zones.get(name)
+            if match is not None:
+                return match
+
+            dot = name.find(".")
+            if dot == -1:
+                return None
+            name = name[dot + 1 :]
+
+    def __contains__(self, zone):
+        return self.normalize(zone) in self._zones
+
+    def __iter__(self):
+        return iter(self._zones.values())
+
+    def __len__(self):
+        return len(self._zones)
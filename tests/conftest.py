@@ -0,0 +1,61 @@
+# the controller modules read the env and build their clients on import, so the fakes
+# of the load tests (bind server, moto, sqlite, in memory kubernetes api) are started
+# before any test module imports them
+import time
+
+import dns.name
+import dns.rdatatype
+import fakes
+import pytest
+
+ZONES = ["zone0.test.example", "zone1.test.example"]
+EXPOSED_ZONES = ZONES[:1]
+
+ENV = fakes.setup(ZONES, exposed_zones=EXPOSED_ZONES)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    ENV.close()
+
+
+@pytest.fixture
+def env():
+    return ENV
+
+
+def bind_a_records(env, zone):
+    zone_obj = env.bind.zones[dns.name.from_text(zone)]
+    records = {}
+    for name, node in zone_obj.nodes.items():
+        for rdataset in node.rdatasets:
+            if rdataset.rdtype == dns.rdatatype.A:
+                host = name.derelativize(zone_obj.origin).to_text(omit_final_dot=True)
+                records[host] = {rdata.address for rdata in rdataset}
+    return records
+
+
+def ext_zone_id(env, zone):
+    return next(
+        hosted_zone["Id"]
+        for hosted_zone in env.route53.list_hosted_zones()["HostedZones"]
+        if hosted_zone["Name"] == zone + "."
+    )
+
+
+def ext_a_records(env, zone_id):
+    return {
+        record_set["Name"].removesuffix("."): {
+            record["Value"] for record in record_set["ResourceRecords"]
+        }
+        for record_set in env.route53.list_resource_record_sets(HostedZoneId=zone_id)[
+            "ResourceRecordSets"
+        ]
+        if record_set["Type"] == "A"
+    }
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
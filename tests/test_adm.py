@@ -0,0 +1,48 @@
+import json
+
+import pytest
+from adm_load import review
+from conftest import ZONES
+
+import pve_cloud_ctrl.adm as adm
+
+
+@pytest.fixture
+def client():
+    return adm.app.test_client()
+
+
+def post_ingress(client, uid, hosts, operation="CREATE"):
+    obj = {"metadata": {"name": "ing"}, "spec": {"rules": [{"host": h} for h in hosts]}}
+    body = review(uid, "default", operation=operation, obj=obj)
+    response = client.post(
+        "/ingress-dns", data=json.dumps(body), content_type="application/json"
+    )
+    return response.get_json()["response"]
+
+
+def test_only_retries_of_the_same_review_are_suppressed(client, env):
+    host = f"idempotent.{ZONES[0]}"
+    updates = env.bind.updates
+
+    assert post_ingress(client, "create-1", [host])["allowed"]
+    assert env.bind.updates == updates + 1
+
+    # apiserver retry of the same review
+    assert post_ingress(client, "create-1", [host])["allowed"]
+    assert env.bind.updates == updates + 1
+
+    # the same hosts in a new review (recreated ingress, another replica's cache)
+    assert post_ingress(client, "create-2", [host])["allowed"]
+    assert env.bind.updates == updates + 2
+
+
+def test_uncovered_host_denies_without_writes(client, env):
+    updates = env.bind.updates
+
+    response = post_ingress(
+        client, "create-uncovered", ["bad.not-covered.example", f"good.{ZONES[1]}"]
+    )
+    assert not response["allowed"]
+    assert "bad.not-covered.example" in response["status"]["message"]
+    assert env.bind.updates == updates
@@ -0,0 +1,113 @@
+import asyncio
+
+import dns.name
+import dns.rcode
+import pytest
+from conftest import (
+    EXPOSED_ZONES,
+    ZONES,
+    bind_a_records,
+    ext_a_records,
+    ext_zone_id,
+)
+from fakes import EXTERNAL_FORWARDED_IP, INTERNAL_PROXY_FIP
+
+import pve_cloud_ctrl.asyncdns as asyncdns
+import pve_cloud_ctrl.funcs as funcs
+from pve_cloud_ctrl.dnsclient import AsyncBindUpdateClient
+
+EXT_ZONE = EXPOSED_ZONES[0]
+BIND_ZONE = ZONES[1]
+
+
+def apply_async(set_hosts=(), delete_hosts=()):
+    return asyncdns.apply_ingress_dns(
+        funcs.get_bind_domains(), funcs.get_ext_domains(), set_hosts, delete_hosts
+    )
+
+
+def apply_sync(set_hosts=(), delete_hosts=()):
+    return funcs.apply_ingress_dns(
+        funcs.get_bind_domains(), funcs.get_ext_domains(), set_hosts, delete_hosts
+    )
+
+
+def test_sets_and_deletes_records_in_bind_and_route53(env):
+    ext_host, bind_host = f"pipeline.{EXT_ZONE}", f"pipeline.{BIND_ZONE}"
+    zone_id = ext_zone_id(env, EXT_ZONE)
+
+    assert apply_async(set_hosts=[ext_host, bind_host]) == []
+    assert bind_a_records(env, EXT_ZONE)[ext_host] == {INTERNAL_PROXY_FIP}
+    assert bind_a_records(env, BIND_ZONE)[bind_host] == {INTERNAL_PROXY_FIP}
+    assert ext_a_records(env, zone_id)[ext_host] == {EXTERNAL_FORWARDED_IP}
+
+    assert apply_async(delete_hosts=[ext_host, bind_host]) == []
+    assert ext_host not in bind_a_records(env, EXT_ZONE)
+    assert bind_host not in bind_a_records(env, BIND_ZONE)
+    assert ext_host not in ext_a_records(env, zone_id)
+
+
+@pytest.mark.parametrize("apply", [apply_async, apply_sync])
+def test_policy_errors_match_the_threaded_apply(env, apply):
+    errors = apply(set_hosts=["bad.not-covered.example", f"good.{BIND_ZONE}"])
+    assert errors == [
+        "Host bad.not-covered.example is not covered by the clusters certificate!"
+    ]
+
+
+@pytest.mark.parametrize("apply", [apply_async, apply_sync])
+def test_bind_errors_match_the_threaded_apply(env, apply, monkeypatch):
+    # the fake answers NOTAUTH for zones it doesnt hold
+    monkeypatch.delitem(env.bind.zones, dns.name.from_text(BIND_ZONE))
+
+    errors = apply(set_hosts=[f"a.{BIND_ZONE}", f"b.{BIND_ZONE}"])
+    assert errors == [
+        f"Error internal dns update NOTAUTH for hosts a.{BIND_ZONE}, b.{BIND_ZONE}"
+    ]
+
+
+def make_client(**options):
+    return AsyncBindUpdateClient(**{**funcs.bind_client_options(), **options})
+
+
+def replace_update(client, host):
+    update = client.make_update(BIND_ZONE)
+    update.replace(host.removesuffix(f".{BIND_ZONE}"), 300, "A", INTERNAL_PROXY_FIP)
+    return update
+
+
+def test_async_client_reuses_and_reconnects(env):
+    client = make_client(pool_size=1)
+    connects = 0
+    connect = client._connect
+
+    async def counting_connect():
+        nonlocal connects
+        connects += 1
+        return await connect()
+
+    client._connect = counting_connect
+
+    async def run():
+        for i in range(3):
+            await client.send(replace_update(client, f"reuse{i}.{BIND_ZONE}"))
+        assert connects == 1
+
+        # the pooled connection was dropped by the server, retried on a fresh one
+        sock, _ = client._idle[0]
+        await sock.close()
+        response = await client.send(replace_update(client, f"retry.{BIND_ZONE}"))
+        await client.close()
+        return response
+
+    response = asyncio.run(run())
+    assert response.rcode() == dns.rcode.NOERROR
+    assert connects == 2
+    assert bind_a_records(env, BIND_ZONE)[f"retry.{BIND_ZONE}"] == {INTERNAL_PROXY_FIP}
+
+
+def test_async_client_doesnt_retry_fresh_connections(env):
+    client = make_client(port=1)  # nothing listens
+
+    with pytest.raises(OSError):
+        asyncio.run(client.send(replace_update(client, f"refused.{BIND_ZONE}")))
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from pve_cloud_ctrl.cache import TTLCache, TTLSet, singleton
+
+
+class Loader:
+    def __init__(self):
+        self.loads = 0
+        self.loaded = threading.Event()
+
+    def __call__(self):
+        self.loads += 1
+        self.loaded.set()
+        return self.loads
+
+
+def test_value_is_served_from_memory_within_ttl():
+    loader = Loader()
+    cache = TTLCache("test", loader, ttl=60)
+
+    assert cache.get() == 1
+    assert cache.get() == 1
+    assert loader.loads == 1
+    assert cache.stats() == (1, 1)
+
+    cache.invalidate()
+    assert cache.get() == 2
+
+
+def test_stale_value_is_served_while_refreshing():
+    loader = Loader()
+    cache = TTLCache("test", loader, ttl=0.01, max_stale=60)
+    cache.get()
+    loader.loaded.clear()
+
+    time.sleep(0.02)
+    assert cache.get() == 1  # stale, the refresh runs in the background
+    assert loader.loaded.wait(5)
+
+    deadline = time.monotonic() + 5
+    while cache._refreshing:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert cache._value == 2
+
+
+def test_ttl_set_expires_keys():
+    keys = TTLSet(0.01)
+    keys.add("a")
+    assert "a" in keys
+    time.sleep(0.02)
+    assert "a" not in keys
+
+
+def test_ttl_set_drops_expired_keys_on_add():
+    keys = TTLSet(0.01)
+    for i in range(1000):
+        keys.add(f"uid-{i}")
+    keys.add("uid-0")  # re-added, expires last
+    time.sleep(0.02)
+
+    keys.add("fresh")
+    assert len(keys) == 1
+    assert "fresh" in keys
+
+
+def test_singleton_builds_once_under_racing_threads():
+    built = []
+    start = threading.Barrier(8)
+
+    @singleton
+    def get_instance():
+        time.sleep(0.01)  # widen the race
+        built.append(object())
+        return built[-1]
+
+    def race(results):
+        start.wait()
+        results.append(get_instance())
+
+    results = []
+    threads = [threading.Thread(target=race, args=(results,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(built) == 1
+    assert all(result is built[0] for result in results)
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from conftest import wait_until
+
+import pve_cloud_ctrl.adm as adm
+from pve_cloud_ctrl.dnsqueue import DnsWorkQueue
+
+
+class Recorder:
+    # apply callback that records its calls, the first call can be held back
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = dict(fail)  # host -> number of failing attempts
+        self.hold = threading.Event()
+        self.hold.set()
+        self.first_call = threading.Event()
+
+    def __call__(self, set_hosts, delete_hosts):
+        self.first_call.set()
+        self.hold.wait(5)
+        self.calls.append((sorted(set_hosts), sorted(delete_hosts)))
+
+        errors = []
+        for host in set_hosts + delete_hosts:
+            if self.fail.get(host, 0) > 0:
+                self.fail[host] -= 1
+                errors.append(f"failed {host}")
+        return errors
+
+
+def test_newest_change_per_host_wins():
+    recorder = Recorder()
+    recorder.hold.clear()
+    queue = DnsWorkQueue("test", recorder, rate=1000, burst=1000)
+
+    queue.enqueue(set_hosts=["first"])
+    recorder.first_call.wait(5)
+
+    # queued while the worker is busy, a.example is set and then deleted
+    queue.enqueue(set_hosts=["a.example", "b.example"])
+    queue.enqueue(delete_hosts=["a.example"])
+    queue.enqueue(set_hosts=["b.example"])
+    recorder.hold.set()
+
+    wait_until(lambda: len(recorder.calls) == 2 and not len(queue))
+    assert recorder.calls == [(["first"], []), (["b.example"], ["a.example"])]
+
+
+def test_failed_batches_are_retried():
+    recorder = Recorder(fail={"flaky.example": 2})
+    queue = DnsWorkQueue("test", recorder, rate=1000, burst=1000, base_backoff=0.01)
+
+    queue.enqueue(set_hosts=["flaky.example"])
+
+    wait_until(lambda: len(recorder.calls) == 3 and not len(queue))
+    assert recorder.calls == [(["flaky.example"], [])] * 3
+
+
+def test_gives_up_after_max_retries():
+    recorder = Recorder(fail={"broken.example": 100})
+    queue = DnsWorkQueue(
+        "test", recorder, rate=1000, burst=1000, max_retries=2, base_backoff=0.01
+    )
+
+    queue.enqueue(delete_hosts=["broken.example"])
+
+    wait_until(lambda: len(recorder.calls) == 3 and not len(queue))
+    time.sleep(0.05)
+    assert len(recorder.calls) == 3
+
+
+def test_drain_flushes_pending_changes():
+    recorder = Recorder()
+    queue = DnsWorkQueue("test", recorder, rate=0.001, burst=0)
+
+    queue.enqueue(set_hosts=["a.example"], delete_hosts=["b.example"])
+    queue.drain(timeout=1)
+
+    assert recorder.calls == [(["a.example"], ["b.example"])]
+    assert not len(queue)
+
+
+def test_discard_drops_pending_and_reports_in_flight():
+    recorder = Recorder()
+    recorder.hold.clear()
+    queue = DnsWorkQueue("test", recorder, rate=1000, burst=1000)
+
+    queue.enqueue(delete_hosts=["running.example"])
+    recorder.first_call.wait(5)
+    queue.enqueue(delete_hosts=["pending.example", "other.example"])
+
+    dropped, in_flight = queue.discard(
+        ["running.example", "pending.example", "unknown.example"]
+    )
+    assert dropped == {"pending.example": "delete"}
+    assert in_flight == ["running.example"]
+    recorder.hold.set()
+
+    wait_until(lambda: len(recorder.calls) == 2 and not len(queue))
+    assert recorder.calls == [([], ["running.example"]), ([], ["other.example"])]
+    assert queue.discard(["running.example"]) == ({}, [])
+
+
+def test_sync_writes_go_around_queued_changes(monkeypatch):
+    recorder = Recorder()
+    recorder.hold.clear()
+    queue = DnsWorkQueue("test", recorder, rate=1000, burst=1000)
+    monkeypatch.setattr(adm, "get_dns_queue", lambda: queue)
+
+    sync_calls = []
+
+    def apply_sync(conf, set_hosts=(), delete_hosts=(), max_workers=1):
+        sync_calls.append((list(set_hosts), list(delete_hosts)))
+        return []
+
+    monkeypatch.setattr(adm, "apply_ingress_dns", apply_sync)
+
+    # async ingress writes, one being applied and one waiting (or backing off)
+    queue.enqueue(set_hosts=["running.example"])
+    recorder.first_call.wait(5)
+    queue.enqueue(set_hosts=["pending.example"])
+
+    # synchronous namespace cleanup of both hosts
+    errors = adm.apply_ingress_dns_around_queue(
+        None, delete_hosts=["running.example", "pending.example"]
+    )
+    assert errors == []
+    assert sync_calls == [([], ["running.example", "pending.example"])]
+    recorder.hold.set()
+
+    # the pending set is gone, the delete is repeated behind the running set
+    wait_until(lambda: len(recorder.calls) == 2 and not len(queue))
+    assert recorder.calls == [(["running.example"], []), ([], ["running.example"])]
@@ -0,0 +1,62 @@
+from fakes import FakeCluster, FakeCoreV1Api
+
+from pve_cloud_ctrl.fanout import HASH_ANNOTATION, content_hash, fan_out_secret
+
+NAMESPACES = ["ns-a", "ns-b", "ns-c"]
+
+
+def make_cluster():
+    cluster = FakeCluster()
+    for namespace in NAMESPACES:
+        cluster.add_namespace(namespace)
+    return cluster, FakeCoreV1Api(cluster)
+
+
+def fan_out(v1, string_data):
+    return fan_out_secret(
+        v1, "cluster-tls", "kubernetes.io/tls", NAMESPACES, string_data=string_data
+    )
+
+
+def test_up_to_date_copies_are_skipped():
+    cluster, v1 = make_cluster()
+    cert = {"tls.crt": "crt", "tls.key": "key"}
+
+    assert fan_out(v1, cert) == []
+    assert cluster.calls == 1 + len(NAMESPACES)  # list + creates
+
+    expected = content_hash({"data": None, "stringData": cert})
+    for namespace in NAMESPACES:
+        secret = cluster.secrets[(namespace, "cluster-tls")]
+        assert secret.metadata.annotations[HASH_ANNOTATION] == expected
+
+    calls = cluster.calls
+    assert fan_out(v1, cert) == []
+    assert cluster.calls == calls + 1  # only the list
+
+
+def test_changed_content_is_patched():
+    cluster, v1 = make_cluster()
+    fan_out(v1, {"tls.crt": "old"})
+
+    calls = cluster.calls
+    rotated = {"tls.crt": "new"}
+    assert fan_out(v1, rotated) == []
+    assert cluster.calls == calls + 1 + len(NAMESPACES)  # list + patches
+
+    for namespace in NAMESPACES:
+        assert cluster.secrets[(namespace, "cluster-tls")].string_data == rotated
+
+
+def test_copies_without_hash_are_rewritten():
+    cluster, v1 = make_cluster()
+    cert = {"tls.crt": "crt"}
+    fan_out(v1, cert)
+    cluster.secrets[("ns-b", "cluster-tls")].metadata.annotations = None
+
+    calls = cluster.calls
+    assert fan_out(v1, cert) == []
+    assert cluster.calls == calls + 2  # list + one patch
+    assert (
+        HASH_ANNOTATION in cluster.secrets[("ns-b", "cluster-tls")].metadata.annotations
+    )
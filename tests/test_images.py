@@ -0,0 +1,63 @@
+import pytest
+
+from pve_cloud_ctrl.images import DEFAULT_IMAGE_MIRRORS, ImageRewriter, split_registry
+
+MIRROR = "harbor.example"
+DIGEST = "sha256:" + "a" * 64
+
+
+@pytest.mark.parametrize(
+    "image, expected",
+    [
+        ("nginx", ("docker.io", "nginx")),
+        ("nginx:1.25", ("docker.io", "nginx:1.25")),
+        ("library/nginx", ("docker.io", "library/nginx")),
+        (f"nginx@{DIGEST}", ("docker.io", f"nginx@{DIGEST}")),
+        ("quay.io/org/app:v1", ("quay.io", "org/app:v1")),
+        ("localhost/app", ("localhost", "app")),
+        ("registry:5000/app:v1", ("registry:5000", "app:v1")),
+        ("10.0.0.1:5000/app", ("10.0.0.1:5000", "app")),
+    ],
+)
+def test_split_registry(image, expected):
+    assert split_registry(image) == expected
+
+
+@pytest.mark.parametrize(
+    "image, expected",
+    [
+        ("nginx:1.25", f"{MIRROR}/docker-hub-mirror/nginx:1.25"),
+        ("docker.io/library/nginx", f"{MIRROR}/docker-hub-mirror/library/nginx"),
+        (
+            f"quay.io/prometheus/node-exporter@{DIGEST}",
+            f"{MIRROR}/quay-mirror/prometheus/node-exporter@{DIGEST}",
+        ),
+        (
+            f"ghcr.io/org/app:v1@{DIGEST}",
+            f"{MIRROR}/github-mirror/org/app:v1@{DIGEST}",
+        ),
+        ("bitnami/redis:7", f"{MIRROR}/docker-hub-mirror/bitnamilegacy/redis:7"),
+        # registries with ports and unlisted registries are left alone
+        ("registry.local:5000/app:v1", "registry.local:5000/app:v1"),
+        ("localhost:5000/app", "localhost:5000/app"),
+        ("gcr.io/distroless/static", "gcr.io/distroless/static"),
+    ],
+)
+def test_rewrite_default_mirrors(image, expected):
+    assert ImageRewriter(MIRROR, DEFAULT_IMAGE_MIRRORS).rewrite(image) == expected
+
+
+def test_rewrite_registry_with_port():
+    rewriter = ImageRewriter(MIRROR, {"registries": {"registry.local:5000": "local"}})
+    assert (
+        rewriter.rewrite(f"registry.local:5000/team/app@{DIGEST}")
+        == f"{MIRROR}/local/team/app@{DIGEST}"
+    )
+    assert rewriter.rewrite("registry.local/team/app") == "registry.local/team/app"
+
+
+def test_rewrite_is_memoized():
+    rewriter = ImageRewriter(MIRROR, DEFAULT_IMAGE_MIRRORS)
+    rewriter.rewrite("nginx")
+    rewriter.rewrite("nginx")
+    assert rewriter.rewrite.cache_info().hits == 1
@@ -0,0 +1,64 @@
+import copy
+import threading
+import time
+
+from conftest import wait_until
+from kubernetes.client.rest import ApiException
+
+from pve_cloud_ctrl.leader import LeaseElector
+
+
+class FakeCoordinationApi:
+    # in memory lease with resourceVersion checks, counts the writes
+    def __init__(self):
+        self.lease = None
+        self.version = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def read_namespaced_lease(self, name, namespace):
+        with self.lock:
+            if self.lease is None:
+                raise ApiException(status=404)
+            lease = copy.deepcopy(self.lease)
+            lease.metadata.resource_version = str(self.version)
+            return lease
+
+    def create_namespaced_lease(self, namespace, body):
+        with self.lock:
+            if self.lease is not None:
+                raise ApiException(status=409)
+            self.lease, self.version = copy.deepcopy(body), self.version + 1
+            self.writes += 1
+
+    def replace_namespaced_lease(self, name, namespace, body):
+        with self.lock:
+            if body.metadata.resource_version != str(self.version):
+                raise ApiException(status=409)
+            self.lease, self.version = copy.deepcopy(body), self.version + 1
+            self.writes += 1
+
+
+def test_release_stops_renewing():
+    api = FakeCoordinationApi()
+    elector = LeaseElector(
+        api,
+        "lease",
+        "ns",
+        "me",
+        lease_duration=1,
+        renew_deadline=0.5,
+        retry_period=0.01,
+    )
+    elector.start()
+    wait_until(lambda: elector.is_leader and api.writes >= 3)
+
+    elector.release()
+    assert not elector.is_leader
+    assert api.lease.spec.holder_identity is None
+    assert not elector._thread.is_alive()
+
+    writes = api.writes
+    time.sleep(0.1)
+    assert api.writes == writes
+    assert api.lease.spec.holder_identity is None
@@ -0,0 +1,106 @@
+import fnmatch
+import json
+
+import pytest
+
+from pve_cloud_ctrl.policy import HostMatcher, HostPolicy
+
+ENTRIES = [
+    {"zone": "example.com", "names": ["*", "api"], "apex": True},
+    {
+        "zone": "sub.example.org",
+        "names": ["app", "a?c", "[ab]x", "*.deep"],
+        "apex": False,
+    },
+    {"zone": "*.wild.net", "names": ["www"], "apex": True},
+    {"zone": "plain.io", "names": ["svc-*"], "apex": False},
+]
+
+HOSTS = [
+    "example.com",
+    "api.example.com",
+    "a.b.example.com",
+    "example.com.evil.org",
+    "notexample.com",
+    "app.sub.example.org",
+    "abc.sub.example.org",
+    "abbc.sub.example.org",
+    "ax.sub.example.org",
+    "cx.sub.example.org",
+    "x.y.deep.sub.example.org",
+    "deep.sub.example.org",
+    "sub.example.org",
+    "www.eu.wild.net",
+    "www.wild.net",
+    "eu.wild.net",
+    "*.wild.net",
+    "svc-a.plain.io",
+    "svc-.plain.io",
+    "svc.plain.io",
+    "plain.io",
+    "",
+]
+
+
+def fnmatch_matches(entries, host, apex_key):
+    # the loop HostMatcher replaced
+    for entry in entries:
+        for name in entry["names"]:
+            if fnmatch.fnmatch(host, f"{name}.{entry['zone']}"):
+                return True
+        if entry[apex_key] and entry["zone"] == host:
+            return True
+    return False
+
+
+@pytest.mark.parametrize("host", HOSTS)
+def test_host_matcher_matches_fnmatch(host):
+    matcher = HostMatcher(ENTRIES, "apex")
+    assert matcher.matches(host) == fnmatch_matches(ENTRIES, host, "apex")
+
+
+def write_conf(conf_dir, cert_entries, external_domains):
+    with open(conf_dir / "cluster_cert_entries.json", "w") as f:
+        json.dump(cert_entries, f)
+    with open(conf_dir / "external_domains.json", "w") as f:
+        json.dump(external_domains, f)
+
+
+def test_host_policy_reloads_changed_files(tmp_path):
+    write_conf(
+        tmp_path,
+        [{"zone": "example.com", "names": ["app"], "apex_zone_san": False}],
+        [],
+    )
+    policy = HostPolicy(str(tmp_path), check_interval=0)
+    assert policy.host_allowed("app.example.com")
+    assert not policy.host_allowed("web.example.com")
+    assert not policy.host_exposed("app.example.com")
+    old = policy.snapshot()
+
+    write_conf(
+        tmp_path,
+        [{"zone": "example.com", "names": ["web"], "apex_zone_san": False}],
+        [{"zone": "example.com", "names": ["*"], "expose_apex": False}],
+    )
+    assert policy.host_allowed("web.example.com")
+    assert not policy.host_allowed("app.example.com")
+    assert policy.host_exposed("web.example.com")
+
+    # a reader holding the old snapshot keeps both matchers of the old files
+    assert policy.snapshot() is not old
+    assert old.allowed.matches("app.example.com")
+    assert not old.exposed.matches("web.example.com")
+
+
+def test_host_policy_keeps_last_good_conf(tmp_path):
+    write_conf(
+        tmp_path,
+        [{"zone": "example.com", "names": ["app"], "apex_zone_san": False}],
+        [],
+    )
+    policy = HostPolicy(str(tmp_path), check_interval=0)
+
+    with open(tmp_path / "cluster_cert_entries.json", "w") as f:
+        f.write("{not json")
+    assert policy.host_allowed("app.example.com")
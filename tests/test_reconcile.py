@@ -0,0 +1,113 @@
+import dns.name
+import dns.rdataset
+from conftest import (
+    EXPOSED_ZONES,
+    ZONES,
+    bind_a_records,
+    ext_a_records,
+    ext_zone_id,
+)
+from fakes import EXTERNAL_FORWARDED_IP, INTERNAL_PROXY_FIP
+from prometheus_client import REGISTRY
+
+import pve_cloud_ctrl.funcs as funcs
+
+BIND_ZONE = ZONES[1]
+EXT_ZONE = EXPOSED_ZONES[0]
+
+
+def add_bind_record(env, zone, name, address):
+    zone_obj = env.bind.zones[dns.name.from_text(zone)]
+    zone_obj.replace_rdataset(name, dns.rdataset.from_text("IN", "A", 300, address))
+
+
+def test_reconcile_bind_zone_only_writes_differences(env):
+    hosts = [f"a.{BIND_ZONE}", f"b.{BIND_ZONE}"]
+    add_bind_record(env, BIND_ZONE, "b", "10.9.9.9")  # points elsewhere
+
+    updates = env.bind.updates
+    assert funcs.reconcile_bind_zone(BIND_ZONE, hosts, prune=False) == []
+    assert env.bind.updates == updates + 1
+
+    records = bind_a_records(env, BIND_ZONE)
+    assert records[f"a.{BIND_ZONE}"] == {INTERNAL_PROXY_FIP}
+    assert records[f"b.{BIND_ZONE}"] == {INTERNAL_PROXY_FIP}
+
+    # in sync, nothing is sent
+    assert funcs.reconcile_bind_zone(BIND_ZONE, hosts, prune=False) == []
+    assert env.bind.updates == updates + 1
+
+
+def test_reconcile_bind_zone_prunes_only_our_records(env):
+    add_bind_record(env, BIND_ZONE, "orphan", INTERNAL_PROXY_FIP)
+    add_bind_record(env, BIND_ZONE, "foreign", "10.9.9.9")
+
+    assert funcs.reconcile_bind_zone(BIND_ZONE, [f"kept.{BIND_ZONE}"], prune=True) == []
+
+    records = bind_a_records(env, BIND_ZONE)
+    assert f"orphan.{BIND_ZONE}" not in records
+    assert records[f"foreign.{BIND_ZONE}"] == {"10.9.9.9"}
+    assert records[f"kept.{BIND_ZONE}"] == {INTERNAL_PROXY_FIP}
+
+
+def test_reconcile_bind_zone_falls_back_to_replace(env):
+    # the fake isnt authoritative, the transfer fails and so does the blind update
+    errors = funcs.reconcile_bind_zone(
+        "unknown.test.example", ["x.unknown.test.example"], prune=False
+    )
+    assert len(errors) == 1
+    assert "NOTAUTH" in errors[0]
+
+
+def route53_changes():
+    return REGISTRY.get_sample_value(
+        "pve_cloud_ctrl_upstream_duration_seconds_count",
+        {"upstream": "route53", "operation": "change_resource_record_sets"},
+    )
+
+
+def seed_ext_record(env, zone_id, host, address):
+    env.route53.change_resource_record_sets(
+        HostedZoneId=zone_id,
+        ChangeBatch={
+            "Changes": [
+                {
+                    "Action": "UPSERT",
+                    "ResourceRecordSet": {
+                        "Name": host + ".",
+                        "Type": "A",
+                        "TTL": 300,
+                        "ResourceRecords": [{"Value": address}],
+                    },
+                }
+            ]
+        },
+    )
+
+
+def test_reconcile_ext_zone_only_writes_differences(env):
+    zone_id = ext_zone_id(env, EXT_ZONE)
+    hosts = [f"a.{EXT_ZONE}", f"b.{EXT_ZONE}"]
+    seed_ext_record(env, zone_id, f"b.{EXT_ZONE}", "198.51.100.1")
+
+    assert funcs.reconcile_ext_zone(zone_id, hosts, prune=False) == []
+    records = ext_a_records(env, zone_id)
+    assert records[f"a.{EXT_ZONE}"] == {EXTERNAL_FORWARDED_IP}
+    assert records[f"b.{EXT_ZONE}"] == {EXTERNAL_FORWARDED_IP}
+
+    changes = route53_changes()
+    assert funcs.reconcile_ext_zone(zone_id, hosts, prune=False) == []
+    assert route53_changes() == changes
+
+
+def test_reconcile_ext_zone_prunes_only_our_records(env):
+    zone_id = ext_zone_id(env, EXT_ZONE)
+    seed_ext_record(env, zone_id, f"orphan.{EXT_ZONE}", EXTERNAL_FORWARDED_IP)
+    seed_ext_record(env, zone_id, f"foreign.{EXT_ZONE}", "198.51.100.1")
+
+    assert funcs.reconcile_ext_zone(zone_id, [f"kept.{EXT_ZONE}"], prune=True) == []
+
+    records = ext_a_records(env, zone_id)
+    assert f"orphan.{EXT_ZONE}" not in records
+    assert records[f"foreign.{EXT_ZONE}"] == {"198.51.100.1"}
+    assert records[f"kept.{EXT_ZONE}"] == {EXTERNAL_FORWARDED_IP}
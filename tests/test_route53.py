@@ -0,0 +1,228 @@
+import itertools
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+from prometheus_client import REGISTRY
+
+from pve_cloud_ctrl.route53 import Route53Writer, merge_changes
+
+zone_counter = itertools.count()
+
+
+def create_zone(route53):
+    # (hosted zone id, zone name)
+    n = next(zone_counter)
+    name = f"r53-{n}.test.example"
+    zone_id = route53.create_hosted_zone(
+        Name=name, CallerReference=f"route53-test-{n}"
+    )["HostedZone"]["Id"]
+    return zone_id, name
+
+
+def change(action, host, value="192.0.2.10"):
+    return {
+        "Action": action,
+        "ResourceRecordSet": {
+            "Name": host + ".",
+            "Type": "A",
+            "TTL": 300,
+            "ResourceRecords": [{"Value": value}],
+        },
+    }
+
+
+def a_records(route53, zone_id):
+    return {
+        record_set["Name"].removesuffix("."): record_set["ResourceRecords"][0]["Value"]
+        for record_set in route53.list_resource_record_sets(HostedZoneId=zone_id)[
+            "ResourceRecordSets"
+        ]
+        if record_set["Type"] == "A"
+    }
+
+
+class ThrottlingClient:
+    # answers the first failures calls with a throttling error, then passes through
+    def __init__(self, route53, failures, code="Throttling"):
+        self.route53 = route53
+        self.failures = failures
+        self.code = code
+        self.calls = 0
+
+    def change_resource_record_sets(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ClientError(
+                {"Error": {"Code": self.code, "Message": "Rate exceeded"}},
+                "ChangeResourceRecordSets",
+            )
+        return self.route53.change_resource_record_sets(**kwargs)
+
+
+class BlockingClient:
+    # the first call waits for release, so other submissions queue up behind it
+    def __init__(self, route53):
+        self.route53 = route53
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.batches = []
+
+    def change_resource_record_sets(self, **kwargs):
+        if not self.entered.is_set():
+            self.entered.set()
+            self.release.wait(5)
+        self.batches.append(kwargs["ChangeBatch"]["Changes"])
+        return self.route53.change_resource_record_sets(**kwargs)
+
+
+def throttled(code):
+    return (
+        REGISTRY.get_sample_value(
+            "pve_cloud_ctrl_route53_throttled_total", {"code": code}
+        )
+        or 0
+    )
+
+
+def test_throttling_is_retried(env):
+    zone_id, zone = create_zone(env.route53)
+    client = ThrottlingClient(env.route53, failures=2, code="PriorRequestNotComplete")
+    writer = Route53Writer(client, rate=1000, burst=10, base_backoff=0.001)
+
+    before = throttled("PriorRequestNotComplete")
+    writer.submit(zone_id, [change("UPSERT", f"a.{zone}")])
+
+    assert client.calls == 3
+    assert throttled("PriorRequestNotComplete") - before == 2
+    assert f"a.{zone}" in a_records(env.route53, zone_id)
+
+
+def test_throttling_gives_up_after_max_retries(env):
+    zone_id, zone = create_zone(env.route53)
+    client = ThrottlingClient(env.route53, failures=10)
+    writer = Route53Writer(
+        client, rate=1000, burst=10, max_retries=2, base_backoff=0.001
+    )
+
+    with pytest.raises(ClientError) as e:
+        writer.submit(zone_id, [change("UPSERT", f"a.{zone}")])
+
+    assert e.value.response["Error"]["Code"] == "Throttling"
+    assert client.calls == 3
+
+
+def test_rate_limit_spaces_requests(env):
+    zone_id, zone = create_zone(env.route53)
+    writer = Route53Writer(env.route53, rate=20, burst=1)
+
+    start = time.monotonic()
+    for i in range(4):
+        writer.submit(zone_id, [change("UPSERT", f"h{i}.{zone}")])
+
+    assert time.monotonic() - start >= 0.14
+
+
+def submit_in_thread(writer, zone_id, changes, results, key):
+    def run():
+        try:
+            writer.submit(zone_id, changes)
+            results[key] = "ok"
+        except ClientError as e:
+            results[key] = e.response["Error"]["Code"]
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_queued(writer, zone_id, count):
+    deadline = time.monotonic() + 5
+    while len(writer._pending.get(zone_id, ())) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_queued_submissions_are_merged(env):
+    zone_id, zone = create_zone(env.route53)
+    client = BlockingClient(env.route53)
+    writer = Route53Writer(client, rate=1000, burst=10)
+
+    results = {}
+    threads = [
+        submit_in_thread(
+            writer, zone_id, [change("UPSERT", f"first.{zone}")], results, 0
+        )
+    ]
+    client.entered.wait(5)
+    for i in range(1, 5):
+        threads.append(
+            submit_in_thread(
+                writer,
+                zone_id,
+                [change("UPSERT", f"h{i}.{zone}")],
+                results,
+                i,
+            )
+        )
+    wait_queued(writer, zone_id, 4)
+
+    client.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {i: "ok" for i in range(5)}
+    assert [len(batch) for batch in client.batches] == [1, 4]
+    assert len(a_records(env.route53, zone_id)) == 5
+    assert not writer._pending
+
+
+def test_failed_merged_batch_is_resent_per_submission(env):
+    zone_id, zone = create_zone(env.route53)
+    client = BlockingClient(env.route53)
+    writer = Route53Writer(client, rate=1000, burst=10)
+
+    results = {}
+    threads = [
+        submit_in_thread(
+            writer, zone_id, [change("UPSERT", f"first.{zone}")], results, "first"
+        )
+    ]
+    client.entered.wait(5)
+    for key, changes in (
+        ("bad", [change("DELETE", f"missing.{zone}")]),
+        ("a", [change("UPSERT", f"a.{zone}")]),
+        ("b", [change("UPSERT", f"b.{zone}")]),
+    ):
+        threads.append(submit_in_thread(writer, zone_id, changes, results, key))
+        wait_queued(writer, zone_id, len(threads) - 1)
+
+    client.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results["first"] == results["a"] == results["b"] == "ok"
+    # route53 answers InvalidChangeBatch, moto InvalidInput
+    assert results["bad"] in ("InvalidChangeBatch", "InvalidInput")
+    # first alone, the merged batch of three, then each of the three on its own
+    assert [len(batch) for batch in client.batches] == [1, 3, 1, 1, 1]
+    assert set(a_records(env.route53, zone_id)) == {
+        f"first.{zone}",
+        f"a.{zone}",
+        f"b.{zone}",
+    }
+
+
+def test_merge_changes_keeps_the_newest_change_per_record():
+    class Submission:
+        def __init__(self, changes):
+            self.changes = changes
+
+    merged = merge_changes(
+        [
+            Submission([change("UPSERT", "a.example"), change("UPSERT", "b.example")]),
+            Submission([change("DELETE", "a.example")]),
+        ]
+    )
+    assert merged == [change("UPSERT", "b.example"), change("DELETE", "a.example")]
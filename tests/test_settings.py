@@ -0,0 +1,37 @@
+import pytest
+
+from pve_cloud_ctrl.settings import Settings
+
+SHARDED = {"STACK_FQDN": "stack.test", "PG_CONN_STR": "sqlite://", "SHARD_COUNT": "3"}
+
+
+def test_adm_ignores_the_shard_env():
+    conf = Settings.from_env({**SHARDED, "HOSTNAME": "adm-7d9f8c6b5-x2x4q"})
+    assert conf.validate("adm") is conf
+    assert conf.shard_index is None
+
+
+@pytest.mark.parametrize(
+    "env, index",
+    [
+        ({"SHARD_INDEX": "2"}, 2),
+        ({"JOB_COMPLETION_INDEX": "1"}, 1),
+        ({"POD_NAME": "watcher-1"}, 1),
+        ({"SHARD_COUNT": "1", "HOSTNAME": "watcher-7d9f8c6b5-x2x4q"}, 0),
+    ],
+)
+def test_watcher_and_cron_resolve_the_shard(env, index):
+    for component in ("watcher", "cron"):
+        conf = Settings.from_env({**SHARDED, **env})
+        validated = conf.validate(component, {**SHARDED, **env})
+        assert validated.shard_index == index
+        assert conf.shard_index is None  # snapshots never change
+
+
+@pytest.mark.parametrize(
+    "env", [{"SHARD_INDEX": "3"}, {"SHARD_INDEX": "x"}, {"HOSTNAME": "watcher"}]
+)
+def test_invalid_shard_fails_validation(env):
+    conf = Settings.from_env({**SHARDED, **env})
+    with pytest.raises(Exception, match="watcher: "):
+        conf.validate("watcher", {**SHARDED, **env})
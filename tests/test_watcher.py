@@ -0,0 +1,38 @@
+from conftest import wait_until
+from fakes import FakeCluster, FakeCoreV1Api
+from kubernetes.client.rest import ApiException
+
+from pve_cloud_ctrl.watcher import NamespaceInformer
+
+
+class Stop(BaseException):
+    pass
+
+
+def test_expired_watch_relists_and_queues_missed_namespaces():
+    cluster = FakeCluster()
+    cluster.add_namespace("existing")
+
+    added = []
+    informer = NamespaceInformer(FakeCoreV1Api(cluster), added.append)
+
+    watches = []
+
+    def watch():
+        watches.append(informer.resource_version)
+        if len(watches) == 1:
+            # created while the watch was gone, then the resource version expired
+            cluster.add_namespace("missed")
+            raise ApiException(status=410, reason="Gone")
+        raise Stop()
+
+    informer.watch = watch
+    try:
+        informer.run()
+    except Stop:
+        pass
+
+    assert len(watches) == 2
+    assert set(informer.store) == {"existing", "missed"}
+    # existing namespaces on startup are left to the cron
+    wait_until(lambda: added == ["missed"])
@@ -0,0 +1,27 @@
+from pve_cloud_ctrl.zones import ZoneIndex
+
+
+def test_lookup_matches_whole_labels_only():
+    index = ZoneIndex([("ample.com", 1)])
+    assert index.lookup("ample.com") == ("ample.com", 1)
+    assert index.lookup("www.ample.com") == ("ample.com", 1)
+    assert index.lookup("example.com") is None
+    assert index.lookup("foo.example.com") is None
+
+
+def test_lookup_returns_most_specific_zone():
+    index = ZoneIndex([("example.com", "parent"), ("sub.example.com", "child")])
+    assert index.lookup("a.sub.example.com") == ("sub.example.com", "child")
+    assert index.lookup("sub.example.com") == ("sub.example.com", "child")
+    assert index.lookup("other.example.com") == ("example.com", "parent")
+    assert index.lookup("com") is None
+
+
+def test_lookup_ignores_case_and_trailing_dot():
+    # route53 zone names are fully qualified
+    index = ZoneIndex([("Example.COM.", "Z123")])
+    assert index.lookup("www.example.com") == ("Example.COM.", "Z123")
+    assert index.lookup("WWW.EXAMPLE.COM.") == ("Example.COM.", "Z123")
+    assert "example.com" in index
+    assert len(index) == 1
+    assert list(index) == [("Example.COM.", "Z123")]